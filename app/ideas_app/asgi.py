@@ -13,4 +13,29 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ideas_app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once get_asgi_application has set Django up
+from ideas_app.async_graphql import AsyncGraphQLHandler  # NOQA: E402
+from ideas_app.export import StreamingASGIHandler  # NOQA: E402
+from ideas_app.schema import schema  # NOQA: E402
+from ideas_app.websocket import GraphQLWebSocketServer  # NOQA: E402
+
+ASYNC_GRAPHQL_PATH = '/api/async/'
+SUBSCRIPTIONS_PATH = '/api/subscriptions/'
+EXPORT_PATH = '/api/export/'
+
+graphql_application = AsyncGraphQLHandler(schema)
+websocket_application = GraphQLWebSocketServer(schema,
+                                               graphql_application.pool)
+export_application = StreamingASGIHandler()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == ASYNC_GRAPHQL_PATH:
+        return await graphql_application(scope, receive, send)
+    if scope['type'] == 'websocket' and scope['path'] == SUBSCRIPTIONS_PATH:
+        return await websocket_application(scope, receive, send)
+    if scope['type'] == 'http' and scope['path'] == EXPORT_PATH:
+        return await export_application(scope, receive, send)
+    return await django_application(scope, receive, send)
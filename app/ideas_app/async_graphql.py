@@ -0,0 +1,234 @@
+import asyncio
+import copy
+import json
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import RequestAborted
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+from django.http import HttpResponse
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, instantiate_middleware
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from ideas_app.auth import authenticate_request, needs_authentication
+from ideas_app.complexity import analyze, report_cost
+from ideas_app.db_router import routed
+from ideas_app.instrumentation import (SQLRecorder, get_operation_name,
+                                       report_sql)
+from ideas_app.persisted_queries import (PersistedQueries,
+                                         PersistedQueryHashMismatch,
+                                         PersistedQueryNotAllowed,
+                                         PersistedQueryNotFound)
+from ideas_app.tracing import phase, start_trace
+from ideas_app.views import document_cache_backend
+
+
+def response_key(selection):
+    return (selection.alias or selection.name).value
+
+
+def split_operation(document_ast, operation):
+    """
+    One document per top-level field of a query, or None when the fields
+    can't be resolved independently: mutations run serially and fragments
+    or repeated response keys need the executor to merge their results
+    """
+    selections = operation.selection_set.selections
+    keys = [response_key(selection) for selection in selections
+            if isinstance(selection, ast.Field)]
+    if (operation.operation != 'query' or len(selections) < 2
+            or len(keys) != len(selections) or len(set(keys)) != len(keys)):
+        return None
+    fragments = [definition for definition in document_ast.definitions
+                 if isinstance(definition, ast.FragmentDefinition)]
+    return [
+        ast.Document(definitions=[ast.OperationDefinition(
+            operation=operation.operation,
+            name=operation.name,
+            variable_definitions=operation.variable_definitions,
+            directives=operation.directives,
+            selection_set=ast.SelectionSet(selections=[selection]),
+        )] + fragments)
+        for selection in selections
+    ]
+
+
+async def run_in_pool(pool, function, *args):
+    """
+    Awaits `function` run in a worker of `pool`, which closes the database
+    connections that are no longer usable before and after
+    """
+    def run():
+        close_old_connections()
+        try:
+            return function(*args)
+        finally:
+            close_old_connections()
+    return await asyncio.get_running_loop().run_in_executor(pool, run)
+
+
+class AsyncGraphQLHandler(ASGIHandler):
+    """
+    ASGI GraphQL endpoint that resolves the top-level fields of a query
+    concurrently, each one in a worker of a bounded thread pool with its
+    own database connection. The event loop never touches the ORM.
+    Persisted queries, the document cache, query cost admission, SQL
+    instrumentation, tracing and replica routing work as in
+    IdeasGraphQLView
+    """
+
+    def __init__(self, schema, max_workers=None):
+        super().__init__()
+        self.schema = schema
+        self.pool = ThreadPoolExecutor(
+            max_workers or settings.ASYNC_GRAPHQL['MAX_WORKERS'],
+            thread_name_prefix='graphql'
+        )
+        self.persisted_queries = PersistedQueries.from_settings()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            body_file = await self.read_body(receive)
+        except RequestAborted:
+            return
+        request, error_response = self.create_request(scope, body_file)
+        if request is None:
+            await self.send_response(error_response, send)
+            return
+        await self.send_response(await self.graphql_response(request), send)
+
+    @staticmethod
+    def json_response(payload, status=200):
+        return HttpResponse(json.dumps(payload, separators=(',', ':')),
+                            status=status, content_type='application/json')
+
+    def error_response(self, message, status):
+        return self.json_response({'errors': [{'message': message}]}, status)
+
+    async def graphql_response(self, request):
+        if request.method != 'POST':
+            return self.error_response('Only POST requests are supported',
+                                       405)
+        try:
+            data = json.loads(request.body or b'{}')
+            variables = data.get('variables') or {}
+            if isinstance(variables, str):
+                variables = json.loads(variables)
+        except (ValueError, AttributeError):
+            return self.error_response('POST body is not a JSON object', 400)
+        if not isinstance(variables, dict):
+            return self.error_response('Variables must be a JSON object', 400)
+
+        try:
+            query = self.persisted_queries.resolve(data.get('query'),
+                                                   data.get('extensions'))
+        except PersistedQueryNotFound as error:
+            return self.error_response(str(error), 200)
+        except PersistedQueryHashMismatch as error:
+            return self.error_response(str(error), 400)
+        except PersistedQueryNotAllowed as error:
+            return self.error_response(str(error), 403)
+        if not query:
+            return self.error_response('Must provide query string.', 400)
+
+        request.graphql_extensions = {}
+        request.graphql_operation = data.get('operationName') or 'unknown'
+        # One per executed document, shared by the copies of the request
+        request.sql_recorders = []
+        request.graphql_tracer = start_trace()
+        start = perf_counter()
+        result = await self.execute(request, query, variables,
+                                    data.get('operationName'))
+        if request.sql_recorders:
+            recorder = SQLRecorder()
+            for document_recorder in request.sql_recorders:
+                recorder.merge(document_recorder)
+            report_sql(request, request.graphql_operation, recorder,
+                       (perf_counter() - start) * 1000)
+        if request.graphql_tracer is not None:
+            request.graphql_extensions['tracing'] = (
+                request.graphql_tracer.as_dict()
+            )
+        response = {}
+        if result.errors:
+            response['errors'] = [GraphQLView.format_error(error)
+                                  for error in result.errors]
+        if not result.invalid:
+            response['data'] = result.data
+        if request.graphql_extensions:
+            response['extensions'] = request.graphql_extensions
+        return self.json_response(response, 400 if result.invalid else 200)
+
+    async def execute(self, request, query, variables, operation_name):
+        try:
+            document = document_cache_backend.document_from_string(
+                self.schema, query, tracer=request.graphql_tracer
+            )
+        except Exception as error:
+            return ExecutionResult(errors=[error], invalid=True)
+        if document.validation_errors:
+            return ExecutionResult(errors=document.validation_errors,
+                                   invalid=True)
+        with phase(request.graphql_tracer, 'validation'):
+            query_cost = analyze(self.schema, document.document_ast,
+                                 operation_name, variables)
+        errors = report_cost(query_cost, request.graphql_extensions)
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True)
+        request.graphql_operation = get_operation_name(document.document_ast,
+                                                       operation_name)
+
+        request.user = AnonymousUser()
+        if needs_authentication(request):
+            request.jwt_user = await run_in_pool(
+                self.pool, authenticate_request, request
+            )
+            request.user = request.jwt_user or request.user
+
+        document_ast = document.document_ast
+        operation = get_operation_ast(document_ast, operation_name)
+        documents = operation and split_operation(document_ast, operation)
+        if not documents:
+            return await run_in_pool(self.pool, self.execute_document,
+                                     request, document_ast, variables,
+                                     operation_name)
+
+        results = await asyncio.gather(*(
+            run_in_pool(self.pool, self.execute_document, copy.copy(request),
+                        field_document, variables, operation_name)
+            for field_document in documents
+        ))
+        data, errors = {}, []
+        for selection, result in zip(operation.selection_set.selections,
+                                     results):
+            data[response_key(selection)] = (result.data or {}).get(
+                response_key(selection)
+            )
+            errors += result.errors or []
+        return ExecutionResult(data=data, errors=errors or None)
+
+    def execute_document(self, request, document_ast, variables,
+                         operation_name):
+        middleware = list(instantiate_middleware(graphene_settings.MIDDLEWARE))
+        if request.graphql_tracer is not None:
+            middleware.append(request.graphql_tracer)
+        recording = nullcontext()
+        if settings.SQL_INSTRUMENTATION['ENABLED']:
+            recorder = SQLRecorder()
+            request.sql_recorders.append(recorder)
+            recording = recorder.record()
+        with recording, routed(request, document_ast, operation_name):
+            return execute(
+                self.schema, document_ast,
+                context_value=request,
+                variable_values=variables,
+                operation_name=operation_name,
+                middleware=middleware,
+            )
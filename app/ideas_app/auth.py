@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.middleware import JSONWebTokenMiddleware
+from graphql_jwt.settings import jwt_settings
+from graphql_jwt.utils import (get_http_authorization, get_payload,
+                               get_user_by_payload)
+
+logger = logging.getLogger(__name__)
+
+# Process wide counters: `decodes` verified JWTs, `token_cache_hits`
+# requests authenticated from the token cache and `memoized` resolvers
+# that reused the request's authentication instead of trying again
+auth_stats = Counter()
+
+
+def token_key(token):
+    return f"jwt:{hashlib.sha256(token.encode('utf-8')).hexdigest()}"
+
+
+def cached_user(token):
+    user_id = cache.get(token_key(token))
+    if user_id is None:
+        return None
+    auth_stats['token_cache_hits'] += 1
+    return get_user_model().objects.filter(pk=user_id,
+                                           is_active=True).first()
+
+
+def cache_user(token, payload, user):
+    timeout = settings.JWT_USER_CACHE_TIMEOUT
+    expires = payload.get('exp')
+    if expires is not None:
+        timeout = min(timeout, expires - time.time())
+    if timeout > 0:
+        cache.set(token_key(token), user.pk, timeout)
+
+
+def needs_authentication(request):
+    is_anonymous = not hasattr(request, 'user') or request.user.is_anonymous
+    return is_anonymous and get_http_authorization(request) is not None
+
+
+def authenticate_request(request):
+    """
+    User of the request's Authorization token, or None when the token is
+    invalid or its user is disabled, as GraphQLAuthBackend does. Verified
+    tokens are cached for JWT_USER_CACHE_TIMEOUT seconds (never past their
+    expiration), so later requests only load the user by primary key
+    """
+    token = get_http_authorization(request)
+    if settings.JWT_USER_CACHE_TIMEOUT:
+        user = cached_user(token)
+        if user is not None:
+            return user
+
+    auth_stats['decodes'] += 1
+    try:
+        payload = get_payload(token, request)
+        user = get_user_by_payload(payload)
+    except JSONWebTokenError as error:
+        logger.debug('JWT authentication failed: %s', error)
+        return None
+    if user is not None and settings.JWT_USER_CACHE_TIMEOUT:
+        cache_user(token, payload, user)
+    return user
+
+
+def viewer_of(request):
+    """
+    User of the request, authenticated ahead of the execution as
+    MemoizedJSONWebTokenMiddleware would, which then reuses the outcome
+    """
+    if needs_authentication(request):
+        request.jwt_user = authenticate_request(request)
+        if request.jwt_user is not None:
+            request.user = request.jwt_user
+    return request.user
+
+
+class MemoizedJSONWebTokenMiddleware(JSONWebTokenMiddleware):
+    """
+    JSONWebTokenMiddleware authenticating once per request: the outcome,
+    user or None, is memoized on the context, so fields after a failed
+    authentication don't verify the token and query the user again.
+    Tokens passed as arguments (JWT_ALLOW_ARGUMENT) keep the per path
+    behaviour of the parent class
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        if jwt_settings.JWT_ALLOW_ARGUMENT:
+            return super().resolve(next, root, info, **kwargs)
+
+        context = info.context
+        if (needs_authentication(context)
+                and self.authenticate_context(info, **kwargs)):
+            if hasattr(context, 'jwt_user'):
+                auth_stats['memoized'] += 1
+            else:
+                context.jwt_user = authenticate_request(context)
+            if context.jwt_user is not None:
+                context.user = context.jwt_user
+        return next(root, info, **kwargs)
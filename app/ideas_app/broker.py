@@ -0,0 +1,143 @@
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rx.subjects import Subject
+
+
+class Subscription:
+    """
+    Mailbox of one subscriber, owned by its event loop. It holds at most
+    `size` messages: a message with the key of one already waiting
+    replaces it (coalescing), and when it is full the oldest message is
+    dropped and counted in `missed`, so a slow consumer never blocks the
+    publishers nor grows without bound
+    """
+
+    def __init__(self, broker, channels, loop, size):
+        self.broker = broker
+        self.channels = set(channels)
+        self.loop = loop
+        self.size = size
+        self.pending = OrderedDict()
+        self.missed = 0
+        self.ready = asyncio.Event()
+        self.subject = Subject()
+
+    def deliver(self, key, message):
+        if key in self.pending:
+            del self.pending[key]
+        elif len(self.pending) >= self.size:
+            self.pending.popitem(last=False)
+            self.missed += 1
+        self.pending[key] = message
+        self.ready.set()
+
+    async def get(self):
+        """
+        Oldest waiting message, with the number of messages dropped
+        before it
+        """
+        while not self.pending:
+            self.ready.clear()
+            await self.ready.wait()
+        _, message = self.pending.popitem(last=False)
+        missed, self.missed = self.missed, 0
+        return message, missed
+
+    def add_channels(self, channels):
+        self.broker.add_channels(self, channels)
+
+    def remove_channels(self, channels):
+        self.broker.remove_channels(self, channels)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+        self.subject.on_completed()
+
+
+class Broker(ABC):
+    """
+    Pub/sub between the code that commits changes and the subscriptions
+    of this process. Subclasses implement `publish`: InMemoryBroker
+    dispatches right away, one backed by an external broker sends the
+    message there and calls `dispatch` with every message it receives,
+    so subscribers in all processes get it
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.subscriptions = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channels, loop):
+        subscription = Subscription(self, channels, loop, self.queue_size)
+        self.add_channels(subscription, channels)
+        return subscription
+
+    def add_channels(self, subscription, channels):
+        with self.lock:
+            for channel in channels:
+                subscription.channels.add(channel)
+                self.subscriptions[channel].add(subscription)
+
+    def remove_channels(self, subscription, channels):
+        with self.lock:
+            for channel in channels:
+                subscription.channels.discard(channel)
+                subscribers = self.subscriptions.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[channel]
+
+    def unsubscribe(self, subscription):
+        self.remove_channels(subscription, list(subscription.channels))
+
+    def dispatch(self, channel, key, message):
+        """
+        Hands the message to the local subscribers of `channel`, from any
+        thread
+        """
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            if not subscription.loop.is_closed():
+                subscription.loop.call_soon_threadsafe(
+                    subscription.deliver, key, message
+                )
+
+    @abstractmethod
+    def publish(self, channel, key, message):
+        """
+        Sends `message` to the subscribers of `channel`, coalescing with
+        the waiting message of the same `key`
+        """
+
+
+class InMemoryBroker(Broker):
+    """
+    Delivers messages within this process only
+    """
+
+    def publish(self, channel, key, message):
+        self.dispatch(channel, key, message)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            options = settings.SUBSCRIPTIONS
+            _broker = import_string(options['BROKER'])(
+                queue_size=options['QUEUE_SIZE']
+            )
+    return _broker
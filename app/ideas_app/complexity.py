@@ -0,0 +1,203 @@
+from collections import namedtuple
+
+from django.conf import settings
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import (GraphQLList, GraphQLNonNull,
+                                     get_named_type)
+from graphql.validation.rules.base import ValidationRule
+
+from ideas_app.pagination import DEFAULT_PAGE_SIZE
+
+QueryCost = namedtuple('QueryCost', ['depth', 'cost'])
+
+
+class CostAnalysis:
+    """
+    Estimates the depth and cost of an operation from its AST.
+
+    Every field costs its weight (QUERY_COST['WEIGHTS'], default 1) times
+    the number of rows its parents may return: `first` for connections,
+    QUERY_COST['LIST_SIZES'] for plain lists. Variables that are not
+    given take their default value
+    """
+
+    def __init__(self, schema, document_ast, variables=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.options = settings.QUERY_COST
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+
+    def page_size(self, parent_type, field, variable_defaults):
+        for argument in field.arguments:
+            if argument.name.value not in ('first', 'last'):
+                continue
+            value = argument.value
+            if isinstance(value, ast.Variable):
+                name = value.name.value
+                value = self.variables.get(name,
+                                           variable_defaults.get(name))
+                return value if isinstance(value, int) else DEFAULT_PAGE_SIZE
+            if isinstance(value, ast.IntValue):
+                return int(value.value)
+        return self.options['LIST_SIZES'].get(
+            f'{parent_type.name}.{field.name.value}', DEFAULT_PAGE_SIZE
+        )
+
+    def rows(self, parent_type, field, field_type, variable_defaults):
+        if 'edges' in getattr(get_named_type(field_type), 'fields', {}):
+            return max(self.page_size(parent_type, field, variable_defaults),
+                       0)
+        if isinstance(field_type, GraphQLNonNull):
+            field_type = field_type.of_type
+        is_list = isinstance(field_type, GraphQLList)
+        if is_list and field.name.value != 'edges':
+            return self.options['LIST_SIZES'].get(
+                f'{parent_type.name}.{field.name.value}',
+                self.options['DEFAULT_LIST_SIZE']
+            )
+        return 1
+
+    def selection_set(self, selection_set, parent_type, multiplier,
+                      variable_defaults, visited_fragments=()):
+        cost, depth = 0, 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in visited_fragments:
+                    continue
+                fragment_type = self.schema.get_type(
+                    fragment.type_condition.name.value
+                )
+                fragment_cost, fragment_depth = self.selection_set(
+                    fragment.selection_set, fragment_type, multiplier,
+                    variable_defaults, visited_fragments + (name,)
+                )
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = self.schema.get_type(
+                        selection.type_condition.name.value
+                    )
+                fragment_cost, fragment_depth = self.selection_set(
+                    selection.selection_set, fragment_type, multiplier,
+                    variable_defaults, visited_fragments
+                )
+            else:
+                fragment_cost, fragment_depth = self.field(
+                    selection, parent_type, multiplier, variable_defaults,
+                    visited_fragments
+                )
+            cost += fragment_cost
+            depth = max(depth, fragment_depth)
+        return cost, depth
+
+    def field(self, field, parent_type, multiplier, variable_defaults,
+              visited_fragments):
+        name = field.name.value
+        field_def = getattr(parent_type, 'fields', {}).get(name)
+        # Introspection is answered from the schema, it never hits the db
+        if name.startswith('__') or field_def is None:
+            return 0, 0
+        weight = self.options['WEIGHTS'].get(f'{parent_type.name}.{name}', 1)
+        cost = multiplier * weight
+        if not field.selection_set:
+            return cost, 1
+        rows = self.rows(parent_type, field, field_def.type,
+                         variable_defaults)
+        children_cost, children_depth = self.selection_set(
+            field.selection_set, get_named_type(field_def.type),
+            multiplier * rows, variable_defaults, visited_fragments
+        )
+        return cost + children_cost, children_depth + 1
+
+    def operation(self, operation):
+        root_type = {
+            'query': self.schema.get_query_type,
+            'mutation': self.schema.get_mutation_type,
+            'subscription': self.schema.get_subscription_type,
+        }[operation.operation]()
+        variable_defaults = {
+            definition.variable.name.value: (
+                int(definition.default_value.value)
+                if isinstance(definition.default_value, ast.IntValue)
+                else None
+            )
+            for definition in operation.variable_definitions or []
+        }
+        cost, depth = self.selection_set(operation.selection_set, root_type,
+                                         1, variable_defaults)
+        return QueryCost(depth=depth, cost=cost)
+
+
+def operation_definitions(document_ast, operation_name=None):
+    return [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition) and (
+            operation_name is None
+            or (definition.name and definition.name.value == operation_name)
+        )
+    ]
+
+
+def analyze(schema, document_ast, operation_name=None, variables=None):
+    """
+    Depth and cost of the operation that will run, or the most expensive
+    one when no operation name is given
+    """
+    analysis = CostAnalysis(schema, document_ast, variables)
+    costs = [analysis.operation(operation) for operation
+             in operation_definitions(document_ast, operation_name)]
+    if not costs:
+        return QueryCost(depth=0, cost=0)
+    return QueryCost(depth=max(cost.depth for cost in costs),
+                     cost=max(cost.cost for cost in costs))
+
+
+def over_budget_errors(query_cost, nodes=None):
+    options = settings.QUERY_COST
+    errors = []
+    if query_cost.depth > options['MAX_DEPTH']:
+        errors.append(GraphQLError(
+            f"Query depth {query_cost.depth} exceeds the maximum depth "
+            f"of {options['MAX_DEPTH']}", nodes
+        ))
+    if query_cost.cost > options['MAX_COST']:
+        errors.append(GraphQLError(
+            f"Query cost {query_cost.cost} exceeds the maximum cost "
+            f"of {options['MAX_COST']}", nodes
+        ))
+    return errors
+
+
+def report_cost(query_cost, extensions):
+    """
+    Adds the cost of the operation to the response extensions and returns
+    the errors of the limits it exceeds
+    """
+    extensions['cost'] = {
+        'depth': query_cost.depth,
+        'estimated': query_cost.cost,
+        'maximum': settings.QUERY_COST['MAX_COST'],
+    }
+    return over_budget_errors(query_cost)
+
+
+class QueryCostRule(ValidationRule):
+    """
+    Rejects operations deeper or costlier than QUERY_COST allows, with
+    variables at their defaults. Documents are validated once and cached,
+    so IdeasGraphQLView checks again with the variables of each request
+    """
+
+    def enter_OperationDefinition(self, node, *args):
+        analysis = CostAnalysis(self.context.get_schema(),
+                                self.context.get_ast())
+        for error in over_budget_errors(analysis.operation(node), [node]):
+            self.context.report_error(error)
+        return False
@@ -0,0 +1,93 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from ideas_app.auth import viewer_of
+
+_reads = threading.local()
+
+
+def pinned_key(user_id):
+    return f'db-primary:user:{user_id}'
+
+
+def pin_to_primary(user):
+    """
+    Sends the reads of `user` to the primary for STICKY_SECONDS, so the
+    replicas' lag can't hide the rows they have just written
+    """
+    if user.is_authenticated and settings.DATABASE_REPLICAS['ALIASES']:
+        cache.set(pinned_key(user.pk), True,
+                  settings.DATABASE_REPLICAS['STICKY_SECONDS'])
+
+
+def is_pinned(user):
+    return user.is_authenticated and bool(cache.get(pinned_key(user.pk)))
+
+
+@contextmanager
+def reading_from(alias):
+    """
+    Sends the reads of the current thread to `alias` during the block
+    """
+    previous = getattr(_reads, 'alias', None)
+    _reads.alias = alias
+    try:
+        yield
+    finally:
+        _reads.alias = previous
+
+
+def read_alias(request, operation_type):
+    """
+    Database the reads of an `operation_type` operation go to: a random
+    replica for queries, unless the viewer is pinned, else the primary
+    """
+    aliases = settings.DATABASE_REPLICAS['ALIASES']
+    if (operation_type != 'query' or not aliases
+            or is_pinned(viewer_of(request))):
+        return DEFAULT_DB_ALIAS
+    return random.choice(aliases)
+
+
+@contextmanager
+def routed(request, document_ast, operation_name):
+    """
+    Routes the reads of the operation executed in the block, and pins
+    the viewer of a mutation to the primary once it is done. The alias
+    is kept as request.db_read_alias
+    """
+    operation = get_operation_ast(document_ast, operation_name)
+    operation_type = operation.operation if operation else None
+    request.db_read_alias = read_alias(request, operation_type)
+    try:
+        with reading_from(request.db_read_alias):
+            yield
+    finally:
+        if operation_type == 'mutation':
+            pin_to_primary(request.user)
+
+
+class ReplicaRouter:
+    """
+    Writes go to the primary, and so do reads outside of routed() and
+    inside transactions, which must see their own writes
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(_reads, 'alias', None)
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
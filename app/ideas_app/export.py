@@ -0,0 +1,119 @@
+import json
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+
+from ideas_app.auth import viewer_of
+from ideas_app.db_router import read_alias
+from ideas_app.ideas.models import ArchivedIdea, Idea
+from ideas_app.users.models import Follow
+
+
+def export_rows(user, chunk_size, using):
+    """
+    `user` followed by their ideas, archived ones first, then followers
+    and follows (pending ones included), as dicts with a `type`. Each
+    query is read `chunk_size` rows at a time from the `using` database,
+    so memory doesn't grow with the number of rows
+    """
+    yield {'type': 'user', 'id': user.id, 'username': user.username,
+           'exported_on': timezone.now().isoformat()}
+    # Archived ideas are older than every idea left in ideas_idea
+    for model in (ArchivedIdea, Idea):
+        ideas = model.objects.using(using).filter(author=user).order_by(
+            'created_on', 'id'
+        ).values_list('id', 'text', 'visibility', 'created_on')
+        for idea_id, text, visibility, created_on in ideas.iterator(
+                chunk_size=chunk_size):
+            yield {'type': 'idea', 'id': idea_id, 'text': text,
+                   'visibility': visibility,
+                   'created_on': created_on.isoformat()}
+    follows = Follow.objects.using(using).order_by('id')
+    for kind, rows in (
+        ('follower', follows.filter(user=user).values_list(
+            'follower_id', 'follower__username', 'approved'
+        )),
+        ('follow', follows.filter(follower=user).values_list(
+            'user_id', 'user__username', 'approved'
+        )),
+    ):
+        for user_id, username, approved in rows.iterator(
+                chunk_size=chunk_size):
+            yield {'type': kind, 'user_id': user_id, 'username': username,
+                   'approved': approved}
+
+
+def ndjson(rows, lines_per_chunk):
+    """
+    `rows` as newline delimited JSON, in chunks of `lines_per_chunk`
+    lines
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, separators=(',', ':')) + '\n')
+        if len(lines) == lines_per_chunk:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+@require_GET
+def export_view(request):
+    """
+    Streams the viewer's export as NDJSON, read from a replica unless they
+    wrote recently
+    """
+    viewer = viewer_of(request)
+    if viewer.is_anonymous:
+        return JsonResponse(
+            {'errors': [{'message': 'Authentication required'}]}, status=401
+        )
+    chunk_size = settings.EXPORT['CHUNK_SIZE']
+    response = StreamingHttpResponse(
+        ndjson(export_rows(viewer, chunk_size, read_alias(request, 'query')),
+               chunk_size),
+        content_type='application/x-ndjson'
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{viewer.username}.ndjson"'
+    )
+    return response
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    Django's ASGI handler, except that streaming responses are iterated
+    in the thread that ran the view: Django 3.0 iterates them on the event
+    loop, where generators reading the database fail
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [(header.encode('ascii'), value.encode('latin1'))
+                   for header, value in response.items()]
+        headers += [
+            (b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+            for cookie in response.cookies.values()
+        ]
+        await send({'type': 'http.response.start',
+                    'status': response.status_code, 'headers': headers})
+        next_part = sync_to_async(partial(next, iter(response), None),
+                                  thread_sensitive=True)
+        try:
+            while True:
+                part = await next_part()
+                if part is None:
+                    break
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk,
+                                'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
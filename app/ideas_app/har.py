@@ -0,0 +1,152 @@
+import json
+import random
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from graphql import parse
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.language.visitor import Visitor, visit
+from graphql_jwt.shortcuts import get_token
+
+from ideas_app.ideas.models import Idea
+from ideas_app.instrumentation import get_operation_name
+from ideas_app.users.models import AppUser, Follow
+
+# Arguments holding ids recorded against the capture's database, and what
+# a replaying user needs in their place
+ID_ARGUMENTS = {
+    'author': 'followee',
+    'userId': 'stranger',
+    'followerId': 'follower',
+    'followRequestId': 'follow_request',
+    'ideaId': 'idea',
+}
+
+
+class HarRequest:
+    """
+    GraphQL request recorded in a HAR capture
+    """
+
+    def __init__(self, path, headers, payload):
+        self.path = path
+        self.headers = headers
+        self.payload = payload
+        self.operation = get_operation_name(parse(payload['query']),
+                                        payload.get('operationName'))
+
+    @property
+    def authenticated(self):
+        return any(name.lower() == 'authorization' for name in self.headers)
+
+
+def load_har(path):
+    """
+    GraphQL POSTs of a HAR file, in the order they were captured
+    """
+    with open(path) as har_file:
+        entries = json.load(har_file)['log']['entries']
+    requests = []
+    for entry in entries:
+        request = entry['request']
+        text = (request.get('postData') or {}).get('text')
+        if request['method'] != 'POST' or not text:
+            continue
+        payload = json.loads(text)
+        if 'query' not in payload:
+            continue
+        headers = {header['name']: header['value']
+                   for header in request['headers']}
+        requests.append(HarRequest(urlsplit(request['url']).path, headers,
+                                   payload))
+    return requests
+
+
+class IdSubstitution(Visitor):
+    def __init__(self, session):
+        self.session = session
+
+    def enter_Argument(self, node, *args):
+        if (node.name.value in ID_ARGUMENTS
+                and isinstance(node.value, (ast.StringValue, ast.IntValue))):
+            new_value = self.session.id_for(node.name.value, node.value.value)
+            node.value = ast.StringValue(value=str(new_value))
+
+
+class ReplaySession:
+    """
+    One replay of the capture as `user`: recorded JWTs are replaced by one
+    of the user and recorded ids by rows created or picked for them, the
+    same recorded id always mapping to the same new one, so a follow and
+    its unfollow still match
+    """
+
+    def __init__(self, user, user_ids, rand=random):
+        self.user = user
+        self.user_ids = user_ids
+        self.rand = rand
+        self.token = get_token(user)
+        self.ids = {}
+        self.related = {user.id} | set(Follow.objects.filter(
+            follower=user
+        ).values_list('user_id', flat=True)) | set(Follow.objects.filter(
+            user=user
+        ).values_list('follower_id', flat=True))
+
+    def id_for(self, argument, recorded_id):
+        key = argument, recorded_id
+        if key not in self.ids:
+            self.ids[key] = getattr(self, f'new_{ID_ARGUMENTS[argument]}')()
+        return self.ids[key]
+
+    def new_stranger(self):
+        # Falls back to a new user once everybody is related
+        for _ in range(100):
+            user_id = self.rand.choice(self.user_ids)
+            if user_id not in self.related:
+                self.related.add(user_id)
+                return user_id
+        name = f'replay_{uuid4().hex[:12]}'
+        stranger = AppUser.objects.create(username=name,
+                                          email=f'{name}@email.com')
+        self.related.add(stranger.id)
+        return stranger.id
+
+    def new_followee(self):
+        followee_id = Follow.objects.filter(
+            follower=self.user, approved=True
+        ).values_list('user_id', flat=True).first()
+        if followee_id is None:
+            followee_id = Follow.objects.create(
+                user_id=self.new_stranger(), follower=self.user,
+                approved=True
+            ).user_id
+        return followee_id
+
+    def new_follower(self):
+        return Follow.objects.create(user=self.user,
+                                     follower_id=self.new_stranger(),
+                                     approved=True).follower_id
+
+    def new_follow_request(self):
+        return Follow.objects.create(user=self.user,
+                                     follower_id=self.new_stranger()).id
+
+    def new_idea(self):
+        return Idea.objects.create(text='replayed idea', author=self.user).id
+
+    def prepare(self, har_request):
+        """
+        Headers and JSON body to send for `har_request`
+        """
+        # Parsed again: the substitution edits the document in place
+        document = parse(har_request.payload['query'])
+        visit(document, IdSubstitution(self))
+        headers = {name: value for name, value in har_request.headers.items()
+                   if name.lower() not in ('authorization', 'cookie')}
+        if har_request.authenticated:
+            headers['Authorization'] = f'JWT {self.token}'
+        headers['Content-Type'] = 'application/json'
+        payload = dict(har_request.payload, query=print_ast(document))
+        return headers, json.dumps(payload).encode()
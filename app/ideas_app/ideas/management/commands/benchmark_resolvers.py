@@ -0,0 +1,221 @@
+import json
+from itertools import count
+from statistics import median
+from time import perf_counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from graphene.test import Client
+
+from ideas_app.ideas.models import Idea
+from ideas_app.instrumentation import count_sql
+from ideas_app.schema import schema
+from ideas_app.seeding import seed
+from ideas_app.users.graph import FollowGraph, write_suggestions
+from ideas_app.users.models import AppUser, Follow
+
+
+class Fixtures:
+    """
+    Users and rows the operations run against. New rows are created for
+    every mutation run, outside of the measured time
+    """
+
+    def __init__(self):
+        follow = Follow.objects.filter(approved=True).order_by('id').first()
+        if follow is None:
+            raise CommandError('Seeding created no approved follows')
+        self.viewer = follow.follower
+        self.author = follow.user
+        self.numbers = count()
+        write_suggestions(FollowGraph.from_database(), [self.viewer.id])
+
+    def new_user(self):
+        number = next(self.numbers)
+        return AppUser.objects.create(username=f'benchmark_{number}',
+                                      email=f'benchmark_{number}@email.com')
+
+    def new_idea(self):
+        return Idea.objects.create(text='benchmark idea', author=self.viewer)
+
+    def new_follower(self, approved=False):
+        return Follow.objects.create(user=self.viewer,
+                                     follower=self.new_user(),
+                                     approved=approved)
+
+    def new_followee(self):
+        return Follow.objects.create(user=self.new_user(),
+                                     follower=self.viewer, approved=True)
+
+
+PAGE = '{edges{node{id, text, author{username}}}}'
+
+# name -> (query, variables for one run built from the Fixtures)
+OPERATIONS = {
+    'myIdeas': ('query{myIdeas(first: 20)' + PAGE + '}', None),
+    'userIdeas': (
+        'query($author: String){userIdeas(author: $author, first: 20)'
+        + PAGE + '}',
+        lambda fixtures: {'author': str(fixtures.author.id)},
+    ),
+    'timeline': ('query{timeline(first: 20)' + PAGE + '}', None),
+    'searchIdeas': ('query{searchIdeas(query: "idea", first: 20)'
+                    + PAGE + '}', None),
+    'myFollowers': ('query{myFollowers{follower{username}}}', None),
+    'myFollows': ('query{myFollows{user{username}}}', None),
+    'myPendingFollowers': ('query{myPendingFollowers{follower{username}}}',
+                           None),
+    'searchByUsername': (
+        'query{searchByUsername(search: "seed_1", first: 20)'
+        '{edges{node{username, followersCount}}}}',
+        None,
+    ),
+    'suggestedUsers': ('query{suggestedUsers(first: 20)'
+                       '{edges{node{username}}}}', None),
+    'me': ('query{me{username, ideaSet{id}}}', None),
+    'users': ('query{users(first: 20){edges{node{username}}}}', None),
+    'createIdea': (
+        'mutation{createIdea(text: "benchmark", visibility: PUBLIC)'
+        '{idea{id}}}',
+        None,
+    ),
+    'createIdeas': (
+        'mutation($ideas: [IdeaInput!]!){createIdeas(ideas: $ideas)'
+        '{results{idea{id}}}}',
+        lambda fixtures: {'ideas': [{'text': f'benchmark {number}',
+                                     'visibility': 'PUBLIC'}
+                                    for number in range(100)]},
+    ),
+    'changeIdeaVisibility': (
+        'mutation($id: String){changeIdeaVisibility(ideaId: $id, '
+        'visibility: PUBLIC){idea{id}}}',
+        lambda fixtures: {'id': str(fixtures.new_idea().id)},
+    ),
+    'deleteIdea': (
+        'mutation($id: String){deleteIdea(ideaId: $id){status}}',
+        lambda fixtures: {'id': str(fixtures.new_idea().id)},
+    ),
+    'deleteIdeas': (
+        'mutation($ids: [String!]!){deleteIdeas(ids: $ids)'
+        '{results{success}}}',
+        lambda fixtures: {'ids': [str(fixtures.new_idea().id)
+                                  for _ in range(100)]},
+    ),
+    'followUser': (
+        'mutation($id: String!){followUser(userId: $id){follow{id}}}',
+        lambda fixtures: {'id': str(fixtures.new_user().id)},
+    ),
+    'approveFollower': (
+        'mutation($id: String!){approveFollower(followRequestId: $id, '
+        'approved: true){follow{id}}}',
+        lambda fixtures: {'id': str(fixtures.new_follower().id)},
+    ),
+    'approveFollowers': (
+        'mutation($ids: [String!]!){approveFollowers(ids: $ids, '
+        'approved: true){results{success}}}',
+        lambda fixtures: {'ids': [str(fixtures.new_follower().id)
+                                  for _ in range(100)]},
+    ),
+    'unfollowUser': (
+        'mutation($id: String!){unfollowUser(userId: $id){success}}',
+        lambda fixtures: {'id': str(fixtures.new_followee().user_id)},
+    ),
+    'deleteFollower': (
+        'mutation($id: String!){deleteFollower(followerId: $id){success}}',
+        lambda fixtures: {
+            'id': str(fixtures.new_follower(approved=True).follower_id)
+        },
+    ),
+}
+
+
+class Command(BaseCommand):
+    help = ('Seeds the database at each size and runs every query and '
+            'mutation of the schema through graphene.test.Client, recording '
+            'wall time, SQL queries and rows fetched. Seeded rows are '
+            'rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+',
+                            default=[1000, 10000])
+        parser.add_argument('--ideas-per-user', type=int, default=20)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--operations', nargs='+',
+                            choices=sorted(OPERATIONS),
+                            help='Only run these operations')
+        parser.add_argument('--output', help='Write the results as JSON')
+        parser.add_argument('--compare',
+                            help='JSON results of a previous run to compare')
+
+    def handle(self, *args, **options):
+        previous = {}
+        if options['compare']:
+            with open(options['compare']) as previous_file:
+                previous = {(run['users'], name): result
+                            for run in json.load(previous_file)['runs']
+                            for name, result in run['operations'].items()}
+        names = options['operations'] or list(OPERATIONS)
+
+        runs = []
+        for users in options['users']:
+            with transaction.atomic():
+                runs.append(self.benchmark(users, names, options, previous))
+                transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'vendor': connection.vendor,
+                    'ideas_per_user': options['ideas_per_user'],
+                    'follows_per_user': options['follows_per_user'],
+                    'repeat': options['repeat'],
+                    'runs': runs,
+                }, output, indent=2)
+
+    def benchmark(self, users, names, options, previous):
+        cache.clear()
+        seed(users=users, ideas_per_user=options['ideas_per_user'],
+             follows_per_user=options['follows_per_user'])
+        fixtures = Fixtures()
+        client = Client(schema)
+
+        self.stdout.write(
+            f"{users} users, {options['ideas_per_user']} ideas and "
+            f"{options['follows_per_user']} follows each "
+            f"({connection.vendor})"
+        )
+        results = {}
+        for name in names:
+            query, variables = OPERATIONS[name]
+            timings = []
+            for _ in range(options['repeat']):
+                run_variables = variables(fixtures) if variables else None
+                # A new request each run: loaders cache rows per request
+                request = RequestFactory().post('/api/')
+                request.user = fixtures.viewer
+                with count_sql() as stats:
+                    start = perf_counter()
+                    result = client.execute(query, variables=run_variables,
+                                            context_value=request)
+                    timings.append((perf_counter() - start) * 1000)
+                if 'errors' in result:
+                    raise CommandError(f"{name}: {result['errors']}")
+            results[name] = {'median_ms': round(median(timings), 3),
+                             'min_ms': round(min(timings), 3),
+                             **stats.as_dict()}
+            self.stdout.write(self.format(name, results[name],
+                                          previous.get((users, name))))
+        return {'users': users, 'operations': results}
+
+    @staticmethod
+    def format(name, result, previous):
+        line = (f"  {name:<22} {result['median_ms']:9.2f} ms "
+                f"{result['queries']:5} queries {result['rows']:7} rows")
+        if previous:
+            line += (f"   was {previous['median_ms']:9.2f} ms "
+                     f"{previous['queries']:5} queries "
+                     f"{previous['rows']:7} rows")
+        return line
@@ -0,0 +1,100 @@
+import os
+import tempfile
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef
+
+from ideas_app.pagination import DEFAULT_PAGE_SIZE
+from ideas_app.seeding import seed
+from ideas_app.users.graph import FollowGraph, write_suggestions
+from ideas_app.users.models import Follow, SuggestedUser
+
+
+def live_suggestions(user_id):
+    """
+    Friends of friends with a self-join of follows on every request, what
+    the precomputed suggestions replace
+    """
+    followees = Follow.objects.filter(follower=user_id,
+                                      approved=True).values('user_id')
+    return Follow.objects.filter(
+        ~Exists(Follow.objects.filter(follower=user_id,
+                                      user=OuterRef('user'))),
+        follower__in=followees, approved=True
+    ).exclude(user=user_id).values('user_id').annotate(
+        mutual=Count('id')
+    ).order_by('-mutual', 'user_id')
+
+
+class Command(BaseCommand):
+    help = ('Times building the follow graph and its suggestions, and '
+            'compares reading them with a live friends-of-friends query. '
+            'Seeded rows are rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--readers', type=int, default=20)
+        parser.add_argument('--plans', action='store_true',
+                            help='Print the query plan of both reads')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.stdout.write('Seeding...')
+            user_ids = seed(users=options['users'], ideas_per_user=0,
+                            follows_per_user=options['follows_per_user'],
+                            approved_ratio=1, timelines=False)
+            self.benchmark(user_ids, options)
+            transaction.set_rollback(True)
+
+    def timed(self, label, function):
+        start = perf_counter()
+        result = function()
+        self.stdout.write(
+            f'  {label:<28} {(perf_counter() - start) * 1000:10.0f} ms'
+        )
+        return result
+
+    def benchmark(self, user_ids, options):
+        self.stdout.write(f"{Follow.objects.count()} edges "
+                          f"({connection.vendor})")
+        graph = self.timed('load edges into CSR',
+                           FollowGraph.from_database)
+        total = self.timed('write suggestions',
+                           lambda: write_suggestions(graph))
+        limit = settings.FOLLOW_GRAPH['SUGGESTIONS']
+        self.stdout.write(f'  {total} suggestions of {len(graph.users)} '
+                          f'users, up to {limit} each')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'follow_graph.bin')
+            self.timed('save graph', lambda: graph.save(path))
+            self.stdout.write(f'  {os.path.getsize(path) / 2 ** 20:.1f} MB')
+            self.timed('load graph', lambda: FollowGraph.load(path))
+        self.timed('replace 1000 rows', lambda: graph.replace({
+            user_id: graph.followees_of(user_id)[1:]
+            for user_id in user_ids[:1000]
+        }))
+
+        readers = user_ids[::max(len(user_ids) // options['readers'], 1)]
+        variants = {
+            'live self-join': lambda user_id: live_suggestions(user_id),
+            'precomputed': lambda user_id: SuggestedUser.objects.filter(
+                user=user_id
+            ).order_by('-mutual', 'suggested_id'),
+        }
+        for name, queryset in variants.items():
+            timings = []
+            for user_id in readers:
+                start = perf_counter()
+                list(queryset(user_id)[:DEFAULT_PAGE_SIZE + 1])
+                timings.append((perf_counter() - start) * 1000)
+            self.stdout.write(
+                f'  {name:<28} {median(timings):10.2f} ms median page'
+            )
+            if options['plans']:
+                for line in queryset(readers[0]).explain().splitlines():
+                    self.stdout.write(f'      {line}')
@@ -0,0 +1,53 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ideas_app.pagination import DEFAULT_PAGE_SIZE
+from ideas_app.seeding import seed
+from ideas_app.users.models import AppUser
+from ideas_app.users.search import users_matching
+
+
+class Command(BaseCommand):
+    help = ('Compares the unbounded username__contains search with the '
+            'indexed, ranked first page. Seeded rows are rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--search', nargs='+',
+                            default=['4242', '77777', 'seed_9', 'zzz'])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--plans', action='store_true',
+                            help='Print the query plan of every variant')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            seed(users=options['users'], ideas_per_user=0,
+                 follows_per_user=0, timelines=False)
+            self.benchmark(options)
+            transaction.set_rollback(True)
+
+    def benchmark(self, options):
+        self.stdout.write(f"{options['users']} users ({connection.vendor})")
+        for search in options['search']:
+            variants = {
+                'contains': AppUser.objects.filter(username__contains=search),
+                'indexed page': users_matching(search).order_by(
+                    'rank', 'username', 'id'
+                )[:DEFAULT_PAGE_SIZE + 1],
+            }
+            for name, queryset in variants.items():
+                timings = []
+                for _ in range(options['repeat']):
+                    start = perf_counter()
+                    rows = len(list(queryset.all()))
+                    timings.append((perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f'  {search:<8} {name:<14} {median(timings):10.2f} ms '
+                    f'{rows:>8} rows'
+                )
+                if options['plans']:
+                    for line in queryset.explain().splitlines():
+                        self.stdout.write(f'      {line}')
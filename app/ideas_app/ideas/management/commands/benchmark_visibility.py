@@ -0,0 +1,84 @@
+from statistics import median
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from ideas_app.ideas.models import Idea
+from ideas_app.seeding import seed
+from ideas_app.users.models import Follow
+
+PAGE_SIZE = 20
+
+
+def distinct_user_ideas(viewer, author):
+    follower_query = Q(author__user__follower=viewer,
+                       author__user__approved=True)
+    return Idea.objects.filter(
+        Q(author_id=author)
+        & (Q(visibility=Idea.VisibilityOptions.PUBLIC)
+           | (Q(visibility=Idea.VisibilityOptions.PROTECTED)
+              & follower_query))
+    ).distinct()
+
+
+def distinct_timeline(viewer):
+    follower_query = Q(author__user__follower=viewer,
+                       author__user__approved=True)
+    return Idea.objects.filter(
+        Q(author=viewer)
+        | (follower_query & Q(visibility__in=Idea.FOLLOWER_VISIBILITIES))
+    ).distinct()
+
+
+class Command(BaseCommand):
+    help = ('Compares the JOIN + DISTINCT visibility queries with the '
+            'EXISTS, IN and UNION ALL ones at several table sizes. '
+            'Seeded rows are rolled back')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ideas', type=int, nargs='+',
+                            default=[10000, 100000, 1000000])
+        parser.add_argument('--ideas-per-user', type=int, default=100)
+        parser.add_argument('--follows-per-user', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--plans', action='store_true',
+                            help='Print the query plan of every variant')
+
+    def handle(self, *args, **options):
+        for ideas in options['ideas']:
+            with transaction.atomic():
+                self.benchmark(ideas, options)
+                transaction.set_rollback(True)
+
+    def benchmark(self, ideas, options):
+        seed(users=max(ideas // options['ideas_per_user'], 2),
+             ideas_per_user=options['ideas_per_user'],
+             follows_per_user=options['follows_per_user'],
+             timelines=False)
+        follow = Follow.objects.filter(approved=True).first()
+        viewer, author = follow.follower_id, follow.user_id
+        variants = {
+            'userIdeas distinct': distinct_user_ideas(viewer, author),
+            'userIdeas exists': Idea.objects.filter(
+                author=author).visible_to(viewer),
+            'timeline distinct': distinct_timeline(viewer),
+            'timeline semi-join': Idea.objects.timeline_for(viewer),
+            'timeline union all': Idea.objects.filter(author=viewer).union(
+                Idea.objects.timeline_for(viewer).exclude(author=viewer),
+                all=True
+            ),
+        }
+        self.stdout.write(f'{ideas} ideas ({connection.vendor})')
+        for name, queryset in variants.items():
+            page = queryset.order_by('-created_on', '-id')[:PAGE_SIZE]
+            timings = []
+            for _ in range(options['repeat']):
+                start = perf_counter()
+                list(page.all())
+                timings.append((perf_counter() - start) * 1000)
+            self.stdout.write(f'  {name:<20} {median(timings):10.2f} ms')
+            if options['plans']:
+                for line in page.explain().splitlines():
+                    self.stdout.write(f'      {line}')
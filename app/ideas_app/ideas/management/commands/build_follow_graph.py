@@ -0,0 +1,29 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+
+from ideas_app.users.graph import build, graph_path, refresh
+
+
+class Command(BaseCommand):
+    help = ('Builds the follow graph and the suggested users of everybody, '
+            'or with --incremental only applies the follows changed since '
+            'the last run')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true')
+        parser.add_argument('--path', default=None,
+                            help='Graph file, FOLLOW_GRAPH_PATH by default')
+
+    def handle(self, *args, **options):
+        path = options['path'] or graph_path()
+        start = perf_counter()
+        if options['incremental']:
+            graph, suggestions = refresh(path)
+        else:
+            graph, suggestions = build(path)
+        self.stdout.write(self.style.SUCCESS(
+            f'Follow graph of {len(graph.users)} users and {graph.edges} '
+            f'edges saved to {path}, {suggestions} suggestions written in '
+            f'{perf_counter() - start:.2f} s'
+        ))
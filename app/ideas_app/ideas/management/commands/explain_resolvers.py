@@ -0,0 +1,94 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from ideas_app.schema import schema
+from ideas_app.seeding import seed
+from ideas_app.users.models import Follow
+
+OPERATIONS = {
+    'myIdeas': (
+        'query{myIdeas(first:20){edges{node{id}}}}',
+        'idea_author_recent_idx',
+    ),
+    'userIdeas': (
+        'query($author:String){'
+        'userIdeas(author:$author, first:20){edges{node{id}}}}',
+        'idea_author_recent_idx',
+    ),
+    'timeline': (
+        'query{timeline(first:20){edges{node{id}}}}',
+        'timeline_reader_recent_idx',
+    ),
+    'myFollowers': (
+        'query{myFollowers{id}}',
+        'follow_user_approved_idx',
+    ),
+    'myPendingFollowers': (
+        'query{myPendingFollowers{id}}',
+        'follow_user_approved_idx',
+    ),
+    'myFollows': (
+        'query{myFollows{id}}',
+        'follow_follower_approved_idx',
+    ),
+}
+
+
+def explain(sql):
+    prefix = ('EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite'
+              else 'EXPLAIN ')
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql)
+        return [str(row[-1]) for row in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = ('Runs every idea and follow resolver, EXPLAINs the SQL it '
+            'issues and checks that it is served by the expected index')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help='Seed the database before explaining')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--ideas-per-user', type=int, default=50)
+        parser.add_argument('--follows-per-user', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            seed(users=options['users'],
+                 ideas_per_user=options['ideas_per_user'],
+                 follows_per_user=options['follows_per_user'])
+
+        follow = Follow.objects.filter(approved=True).first()
+        if follow is None:
+            raise CommandError('No approved follows, run with --seed')
+        request = RequestFactory().post('/api/')
+        request.user = follow.follower
+
+        missing = []
+        for name, (query, index) in OPERATIONS.items():
+            with CaptureQueriesContext(connection) as queries:
+                result = schema.execute(
+                    query, context=request,
+                    variables={'author': str(follow.user_id)}
+                )
+            if result.errors:
+                raise CommandError(f'{name}: {result.errors}')
+            plan = [line
+                    for captured in queries.captured_queries
+                    for line in explain(captured['sql'])]
+            used = any(index in line for line in plan)
+            self.stdout.write(f'{name}: {index} '
+                              f'{"used" if used else "NOT USED"}')
+            for line in plan:
+                self.stdout.write(f'    {line}')
+            if not used:
+                missing.append(name)
+
+        if missing:
+            raise CommandError(
+                f'Resolvers not using their index: {", ".join(missing)}'
+            )
+        self.stdout.write(self.style.SUCCESS('Every resolver uses its index'))
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from ideas_app.export import export_rows, ndjson
+from ideas_app.users.models import AppUser
+
+
+class Command(BaseCommand):
+    help = ('Writes the ideas, followers and follows of a user as NDJSON, '
+            'streamed in chunks so memory stays flat however many rows '
+            'there are')
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='Username or id')
+        parser.add_argument('--output', help='File written instead of '
+                            'standard output')
+        parser.add_argument('--chunk-size', type=int,
+                            default=settings.EXPORT['CHUNK_SIZE'],
+                            help='Rows read per query round trip')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='Database alias read, e.g. a replica')
+
+    def handle(self, *args, **options):
+        users = AppUser.objects.using(options['database'])
+        lookup = {'id': options['user']} if options['user'].isdigit() else {
+            'username': options['user']
+        }
+        try:
+            user = users.get(**lookup)
+        except AppUser.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist")
+        chunks = ndjson(
+            export_rows(user, options['chunk_size'], options['database']),
+            options['chunk_size']
+        )
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            for chunk in chunks:
+                output.write(chunk)
@@ -0,0 +1,94 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from statistics import quantiles
+from time import perf_counter
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from graphql_jwt.shortcuts import get_token
+
+from ideas_app.loadgen import asgi_post, wsgi_post
+from ideas_app.seeding import seed
+from ideas_app.users.models import Follow
+
+DASHBOARD_QUERY = """
+query dashboard{
+  myFollowers{follower{username}}
+  myFollows{user{username}}
+  timeline(first: 20){edges{node{text, author{username}}}}
+}
+"""
+
+
+class Command(BaseCommand):
+    help = ('Sends the same authenticated query to the WSGI /api/ view and '
+            'to the ASGI /api/async/ endpoint in process, with the same '
+            'concurrency, and compares their throughput')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--query', default=DASHBOARD_QUERY)
+        parser.add_argument('--seed', action='store_true',
+                            help='Seed the database before the load test')
+        parser.add_argument('--users', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            seed(users=options['users'])
+        follow = Follow.objects.filter(approved=True).first()
+        if follow is None:
+            raise CommandError('No approved follows, run with --seed')
+        body = json.dumps({'query': options['query']}).encode()
+        token = get_token(follow.follower)
+
+        for name, run in (('wsgi /api/', self.run_wsgi),
+                          ('asgi /api/async/', self.run_asgi)):
+            start = perf_counter()
+            results = run(body, token, options)
+            elapsed = perf_counter() - start
+            timings = sorted(timing for timing, _ in results)
+            percentiles = quantiles(timings, n=100)
+            failed = sum(1 for _, ok in results if not ok)
+            self.stdout.write(
+                f'{name:<18} {len(results) / elapsed:8.1f} req/s  '
+                f'p50 {percentiles[49]:7.2f} ms  '
+                f'p95 {percentiles[94]:7.2f} ms  {failed} failed'
+            )
+
+    @staticmethod
+    def run_wsgi(body, token, options):
+        handler = WSGIHandler()
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': f'JWT {token}'}
+
+        def request(_):
+            timing, status, content = wsgi_post(handler, '/api/', body,
+                                                headers)
+            return timing, status == 200 and b'"errors"' not in content
+
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            return list(pool.map(request, range(options['requests'])))
+
+    @staticmethod
+    def run_asgi(body, token, options):
+        from ideas_app.asgi import ASYNC_GRAPHQL_PATH, application
+
+        headers = {'Content-Type': 'application/json',
+                   'Authorization': f'JWT {token}'}
+
+        async def request(semaphore):
+            async with semaphore:
+                timing, status, content = await asgi_post(
+                    application, ASYNC_GRAPHQL_PATH, body, headers
+                )
+            return timing, status == 200 and b'"errors"' not in content
+
+        async def load():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(*(
+                request(semaphore) for _ in range(options['requests'])
+            ))
+
+        return asyncio.run(load())
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ideas_app.ideas.partitions import archive_ideas, create_partitions
+
+
+class Command(BaseCommand):
+    help = ('Creates the monthly partitions of ideas_idea for the coming '
+            'months on Postgres, and moves the ideas older than the hot '
+            'months to ideas_idea_archive: their partitions on Postgres, '
+            'row by row on SQLite. Run it monthly')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months-ahead', type=int,
+            default=settings.IDEA_PARTITIONS['MONTHS_AHEAD'],
+            help='Months after this one that must have a partition'
+        )
+        parser.add_argument(
+            '--hot-months', type=int,
+            default=settings.IDEA_PARTITIONS['HOT_MONTHS'],
+            help='Months of ideas kept, counting this one; 0 archives none'
+        )
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Ideas moved per transaction on SQLite')
+
+    def handle(self, *args, **options):
+        if options['months_ahead'] < 0 or options['hot_months'] < 0:
+            raise CommandError('Months must not be negative')
+        for name in create_partitions(options['months_ahead']):
+            self.stdout.write(f'Created partition {name}')
+        if not options['hot_months']:
+            return
+        before, archived = archive_ideas(options['hot_months'],
+                                         options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{archived} ideas created before {before:%Y-%m-%d} archived'
+        ))
@@ -0,0 +1,40 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ideas_app.persisted_queries import load_registry, query_hash
+
+
+class Command(BaseCommand):
+    help = ('Adds the GraphQL queries recorded in HAR files to the '
+            'persisted queries registry used by strict mode')
+
+    def add_arguments(self, parser):
+        parser.add_argument('har', nargs='+', help='HAR files to read')
+        parser.add_argument(
+            '--registry', default=settings.PERSISTED_QUERIES['REGISTRY']
+        )
+
+    def handle(self, *args, **options):
+        registry = load_registry(options['registry'])
+        added = 0
+        for har in options['har']:
+            with open(har) as har_file:
+                entries = json.load(har_file)['log']['entries']
+            for entry in entries:
+                post_data = entry['request'].get('postData') or {}
+                try:
+                    query = json.loads(post_data.get('text', ''))['query']
+                except (ValueError, KeyError, TypeError):
+                    continue
+                sha256_hash = query_hash(query)
+                if sha256_hash not in registry:
+                    registry[sha256_hash] = query
+                    added += 1
+
+        with open(options['registry'], 'w') as registry_file:
+            json.dump(registry, registry_file, indent=2, sort_keys=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'{added} queries added, {len(registry)} registered'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ideas_app.ideas.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds every materialized timeline from ideas and follows'
+
+    def handle(self, *args, **options):
+        entries = TimelineEntry.objects.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Timelines rebuilt with {entries} entries')
+        )
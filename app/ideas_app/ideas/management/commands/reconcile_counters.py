@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ideas_app.users.counters import BATCH_SIZE, reconcile_counters
+
+
+class Command(BaseCommand):
+    help = ('Recounts the followers, follows and ideas of every user and '
+            'repairs the counters that drifted')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Users checked per transaction')
+
+    def handle(self, *args, **options):
+        repaired = reconcile_counters(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Counters of {repaired} users repaired')
+        )
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import random
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from ideas_app.har import ReplaySession, load_har
+from ideas_app.loadgen import (asgi_post, graphql_errors, http_post,
+                               percentile, wsgi_post)
+from ideas_app.seeding import seed
+from ideas_app.users.models import AppUser
+
+# graphql_auth account flows: they need e-mailed tokens and real passwords
+ACCOUNT_OPERATIONS = [
+    'register', 'verifyAccount', 'resendActivationEmail', 'tokenAuth',
+    'sendPasswordResetEmail', 'passwordReset', 'passwordChange',
+    'updateAccount',
+]
+
+
+class Command(BaseCommand):
+    help = ('Replays the GraphQL requests of a HAR capture as many users at '
+            'once, with fresh JWTs and ids, in process through the WSGI or '
+            'ASGI application or against a running server, and reports '
+            'throughput and latency percentiles per operation. It writes to '
+            'the database: use a disposable one')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--har', default=os.path.join(os.path.dirname(settings.BASE_DIR),
+                                          'ideas_requests.har')
+        )
+        target = parser.add_mutually_exclusive_group()
+        target.add_argument('--url', help='Base URL of a running server, '
+                            'e.g. http://127.0.0.1:8000; it must share this '
+                            'database and SECRET_KEY')
+        target.add_argument('--asgi', action='store_true',
+                            help='Use the ASGI application in process '
+                            'instead of the WSGI one')
+        parser.add_argument('--path', help='Send every request to this path '
+                            'instead of the recorded one, e.g. /api/async/')
+        parser.add_argument('--sessions', type=int, default=50,
+                            help='Replays of the whole capture, each one by '
+                            'a different user')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Sessions running at once')
+        parser.add_argument('--exclude', nargs='*',
+                            default=ACCOUNT_OPERATIONS,
+                            help='Operations not replayed')
+        parser.add_argument('--seed', action='store_true',
+                            help='Seed the database before replaying')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--random-seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            seed(users=options['users'])
+        requests = [request for request in load_har(options['har'])
+                    if request.operation not in options['exclude']]
+        if not requests:
+            raise CommandError('No request left to replay')
+        user_ids = list(AppUser.objects.values_list('id', flat=True))
+        if len(user_ids) < 2:
+            raise CommandError('Not enough users, run with --seed')
+
+        rand = random.Random(options['random_seed'])
+        sessions = []
+        for user in AppUser.objects.filter(
+            id__in=rand.sample(user_ids, min(options['sessions'],
+                                             len(user_ids)))
+        ):
+            session = ReplaySession(user, user_ids, rand)
+            sessions.append([
+                (request.operation, options['path'] or request.path,
+                 *session.prepare(request))
+                for request in requests
+            ])
+        if len(sessions) < options['sessions']:
+            self.stderr.write(f'Only {len(sessions)} sessions: one per user')
+
+        start = perf_counter()
+        if options['asgi']:
+            results = self.run_asgi(sessions, options)
+        else:
+            results = self.run_threads(sessions, options)
+        elapsed = perf_counter() - start
+        self.report(results, elapsed, options)
+
+    @staticmethod
+    def run_threads(sessions, options):
+        if options['url']:
+            base_url = options['url'].rstrip('/')
+
+            def post(path, body, headers):
+                return http_post(f'{base_url}{path}', body, headers)
+        else:
+            post = partial(wsgi_post, WSGIHandler())
+
+        def replay(session):
+            results = []
+            try:
+                for operation, path, headers, body in session:
+                    timing, status, content = post(path, body, headers)
+                    results.append((operation, timing,
+                                    graphql_errors(status, content)))
+            finally:
+                close_old_connections()
+            return results
+
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            return [result for session in pool.map(replay, sessions)
+                    for result in session]
+
+    @staticmethod
+    def run_asgi(sessions, options):
+        from ideas_app.asgi import application
+
+        async def replay(semaphore, session):
+            results = []
+            async with semaphore:
+                for operation, path, headers, body in session:
+                    timing, status, content = await asgi_post(
+                        application, path, body, headers
+                    )
+                    results.append((operation, timing,
+                                    graphql_errors(status, content)))
+            return results
+
+        async def load():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(*(
+                replay(semaphore, session) for session in sessions
+            ))
+
+        return [result for session in asyncio.run(load())
+                for result in session]
+
+    def report(self, results, elapsed, options):
+        by_operation = defaultdict(list)
+        for operation, timing, errors in results:
+            by_operation[operation].append((timing, errors))
+
+        self.stdout.write(
+            f"{'operation':<22} {'requests':>8} {'errors':>6} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for operation, rows in by_operation.items():
+            timings = [timing for timing, _ in rows]
+            failed = [errors for _, errors in rows if errors]
+            self.stdout.write(
+                f'{operation:<22} {len(rows):>8} {len(failed):>6} '
+                f'{percentile(timings, 50):8.2f} '
+                f'{percentile(timings, 95):8.2f} '
+                f'{percentile(timings, 99):8.2f}'
+            )
+            if failed and options['verbosity'] > 1:
+                self.stdout.write(f'    {failed[0][0]}')
+
+        timings = [timing for _, timing, _ in results]
+        failed = sum(1 for _, _, errors in results if errors)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(results)} requests in {elapsed:.2f} s: '
+            f'{len(results) / elapsed:.1f} req/s, {failed} failed, '
+            f'p50 {percentile(timings, 50):.2f} ms, '
+            f'p95 {percentile(timings, 95):.2f} ms, '
+            f'p99 {percentile(timings, 99):.2f} ms'
+        ))
@@ -0,0 +1,58 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:42
+
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_timelines(apps, schema_editor):
+    Idea = apps.get_model('ideas', 'Idea')
+    TimelineEntry = apps.get_model('ideas', 'TimelineEntry')
+    own_ideas = Idea.objects.values_list('author_id', 'id', 'created_on')
+    followed_ideas = Idea.objects.filter(
+        visibility__in=['PROTECTED', 'PUBLIC'],
+        author__user__approved=True
+    ).values_list('author__user__follower', 'id', 'created_on')
+    for rows in (own_ideas, followed_ideas):
+        rows = rows.iterator()
+        while True:
+            batch = [
+                TimelineEntry(reader_id=reader_id, idea_id=idea_id,
+                              created_on=created_on)
+                for reader_id, idea_id, created_on in islice(rows, 1000)
+            ]
+            if not batch:
+                break
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ideas', '0001_initial'),
+        ('users', '0003_auto_20200722_1904'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField()),
+                ('idea', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ideas.Idea')),
+                ('reader', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['reader', '-created_on', '-idea'], name='timeline_reader_recent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('reader', 'idea'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(populate_timelines, migrations.RunPython.noop),
+    ]
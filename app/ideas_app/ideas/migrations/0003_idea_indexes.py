@@ -0,0 +1,21 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0002_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['author', '-created_on', '-id'], name='idea_author_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='idea',
+            index=models.Index(fields=['visibility', '-created_on'], name='idea_visibility_recent_idx'),
+        ),
+    ]
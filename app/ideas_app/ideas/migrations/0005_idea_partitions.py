@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from ideas_app.ideas.partitions import partition_ideas, unpartition_ideas
+
+
+def partition(apps, schema_editor):
+    partition_ideas(schema_editor,
+                    settings.IDEA_PARTITIONS['MONTHS_AHEAD'])
+
+
+def unpartition(apps, schema_editor):
+    unpartition_ideas(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ideas', '0004_idea_search'),
+    ]
+
+    operations = [
+        # A foreign key to a partitioned table must cover its partition
+        # key, and archived ideas leave ideas_idea
+        migrations.AlterField(
+            model_name='timelineentry',
+            name='idea',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='ideas.Idea'),
+        ),
+        # Archiving drops the timeline entries of a range of months
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['created_on'], name='timeline_created_on_idx'),
+        ),
+        migrations.RunPython(partition, unpartition),
+        # ideas_idea_archive is created by partition_ideas
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ArchivedIdea',
+                fields=[
+                    ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('text', models.CharField(max_length=280)),
+                    ('created_on', models.DateTimeField()),
+                    ('visibility', models.CharField(choices=[('PUBLIC', 'public'), ('PROTECTED', 'protected'), ('PRIVATE', 'private')], max_length=9)),
+                    ('author', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ],
+                options={
+                    'db_table': 'ideas_idea_archive',
+                },
+            ),
+        ]),
+    ]
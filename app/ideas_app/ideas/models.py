@@ -1,8 +1,73 @@
-from django.db import models
+from collections import defaultdict
+from itertools import islice
 
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from ideas_app.response_cache import invalidate_users
+from ideas_app.users.counters import adjust_counters, batched_counters
 from ideas_app.users.models import AppUser, Follow
 
 
+class IdeaQuerySet(models.QuerySet):
+    """
+    Visibility rules as semi-joins (EXISTS / IN subqueries): one row per
+    idea and no DISTINCT, so each author's ideas are read from
+    idea_author_recent_idx and the ORDER BY ... LIMIT can stop early.
+    When the viewer's followee ids are already known (see
+    users.cache.get_followee_ids) they replace the Follow subquery
+    """
+
+    def visible_to(self, viewer, followee_ids=None):
+        if followee_ids is None:
+            author_followed = Exists(Follow.objects.filter(
+                user=OuterRef('author'), follower=viewer, approved=True
+            ))
+            protected_query = Q(author_followed)
+        else:
+            protected_query = Q(author__in=followee_ids)
+        return self.filter(
+            Q(visibility=Idea.VisibilityOptions.PUBLIC)
+            | (protected_query
+               & Q(visibility=Idea.VisibilityOptions.PROTECTED))
+        )
+
+    def create_many(self, ideas):
+        """
+        bulk_create that also fans the ideas out to timelines, which
+        Idea.save would do one by one. SQLite can't return the new ids,
+        but it serializes writers: once inserted, the highest ids are
+        these ideas' until the transaction ends
+        """
+        with transaction.atomic():
+            ideas = self.bulk_create(ideas)
+            if ideas and ideas[0].pk is None:
+                ids = Idea.objects.order_by('-id').values_list(
+                    'id', flat=True
+                )[:len(ideas)]
+                for idea, idea_id in zip(ideas, reversed(ids)):
+                    idea.pk = idea_id
+            TimelineEntry.objects.fan_out_many(ideas)
+            # bulk_create skips the post_save signal that counts ideas and
+            # expires cached responses
+            with batched_counters():
+                for idea in ideas:
+                    adjust_counters(idea.author_id, ideas_count=1)
+            invalidate_users(idea.author_id for idea in ideas)
+        return ideas
+
+    def timeline_for(self, viewer, followee_ids=None):
+        if followee_ids is None:
+            followee_ids = Follow.objects.filter(
+                follower=viewer, approved=True
+            ).values('user')
+        return self.filter(
+            Q(author=viewer)
+            | Q(author__in=followee_ids,
+                visibility__in=Idea.FOLLOWER_VISIBILITIES)
+        )
+
+
 class Idea(models.Model):
 
     class VisibilityOptions(models.TextChoices):
@@ -10,6 +75,9 @@ class Idea(models.Model):
         PROTECTED = 'PROTECTED', 'protected'
         PRIVATE = 'PRIVATE', 'private'
 
+    FOLLOWER_VISIBILITIES = [VisibilityOptions.PROTECTED,
+                             VisibilityOptions.PUBLIC]
+
     text = models.CharField(max_length=280)
     created_on = models.DateTimeField(auto_now_add=True)
     visibility = models.CharField(max_length=9,
@@ -17,10 +85,163 @@ class Idea(models.Model):
                                   default=VisibilityOptions.PRIVATE)
     author = models.ForeignKey(AppUser, on_delete=models.CASCADE)
 
+    objects = IdeaQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['author', '-created_on', '-id'],
+                         name='idea_author_recent_idx'),
+            models.Index(fields=['visibility', '-created_on'],
+                         name='idea_visibility_recent_idx'),
+        ]
+
     def save(self, **kwargs):
-        super().save(**kwargs)
-        # followers = Follow.objects.select_related('follower').filter(
-        #     user=self.author)
+        created = self._state.adding
+        with transaction.atomic():
+            super().save(**kwargs)
+            if created:
+                TimelineEntry.objects.fan_out(self)
 
         # send notification using a django pusher mobile / web
         # to each follower.follower
+
+
+class ArchivedIdea(models.Model):
+    """
+    Idea older than the hot months, moved to ideas_idea_archive by
+    ideas.partitions. Its author may change its visibility or delete it,
+    and the database deletes it with its author. On Postgres the table is
+    partitioned too, by the monthly partitions detached from ideas_idea
+    """
+    text = models.CharField(max_length=280)
+    created_on = models.DateTimeField()
+    visibility = models.CharField(max_length=9,
+                                  choices=Idea.VisibilityOptions.choices)
+    author = models.ForeignKey(AppUser, on_delete=models.DO_NOTHING,
+                               db_constraint=False, related_name='+')
+
+    objects = IdeaQuerySet.as_manager()
+
+    class Meta:
+        # Managed so that flush truncates it along with users_appuser,
+        # which it references; ideas.partitions creates the table
+        db_table = 'ideas_idea_archive'
+
+
+class TimelineEntryManager(models.Manager):
+    BATCH_SIZE = 1000
+
+    def _insert(self, rows):
+        rows = iter(rows)
+        while True:
+            batch = [
+                TimelineEntry(reader_id=reader_id, idea_id=idea_id,
+                              created_on=created_on)
+                for reader_id, idea_id, created_on
+                in islice(rows, self.BATCH_SIZE)
+            ]
+            if not batch:
+                break
+            self.bulk_create(batch, ignore_conflicts=True)
+
+    def fan_out(self, idea):
+        self.fan_out_many([idea])
+
+    def fan_out_many(self, ideas):
+        followers = {}
+        for idea in ideas:
+            if (idea.visibility in Idea.FOLLOWER_VISIBILITIES
+                    and idea.author_id not in followers):
+                followers[idea.author_id] = list(Follow.objects.filter(
+                    user=idea.author_id, approved=True
+                ).values_list('follower_id', flat=True))
+        self._insert(
+            (reader_id, idea.id, idea.created_on)
+            for idea in ideas
+            for reader_id in [idea.author_id] + (
+                followers.get(idea.author_id, [])
+                if idea.visibility in Idea.FOLLOWER_VISIBILITIES else []
+            )
+        )
+
+    def sync_visibility(self, idea):
+        if idea.visibility in Idea.FOLLOWER_VISIBILITIES:
+            self.fan_out(idea)
+        else:
+            self.filter(idea=idea).exclude(reader=idea.author_id).delete()
+
+    def sync_follow(self, follow):
+        self.sync_follows([follow])
+
+    def sync_follows(self, follows):
+        """
+        Adds the followed users' ideas to the timelines of approved
+        followers and removes them from the rest, reading each followed
+        user's ideas once
+        """
+        self.remove_follows(
+            [follow for follow in follows if not follow.approved]
+        )
+        followers = defaultdict(list)
+        for follow in follows:
+            if follow.approved:
+                followers[follow.user_id].append(follow.follower_id)
+        for user_id, follower_ids in followers.items():
+            ideas = list(Idea.objects.filter(
+                author=user_id,
+                visibility__in=Idea.FOLLOWER_VISIBILITIES
+            ).values_list('id', 'created_on'))
+            self._insert(
+                (follower_id, idea_id, created_on)
+                for follower_id in follower_ids
+                for idea_id, created_on in ideas
+            )
+
+    def remove_follow(self, follow):
+        self.remove_follows([follow])
+
+    def remove_follows(self, follows):
+        followers = defaultdict(list)
+        for follow in follows:
+            if follow.user_id != follow.follower_id:
+                followers[follow.user_id].append(follow.follower_id)
+        for user_id, follower_ids in followers.items():
+            self.filter(reader__in=follower_ids,
+                        idea__author=user_id).delete()
+
+    @transaction.atomic
+    def rebuild(self):
+        self.all().delete()
+        own_ideas = Idea.objects.values_list('author_id', 'id', 'created_on')
+        self._insert(own_ideas.iterator())
+        followed_ideas = Idea.objects.filter(
+            visibility__in=Idea.FOLLOWER_VISIBILITIES,
+            author__user__approved=True
+        ).values_list('author__user__follower', 'id', 'created_on')
+        self._insert(followed_ideas.iterator())
+        return self.count()
+
+
+class TimelineEntry(models.Model):
+    reader = models.ForeignKey(AppUser, on_delete=models.CASCADE,
+                               related_name='timeline_entries')
+    # No database constraint: ideas_idea is partitioned on Postgres and
+    # archived ideas leave it, see ideas.partitions
+    idea = models.ForeignKey(Idea, on_delete=models.CASCADE,
+                             db_constraint=False)
+    created_on = models.DateTimeField()
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['reader', 'idea'],
+                                    name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['reader', '-created_on', '-idea'],
+                         name='timeline_reader_recent_idx'),
+            # Archiving drops the entries of a range of months
+            models.Index(fields=['created_on'],
+                         name='timeline_created_on_idx'),
+        ]
@@ -0,0 +1,351 @@
+from collections import Counter
+from datetime import datetime
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ideas_app.ideas.models import Idea, TimelineEntry
+from ideas_app.ideas.search import (
+    create_search_index, search_trigger_statements
+)
+from ideas_app.response_cache import invalidate_users
+
+IDEA_TABLE = 'ideas_idea'
+DEFAULT_PARTITION = f'{IDEA_TABLE}_default'
+UNPARTITIONED_TABLE = f'{IDEA_TABLE}_unpartitioned'
+ARCHIVE_TABLE = f'{IDEA_TABLE}_archive'
+ARCHIVE_DEFAULT_PARTITION = f'{ARCHIVE_TABLE}_default'
+IDEA_COLUMNS = 'id, text, created_on, visibility, author_id'
+
+# Primary key, foreign key and indexes of ideas_idea as declared by the
+# model, rebuilt on the partitioned table. Postgres requires the partition
+# key in every unique constraint
+POSTGRES_IDEA_CONSTRAINTS = [
+    f'ALTER TABLE {IDEA_TABLE} ADD PRIMARY KEY (id, created_on)',
+    f'ALTER TABLE {IDEA_TABLE} ADD CONSTRAINT ideas_idea_author_id_fk '
+    f'FOREIGN KEY (author_id) REFERENCES users_appuser (id) '
+    f'DEFERRABLE INITIALLY DEFERRED',
+    f'CREATE INDEX idea_author_recent_idx '
+    f'ON {IDEA_TABLE} (author_id, created_on DESC, id DESC)',
+    f'CREATE INDEX idea_visibility_recent_idx '
+    f'ON {IDEA_TABLE} (visibility, created_on DESC)',
+]
+
+# Archived ideas go when their author does, in the database since
+# ArchivedIdea is not collected by Django
+ARCHIVE_AUTHOR_FK = 'REFERENCES users_appuser (id) ON DELETE CASCADE'
+
+# Partitioned as well: archiving attaches the detached monthly partitions
+POSTGRES_ARCHIVE_STATEMENTS = [
+    f'CREATE TABLE {ARCHIVE_TABLE} (LIKE {IDEA_TABLE}) '
+    f'PARTITION BY RANGE (created_on)',
+    f'ALTER TABLE {ARCHIVE_TABLE} ADD PRIMARY KEY (id, created_on)',
+    f'ALTER TABLE {ARCHIVE_TABLE} ADD CONSTRAINT {ARCHIVE_TABLE}_author_id_fk '
+    f'FOREIGN KEY (author_id) {ARCHIVE_AUTHOR_FK}',
+    f'CREATE INDEX idea_archive_author_recent_idx '
+    f'ON {ARCHIVE_TABLE} (author_id, created_on DESC, id DESC)',
+    f'CREATE TABLE {ARCHIVE_DEFAULT_PARTITION} PARTITION OF '
+    f'{ARCHIVE_TABLE} DEFAULT',
+]
+
+SQLITE_ARCHIVE_STATEMENTS = [
+    f"""CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} (
+        id integer NOT NULL PRIMARY KEY,
+        text varchar(280) NOT NULL,
+        created_on datetime NOT NULL,
+        visibility varchar(9) NOT NULL,
+        author_id integer NOT NULL {ARCHIVE_AUTHOR_FK}
+    )""",
+    f'CREATE INDEX IF NOT EXISTS idea_archive_author_recent_idx '
+    f'ON {ARCHIVE_TABLE} (author_id, created_on DESC, id DESC)',
+]
+
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f'{IDEA_TABLE}_p{month:%Y_%m}'
+
+
+def archive_name(month):
+    return f'{IDEA_TABLE}_archive_{month:%Y_%m}'
+
+
+def partition_bounds(month):
+    return (f"FOR VALUES FROM ('{month.isoformat()}') "
+            f"TO ('{add_months(month, 1).isoformat()}')")
+
+
+def partition_ideas(schema_editor, months_ahead):
+    """
+    Turns ideas_idea into a table partitioned by month of created_on on
+    Postgres, with a partition per month from the oldest idea to
+    `months_ahead` months from now and a default one for anything else.
+    Rows are copied over and the id sequence kept. Both vendors get the
+    archive table, see archive_ideas
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for statement in SQLITE_ARCHIVE_STATEMENTS:
+            schema_editor.execute(statement)
+    if vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT min(created_on) FROM {IDEA_TABLE}')
+        oldest = cursor.fetchone()[0] or timezone.now()
+    # The old table takes its indexes along, their names are reused
+    for index in ('idea_author_recent_idx', 'idea_visibility_recent_idx',
+                  'idea_search_vector_idx'):
+        schema_editor.execute(f'DROP INDEX IF EXISTS {index}')
+    schema_editor.execute(
+        f'ALTER TABLE {IDEA_TABLE} RENAME TO {UNPARTITIONED_TABLE}'
+    )
+    schema_editor.execute(
+        f'CREATE TABLE {IDEA_TABLE} (LIKE {UNPARTITIONED_TABLE} '
+        f'INCLUDING DEFAULTS) PARTITION BY RANGE (created_on)'
+    )
+    for statement in POSTGRES_IDEA_CONSTRAINTS:
+        schema_editor.execute(statement)
+    schema_editor.execute(
+        f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {IDEA_TABLE} DEFAULT'
+    )
+    partitions = [DEFAULT_PARTITION]
+    month, last = month_start(oldest), add_months(
+        month_start(timezone.now()), months_ahead
+    )
+    while month <= last:
+        partitions.append(partition_name(month))
+        schema_editor.execute(
+            f'CREATE TABLE {partitions[-1]} PARTITION OF '
+            f'{IDEA_TABLE} {partition_bounds(month)}'
+        )
+        month = add_months(month, 1)
+    schema_editor.execute(
+        f'INSERT INTO {IDEA_TABLE} SELECT * FROM {UNPARTITIONED_TABLE}'
+    )
+    schema_editor.execute(
+        f'ALTER SEQUENCE {IDEA_TABLE}_id_seq OWNED BY {IDEA_TABLE}.id'
+    )
+    schema_editor.execute(f'DROP TABLE {UNPARTITIONED_TABLE}')
+    # The copied rows queued deferred foreign key checks, which would
+    # stop the search index from being built in this transaction
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    create_search_index(schema_editor, trigger_tables=partitions)
+    for statement in POSTGRES_ARCHIVE_STATEMENTS:
+        schema_editor.execute(statement)
+
+
+def unpartition_ideas(schema_editor):
+    """
+    Turns ideas_idea back into a plain table holding the archived ideas
+    too. Their timeline entries are not restored, rebuild_timeline does
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'INSERT INTO {IDEA_TABLE} ({IDEA_COLUMNS}) '
+            f'SELECT {IDEA_COLUMNS} FROM {ARCHIVE_TABLE}'
+        )
+        schema_editor.execute(f'DROP TABLE {ARCHIVE_TABLE}')
+    if vendor != 'postgresql':
+        return
+
+    schema_editor.execute(
+        f'ALTER TABLE {IDEA_TABLE} RENAME TO {UNPARTITIONED_TABLE}'
+    )
+    schema_editor.execute(
+        f'CREATE TABLE {IDEA_TABLE} (LIKE {UNPARTITIONED_TABLE} '
+        f'INCLUDING DEFAULTS)'
+    )
+    for table in (UNPARTITIONED_TABLE, ARCHIVE_TABLE):
+        schema_editor.execute(
+            f'INSERT INTO {IDEA_TABLE} SELECT * FROM {table}'
+        )
+    schema_editor.execute(
+        f'ALTER SEQUENCE {IDEA_TABLE}_id_seq OWNED BY {IDEA_TABLE}.id'
+    )
+    # Partitions go with them
+    schema_editor.execute(f'DROP TABLE {UNPARTITIONED_TABLE}, {ARCHIVE_TABLE}')
+    schema_editor.execute(f'ALTER TABLE {IDEA_TABLE} ADD PRIMARY KEY (id)')
+    for statement in POSTGRES_IDEA_CONSTRAINTS[1:]:
+        schema_editor.execute(statement)
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    create_search_index(schema_editor)
+
+
+def existing_partitions(cursor):
+    cursor.execute(
+        'SELECT child.relname FROM pg_inherits JOIN pg_class child '
+        'ON child.oid = pg_inherits.inhrelid '
+        'WHERE pg_inherits.inhparent = %s::regclass',
+        [IDEA_TABLE]
+    )
+    return {name for name, in cursor.fetchall()}
+
+
+def create_partitions(months_ahead):
+    """
+    Creates the missing monthly partitions from this month to
+    `months_ahead` months from now, moving their rows out of the default
+    partition, and returns their names. Only Postgres has partitions
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    created = []
+    month = month_start(timezone.now())
+    with transaction.atomic(), connection.cursor() as cursor:
+        partitions = existing_partitions(cursor)
+        for _ in range(months_ahead + 1):
+            name = partition_name(month)
+            if name not in partitions:
+                # Attaching checks that the default partition holds no
+                # row of the month, so they move first
+                cursor.execute(f'CREATE TABLE {name} '
+                               f'(LIKE {IDEA_TABLE} INCLUDING DEFAULTS)')
+                for statement in search_trigger_statements(name):
+                    cursor.execute(statement)
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+                    f'WHERE created_on >= %s AND created_on < %s '
+                    f'RETURNING *) INSERT INTO {name} SELECT * FROM moved',
+                    [month, add_months(month, 1)]
+                )
+                cursor.execute(f'ALTER TABLE {IDEA_TABLE} ATTACH PARTITION '
+                               f'{name} {partition_bounds(month)}')
+                created.append(name)
+            month = add_months(month, 1)
+    return created
+
+
+def forget_ideas(authors, timeline_entries):
+    """
+    Drops archived ideas from the timelines and the cached responses of
+    `authors`, which maps author ids to how many. They stay counted, the
+    authors still read them (see ArchivedIdea)
+    """
+    timeline_entries.delete()
+    invalidate_users(authors)
+
+
+def drop_foreign_keys(cursor, table):
+    cursor.execute(
+        "SELECT conname FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'", [table]
+    )
+    for name, in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT {name}')
+
+
+def archive_partitions(before):
+    """
+    Detaches the monthly partitions ending by `before` and attaches them
+    to ideas_idea_archive as ideas_idea_archive_YYYY_MM: catalog changes
+    and a read to check the bounds, however many rows they hold. Rows of
+    those months in the default partition are moved. Returns the number
+    of ideas archived
+    """
+    archived = 0
+    with connection.cursor() as cursor:
+        partitions = sorted(existing_partitions(cursor))
+    for name in partitions:
+        if name == DEFAULT_PARTITION:
+            continue
+        month = datetime.strptime(name, f'{IDEA_TABLE}_p%Y_%m').replace(
+            tzinfo=timezone.utc
+        )
+        if add_months(month, 1) > before:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT author_id, count(*) FROM {name} GROUP BY author_id'
+            )
+            authors = Counter(dict(cursor.fetchall()))
+            cursor.execute(
+                f'ALTER TABLE {IDEA_TABLE} DETACH PARTITION {name}'
+            )
+            # The copy of ideas_idea's author foreign key would stop
+            # authors from being deleted, the archive's cascades
+            drop_foreign_keys(cursor, name)
+            cursor.execute(f'ALTER TABLE {name} RENAME TO '
+                           f'{archive_name(month)}')
+            cursor.execute(f'ALTER TABLE {ARCHIVE_TABLE} ATTACH PARTITION '
+                           f'{archive_name(month)} {partition_bounds(month)}')
+            # Timeline entries share the created_on of their idea
+            forget_ideas(authors, TimelineEntry.objects.filter(
+                created_on__gte=month, created_on__lt=add_months(month, 1)
+            ))
+        archived += sum(authors.values())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+            f'WHERE created_on < %s RETURNING *) '
+            f'INSERT INTO {ARCHIVE_TABLE} SELECT * FROM moved '
+            f'RETURNING id, author_id', [before]
+        )
+        rows = cursor.fetchall()
+        forget_ideas(Counter(author_id for _, author_id in rows),
+                     TimelineEntry.objects.filter(
+                         created_on__lt=before,
+                         idea_id__in=[idea_id for idea_id, _ in rows]
+                     ))
+    return archived + len(rows)
+
+
+def archive_rows(before, batch_size):
+    """
+    Moves the ideas created before `before` to ideas_idea_archive, one
+    transaction per `batch_size` ideas. Returns the number moved
+    """
+    archived = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            rows = list(Idea.objects.filter(created_on__lt=before).order_by(
+                'created_on', 'id'
+            ).values_list('id', 'author_id', 'created_on')[:batch_size])
+            if not rows:
+                break
+            ids = [idea_id for idea_id, _, _ in rows]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(
+                f'INSERT INTO {ARCHIVE_TABLE} ({IDEA_COLUMNS}) '
+                f'SELECT {IDEA_COLUMNS} FROM {IDEA_TABLE} '
+                f'WHERE id IN ({placeholders})', ids
+            )
+            # Not Idea.delete(): archived ideas are not deleted ideas
+            cursor.execute(
+                f'DELETE FROM {IDEA_TABLE} WHERE id IN ({placeholders})', ids
+            )
+            # Timeline entries share the created_on of their idea
+            forget_ideas(
+                Counter(author_id for _, author_id, _ in rows),
+                TimelineEntry.objects.filter(
+                    created_on__gte=rows[0][2], created_on__lte=rows[-1][2],
+                    idea_id__in=ids
+                )
+            )
+        archived += len(rows)
+    return archived
+
+
+def archive_ideas(hot_months, batch_size):
+    """
+    Moves the ideas older than the `hot_months` latest months, this one
+    included, out of ideas_idea, so its indexes only cover the ideas
+    being read, to ideas_idea_archive: by partition on Postgres, by row
+    elsewhere. Archived ideas leave the timelines and search, myIdeas,
+    userIdeas and exports read them from the archive. Returns the start
+    of the hot months and the ideas archived
+    """
+    before = add_months(month_start(timezone.now()), 1 - hot_months)
+    if connection.vendor == 'postgresql':
+        return before, archive_partitions(before)
+    return before, archive_rows(before, batch_size)
@@ -1,59 +1,111 @@
+from functools import partial
+
 import graphene
-from django.db.models import Q
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
 from graphql_jwt.decorators import login_required
 from graphene_django.types import DjangoObjectType
 
-from ideas_app.ideas.models import Idea
-from ideas_app.types import SuccessType
+from ideas_app.broker import get_broker
+from ideas_app.ideas.models import ArchivedIdea, Idea, TimelineEntry
+from ideas_app.ideas.search import ideas_matching
+from ideas_app.ideas.subscriptions import (author_channel, follows_channel,
+                                           publish_idea)
+from ideas_app.loaders import load_related
+from ideas_app.pagination import connection_field, paginate
+from ideas_app.projection import project
+from ideas_app.types import (ItemResult, SuccessType, check_batch_size,
+                             parse_ids)
+from ideas_app.users.cache import get_followee_ids
+from ideas_app.users.counters import batched_counters
 
 
 class IdeaType(DjangoObjectType):
     class Meta:
         model = Idea
 
+    @classmethod
+    def is_type_of(cls, root, info):
+        # Archived ideas are read through the same type
+        return (isinstance(root, ArchivedIdea)
+                or super().is_type_of(root, info))
+
+    def resolve_author(self, info):
+        return load_related(info, self, 'author', 'user')
+
+
+class IdeaConnection(graphene.relay.Connection):
+    class Meta:
+        node = IdeaType
+
+
+# Where connections keep their nodes, and the columns of their cursors
+PAGE_NODES = ('edges', 'node')
+PAGE_KEYS = ('created_on', 'id')
+
 
 class IdeaQuery:
-    my_ideas = graphene.List(IdeaType)
-    user_ideas = graphene.List(IdeaType, author=graphene.String())
-    timeline = graphene.List(IdeaType)
+    my_ideas = connection_field(IdeaConnection)
+    user_ideas = connection_field(IdeaConnection, author=graphene.String())
+    timeline = connection_field(IdeaConnection)
+    search_ideas = connection_field(IdeaConnection,
+                                    query=graphene.String(required=True))
 
     @login_required
-    def resolve_my_ideas(self, info):
-        return info.context.user.idea_set.all().order_by('-created_on')
+    def resolve_my_ideas(self, info, first=None, after=None):
+        # Not user.idea_set: related managers read each row's author_id
+        ideas, archived = (
+            project(model.objects.filter(author=info.context.user), info,
+                    PAGE_NODES, required=PAGE_KEYS)
+            for model in (Idea, ArchivedIdea)
+        )
+        return paginate(ideas, IdeaConnection, first, after, older=archived)
 
     @login_required
-    def resolve_user_ideas(self, info, author):
-        author_query = Q(author_id=author)
-        public_ideas_query = Q(visibility=Idea.VisibilityOptions.PUBLIC)
-        protected_ideas_query = Q(visibility=Idea.VisibilityOptions.PROTECTED)
-        follower_query = Q(author__user__follower=info.context.user,
-                           author__user__approved=True)
-        return Idea.objects.select_related('author').filter(
-            author_query
-            & (public_ideas_query | (protected_ideas_query & follower_query))
-        ).distinct().order_by('-created_on')
+    def resolve_user_ideas(self, info, author, first=None, after=None):
+        viewer = info.context.user
+        followee_ids = get_followee_ids(viewer.id)
+        ideas, archived = (
+            project(model.objects.select_related('author').filter(
+                author=author
+            ).visible_to(viewer, followee_ids), info, PAGE_NODES,
+                required=PAGE_KEYS)
+            for model in (Idea, ArchivedIdea)
+        )
+        return paginate(ideas, IdeaConnection, first, after, older=archived)
 
     @login_required
-    def resolve_timeline(self, info):
-        my_ideas_query = Q(author=info.context.user)
-        follow_user_ideas_query = Q(
-            visibility__in=[Idea.VisibilityOptions.PROTECTED,
-                            Idea.VisibilityOptions.PUBLIC]
+    def resolve_timeline(self, info, first=None, after=None):
+        # Entries share the created_on of their idea: joining on it too
+        # reads each idea from its own partition on Postgres
+        entries = TimelineEntry.objects.select_related('idea__author').filter(
+            reader=info.context.user, idea__created_on=F('created_on')
         )
-        follower_query = Q(author__user__follower=info.context.user,
-                           author__user__approved=True)
-        return Idea.objects.select_related('author').filter(
-            my_ideas_query | (follower_query & follow_user_ideas_query)
-        ).distinct().order_by('-created_on')
+        entries = project(entries, info, PAGE_NODES, prefix='idea__',
+                          required=('created_on', 'idea'))
+        return paginate(entries, IdeaConnection, first, after,
+                        ordering=('-created_on', '-idea_id'),
+                        node=lambda entry: entry.idea)
+
+    @login_required
+    def resolve_search_ideas(self, info, query, first=None, after=None):
+        viewer = info.context.user
+        ideas = ideas_matching(query).select_related('author').visible_to(
+            viewer, get_followee_ids(viewer.id)
+        )
+        return paginate(project(ideas, info, PAGE_NODES, required=PAGE_KEYS),
+                        IdeaConnection, first, after)
+
+
+VisibilityOptions = graphene.Enum.from_enum(
+    Idea.VisibilityOptions,
+    description='Idea visibility'
+)
 
 
 class VisibilityArg:
-    visibility = graphene.Argument(
-        graphene.Enum.from_enum(
-            Idea.VisibilityOptions,
-            description='Idea visibility'
-        )
-    )
+    visibility = graphene.Argument(VisibilityOptions)
 
 
 class CreationMutation(graphene.Mutation):
@@ -70,9 +122,24 @@ class CreationMutation(graphene.Mutation):
             author=info.context.user
         )
         new_idea.save()
+        publish_idea(new_idea, created=True)
         return CreationMutation(idea=new_idea)
 
 
+def get_own_idea(user, idea_id):
+    """
+    The user's idea, looked up in the archive when it is no longer hot
+    """
+    try:
+        return Idea.objects.get(id=idea_id, author=user)
+    except Idea.DoesNotExist:
+        archived = ArchivedIdea.objects.filter(id=idea_id,
+                                               author=user).first()
+        if archived is None:
+            raise
+        return archived
+
+
 class ChangeVisibilityMutation(graphene.Mutation):
     class Arguments(VisibilityArg):
         idea_id = graphene.String()
@@ -81,9 +148,13 @@ class ChangeVisibilityMutation(graphene.Mutation):
 
     @login_required
     def mutate(self, info, idea_id, visibility):
-        idea = Idea.objects.get(id=idea_id, author=info.context.user)
+        idea = get_own_idea(info.context.user, idea_id)
         idea.visibility = visibility
         idea.save()
+        # Archived ideas already left the timelines
+        if isinstance(idea, Idea):
+            TimelineEntry.objects.sync_visibility(idea)
+        publish_idea(idea)
         return ChangeVisibilityMutation(idea=idea)
 
 
@@ -95,12 +166,144 @@ class DeleteIdeaMutation(graphene.Mutation):
 
     @login_required
     def mutate(self, info, idea_id):
-        idea = Idea.objects.get(id=idea_id, author=info.context.user)
-        idea.delete()
+        get_own_idea(info.context.user, idea_id).delete()
         return DeleteIdeaMutation(status=True)
 
 
+class IdeaInput(graphene.InputObjectType):
+    text = graphene.String(required=True, description="Idea content")
+    visibility = VisibilityOptions(
+        default_value=Idea.VisibilityOptions.PRIVATE.value
+    )
+
+
+class IdeaResult(graphene.ObjectType):
+    idea = graphene.Field(IdeaType)
+    errors = graphene.List(graphene.String)
+
+
+class BatchCreationMutation(graphene.Mutation):
+    """
+    Creates many ideas with one INSERT per batch. Invalid items are
+    reported in their result and the rest are created
+    """
+    class Arguments:
+        ideas = graphene.List(graphene.NonNull(IdeaInput), required=True)
+
+    results = graphene.List(IdeaResult)
+
+    @login_required
+    def mutate(self, info, ideas):
+        check_batch_size(ideas)
+        results, new_ideas = [], []
+        for item in ideas:
+            idea = Idea(text=item.text, visibility=item.visibility,
+                        author=info.context.user)
+            try:
+                idea.full_clean(exclude=['author', 'created_on'])
+            except ValidationError as error:
+                results.append(IdeaResult(errors=error.messages))
+                continue
+            results.append(IdeaResult(idea=idea, errors=[]))
+            new_ideas.append(idea)
+
+        with transaction.atomic():
+            new_ideas = Idea.objects.create_many(new_ideas)
+            for idea in new_ideas:
+                publish_idea(idea, created=True)
+        return BatchCreationMutation(results=results)
+
+
+class BatchDeleteMutation(graphene.Mutation):
+    """
+    Deletes the user's ideas among `ids`, hot or archived, in one DELETE
+    per table, the others are reported as not found
+    """
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.String),
+                            required=True)
+
+    results = graphene.List(ItemResult)
+
+    @login_required
+    def mutate(self, info, ids):
+        check_batch_size(ids)
+        parsed_ids = parse_ids(ids)
+        with transaction.atomic():
+            found = set()
+            with batched_counters():
+                for model in (Idea, ArchivedIdea):
+                    ideas = model.objects.filter(
+                        id__in=set(parsed_ids.values()),
+                        author=info.context.user
+                    )
+                    found.update(ideas.values_list('id', flat=True))
+                    ideas.delete()
+        return BatchDeleteMutation(results=[
+            ItemResult(id=idea_id, success=True, errors=[])
+            if parsed_ids.get(idea_id) in found else
+            ItemResult(id=idea_id, success=False,
+                       errors=['Idea not found'])
+            for idea_id in ids
+        ])
+
+
+class TimelineEvent(graphene.ObjectType):
+    idea_id = graphene.ID()
+    idea = graphene.Field(
+        IdeaType, description="Null when the idea is no longer visible"
+    )
+    missed = graphene.Int(
+        description="Events dropped before this one, refetch the timeline"
+    )
+
+
+def timeline_event(viewer, subscription, seen, item):
+    """
+    Event of a broker message, or None when the viewer has nothing to
+    see: ideas they can't see are only announced, with a null idea, to
+    remove one this subscription sent them before (`seen` ids)
+    """
+    message, missed = item
+    if 'user_id' in message:
+        channels = [author_channel(message['user_id'])]
+        if message['approved']:
+            subscription.add_channels(channels)
+        elif message['user_id'] != viewer.id:
+            subscription.remove_channels(channels)
+        return TimelineEvent(missed=missed) if missed else None
+    idea = Idea.objects.timeline_for(
+        viewer, get_followee_ids(viewer.id)
+    ).select_related('author').filter(id=message['idea_id']).first()
+    if idea is not None:
+        seen.add(idea.id)
+    elif message['idea_id'] in seen:
+        seen.discard(message['idea_id'])
+    else:
+        return TimelineEvent(missed=missed) if missed else None
+    return TimelineEvent(idea_id=message['idea_id'], idea=idea,
+                         missed=missed)
+
+
+class IdeaSubscription:
+    timeline = graphene.Field(TimelineEvent)
+
+    @login_required
+    def resolve_timeline(self, info):
+        viewer = info.context.user
+        channels = [author_channel(viewer.id), follows_channel(viewer.id)]
+        channels += [author_channel(followee_id)
+                     for followee_id in get_followee_ids(viewer.id)]
+        subscription = get_broker().subscribe(channels, info.context.loop)
+        info.context.subscriptions.append(subscription)
+        return subscription.subject.map(
+            partial(timeline_event, viewer, subscription, set())
+        ).filter(lambda event: event is not None)
+
+
 class IdeaMutation(graphene.ObjectType):
     create_idea = CreationMutation.Field()
     change_idea_visibility = ChangeVisibilityMutation.Field()
     delete_idea = DeleteIdeaMutation.Field()
+    create_ideas = BatchCreationMutation.Field()
+    delete_ideas = BatchDeleteMutation.Field()
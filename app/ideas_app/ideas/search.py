@@ -0,0 +1,133 @@
+import re
+import sqlite3
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from ideas_app.ideas.models import Idea
+
+POSTGRES_SEARCH_COLUMN = 'search_vector'
+POSTGRES_SEARCH_INDEX = 'idea_search_vector_idx'
+POSTGRES_SEARCH_TRIGGER = 'idea_search_vector_update'
+SQLITE_FTS_TABLE = 'ideas_idea_fts'
+
+POSTGRES_SEARCH_STATEMENTS = [
+    f'ALTER TABLE ideas_idea ADD COLUMN IF NOT EXISTS '
+    f'{POSTGRES_SEARCH_COLUMN} tsvector',
+    f"UPDATE ideas_idea SET {POSTGRES_SEARCH_COLUMN} = "
+    f"to_tsvector('pg_catalog.english', text)",
+    f'CREATE INDEX IF NOT EXISTS {POSTGRES_SEARCH_INDEX} '
+    f'ON ideas_idea USING gin ({POSTGRES_SEARCH_COLUMN})',
+]
+
+SQLITE_FTS_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        text, content='ideas_idea', content_rowid='id',
+        tokenize='porter unicode61'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert
+    AFTER INSERT ON ideas_idea BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete
+    AFTER DELETE ON ideas_idea BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_update
+    AFTER UPDATE OF text ON ideas_idea BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, text) VALUES (new.id, new.text);
+    END""",
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def search_trigger_statements(table):
+    """
+    Trigger filling the search vector of `table`. Postgres 12 has no row
+    trigger on a partitioned table, each partition gets its own
+    """
+    return [
+        f'DROP TRIGGER IF EXISTS {POSTGRES_SEARCH_TRIGGER} ON {table}',
+        f"""CREATE TRIGGER {POSTGRES_SEARCH_TRIGGER}
+        BEFORE INSERT OR UPDATE OF text ON {table} FOR EACH ROW
+        EXECUTE PROCEDURE tsvector_update_trigger(
+            {POSTGRES_SEARCH_COLUMN}, 'pg_catalog.english', text
+        )""",
+    ]
+
+
+def create_search_index(schema_editor, trigger_tables=('ideas_idea',)):
+    """
+    Idea text search vector, maintained by the database on every insert
+    and text update (Idea.save as well as bulk writes): a tsvector column
+    with a GIN index on Postgres, an FTS5 table on SQLite >= 3.34. The
+    Postgres trigger goes on `trigger_tables`, the partitions once
+    ideas_idea is partitioned. SQLite drops triggers when it remakes
+    ideas_idea, so migrations altering that table must call this again
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        statements = POSTGRES_SEARCH_STATEMENTS + [
+            statement for table in trigger_tables
+            for statement in search_trigger_statements(table)
+        ]
+    elif vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+        statements = SQLITE_FTS_STATEMENTS
+    else:
+        statements = []
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'DROP TRIGGER IF EXISTS {POSTGRES_SEARCH_TRIGGER} ON ideas_idea'
+        )
+        schema_editor.execute(
+            f'ALTER TABLE ideas_idea DROP COLUMN IF EXISTS '
+            f'{POSTGRES_SEARCH_COLUMN}'
+        )
+    elif vendor == 'sqlite':
+        for action in ('insert', 'delete', 'update'):
+            schema_editor.execute(
+                f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_{action}'
+            )
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+
+def has_sqlite_fts():
+    return (connection.vendor == 'sqlite'
+            and SQLITE_FTS_TABLE in connection.introspection.table_names())
+
+
+def ideas_matching(query):
+    """
+    Ideas containing every word of `query`, looked up in the search index
+    so visibility rules and paging run on the matches only
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return Idea.objects.none()
+    if connection.vendor == 'postgresql':
+        return Idea.objects.filter(id__in=RawSQL(
+            f"SELECT id FROM ideas_idea WHERE {POSTGRES_SEARCH_COLUMN} "
+            f"@@ plainto_tsquery('pg_catalog.english', %s)",
+            [' '.join(words)]
+        ))
+    if has_sqlite_fts():
+        # Quoted words can't be read as FTS5 operators
+        return Idea.objects.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {SQLITE_FTS_TABLE} '
+            f'WHERE {SQLITE_FTS_TABLE} MATCH %s',
+            [' '.join(f'"{word}"' for word in words)]
+        ))
+    query = Q()
+    for word in words:
+        query &= Q(text__icontains=word)
+    return Idea.objects.filter(query)
@@ -0,0 +1,43 @@
+from django.db import transaction
+
+from ideas_app.broker import get_broker
+from ideas_app.ideas.models import Idea
+
+
+def author_channel(author_id):
+    """
+    New and changed ideas of an author
+    """
+    return f'ideas:{author_id}'
+
+
+def follows_channel(follower_id):
+    """
+    Users whose ideas a follower may now see
+    """
+    return f'follows:{follower_id}'
+
+
+def publish_idea(idea, created=False):
+    """
+    Notifies the author's subscribers once the current transaction
+    commits. Messages of the same idea coalesce. A private idea is only
+    published when it was visible before, nobody else may see it created
+    """
+    if created and idea.visibility == Idea.VisibilityOptions.PRIVATE:
+        return
+    transaction.on_commit(lambda: get_broker().publish(
+        author_channel(idea.author_id), ('idea', idea.id),
+        {'idea_id': idea.id}
+    ))
+
+
+def publish_follow(follow, approved):
+    """
+    Tells the follower's subscriptions to start, or stop, receiving the
+    followed user's ideas once the current transaction commits
+    """
+    transaction.on_commit(lambda: get_broker().publish(
+        follows_channel(follow.follower_id), ('follow', follow.user_id),
+        {'user_id': follow.user_id, 'approved': approved}
+    ))
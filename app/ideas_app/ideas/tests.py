@@ -1,6 +1,25 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ideas_app.ideas.management.commands.benchmark_resolvers import (
+    OPERATIONS)
+from ideas_app.ideas.partitions import (add_months,
+                                        month_start)
+from ideas_app.pagination import encode_cursor
+from ideas_app.seeding import seed
 from ideas_app.tests import BaseTestCase
+from ideas_app.users.counters import reconcile_counters
 from ideas_app.users.models import Follow, AppUser
-from ideas_app.ideas.models import Idea
+from ideas_app.ideas.models import ArchivedIdea, Idea, TimelineEntry
 
 
 class BaseLoggedUserWithFollowsTestCase(BaseTestCase):
@@ -16,7 +35,7 @@ class BaseLoggedUserWithFollowsTestCase(BaseTestCase):
 my_ideas_query = """
     query myIdeas{
       myIdeas{
-        text
+        edges{node{text}}
       }
     }
 """
@@ -26,26 +45,89 @@ class MyIdeasTestCase(BaseTestCase):
 
     def test_no_own_ideas(self):
         response = self.client.execute(my_ideas_query)
-        content = response.data['myIdeas']
+        content = response.data['myIdeas']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_own_idea(self):
         Idea.objects.create(text='hola', author=self.logged_user)
         response = self.client.execute(my_ideas_query)
-        content = response.data['myIdeas']
+        content = response.data['myIdeas']['edges']
         self.assertEqual(len(content), 1)
 
     def other_user_idea_not_shown(self):
         Idea.objects.create(text='hola', author=self.extra_user)
         response = self.client.execute(my_ideas_query)
-        content = response.data['myIdeas']
+        content = response.data['myIdeas']['edges']
         self.assertEqual(len(content), 0)
 
 
+my_ideas_page_query = """
+    query myIdeas($first:Int, $after:String){
+      myIdeas(first:$first, after:$after){
+        edges{node{text}}
+        pageInfo{hasNextPage, endCursor}
+      }
+    }
+"""
+
+
+class MyIdeasPaginationTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for number in range(5):
+            Idea.objects.create(text=str(number), author=self.logged_user)
+
+    def get_page(self, first, after=None):
+        response = self.client.execute(my_ideas_page_query,
+                                       {'first': first, 'after': after})
+        return response.data['myIdeas']
+
+    def test_pages_are_newest_first_without_overlap(self):
+        first_page = self.get_page(2)
+        second_page = self.get_page(2, first_page['pageInfo']['endCursor'])
+        texts = [edge['node']['text']
+                 for edge in first_page['edges'] + second_page['edges']]
+        self.assertEqual(texts, ['4', '3', '2', '1'])
+        self.assertTrue(second_page['pageInfo']['hasNextPage'])
+
+    def test_last_page(self):
+        first_page = self.get_page(4)
+        last_page = self.get_page(4, first_page['pageInfo']['endCursor'])
+        self.assertEqual(len(last_page['edges']), 1)
+        self.assertFalse(last_page['pageInfo']['hasNextPage'])
+
+    def test_ties_on_created_on_are_broken_by_id(self):
+        Idea.objects.update(created_on=Idea.objects.first().created_on)
+        first_page = self.get_page(3)
+        second_page = self.get_page(3, first_page['pageInfo']['endCursor'])
+        self.assertEqual(
+            len(first_page['edges']) + len(second_page['edges']), 5
+        )
+
+    def test_invalid_cursor(self):
+        response = self.client.execute(my_ideas_page_query,
+                                       {'first': 2, 'after': 'nope'})
+        self.assertNotEqual(len(response.errors), 0)
+
+    def test_malformed_cursor_values(self):
+        for values in (['x', 1], ['2020-01-01 00:00:00+00:00', '1'],
+                       ['2020-01-01 00:00:00+00:00', True],
+                       ['2020-13-45 00:00:00+00:00', 1], [None, 1], [1]):
+            cursor = encode_cursor(values)
+            response = self.client.execute(my_ideas_page_query,
+                                           {'first': 2, 'after': cursor})
+            self.assertEqual([error.message for error in response.errors],
+                             [f'Invalid cursor {cursor}'])
+
+    def test_page_size_limit(self):
+        response = self.client.execute(my_ideas_page_query, {'first': 1000})
+        self.assertNotEqual(len(response.errors), 0)
+
+
 user_ideas_query = """
     query userIdeas($author:String!){
       userIdeas(author:$author){
-        text
+        edges{node{text}}
       }
     }
 """
@@ -56,7 +138,7 @@ class UserIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
     def test_user_has_no_ideas(self):
         response = self.client.execute(user_ideas_query,
                                        {'author': self.extra_user.id})
-        content = response.data['userIdeas']
+        content = response.data['userIdeas']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_public_idea(self):
@@ -65,7 +147,7 @@ class UserIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
                             visibility=Idea.VisibilityOptions.PUBLIC)
         response = self.client.execute(user_ideas_query,
                                        {'author': self.extra_user.id})
-        content = response.data['userIdeas']
+        content = response.data['userIdeas']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_protected_idea_and_is_followed(self):
@@ -74,7 +156,7 @@ class UserIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
                             visibility=Idea.VisibilityOptions.PROTECTED)
         response = self.client.execute(user_ideas_query,
                                        {'author': self.extra_user.id})
-        content = response.data['userIdeas']
+        content = response.data['userIdeas']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_protected_idea_and_is_not_approved(self):
@@ -85,7 +167,7 @@ class UserIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
         self.follow.save()
         response = self.client.execute(user_ideas_query,
                                        {'author': self.extra_user.id})
-        content = response.data['userIdeas']
+        content = response.data['userIdeas']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_protected_idea_and_is_not_followed(self):
@@ -95,7 +177,7 @@ class UserIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
         self.follow.delete()
         response = self.client.execute(user_ideas_query,
                                        {'author': self.extra_user.id})
-        content = response.data['userIdeas']
+        content = response.data['userIdeas']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_private_idea(self):
@@ -105,14 +187,14 @@ class UserIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
         self.follow.delete()
         response = self.client.execute(user_ideas_query,
                                        {'author': self.extra_user.id})
-        content = response.data['userIdeas']
+        content = response.data['userIdeas']['edges']
         self.assertEqual(len(content), 0)
 
 
 timeline_query = """
     query timeline{
       timeline{
-        text
+        edges{node{text}}
       }
     }
 """
@@ -122,7 +204,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
 
     def test_timeline_has_no_ideas(self):
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_logged_user_private_idea(self):
@@ -130,7 +212,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=self.logged_user,
                             visibility=Idea.VisibilityOptions.PRIVATE)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_logged_user_protected_idea(self):
@@ -138,7 +220,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=self.logged_user,
                             visibility=Idea.VisibilityOptions.PROTECTED)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_logged_user_public_idea(self):
@@ -146,7 +228,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=self.logged_user,
                             visibility=Idea.VisibilityOptions.PUBLIC)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_not_follow_user_private_idea(self):
@@ -154,7 +236,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=self.extra_user,
                             visibility=Idea.VisibilityOptions.PRIVATE)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_follow_user_protected_idea(self):
@@ -162,7 +244,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=self.extra_user,
                             visibility=Idea.VisibilityOptions.PROTECTED)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_follow_user_public_idea(self):
@@ -170,7 +252,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=self.extra_user,
                             visibility=Idea.VisibilityOptions.PUBLIC)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 1)
 
     def test_has_not_unfollowed_user_private_idea(self):
@@ -179,7 +261,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=unfollowed_user,
                             visibility=Idea.VisibilityOptions.PRIVATE)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_not_unfollowed_user_protected_idea(self):
@@ -188,7 +270,7 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=unfollowed_user,
                             visibility=Idea.VisibilityOptions.PROTECTED)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 0)
 
     def test_has_not_unfollowed_user_public_idea(self):
@@ -197,10 +279,332 @@ class TimelineTestCase(BaseLoggedUserWithFollowsTestCase):
                             author=unfollowed_user,
                             visibility=Idea.VisibilityOptions.PUBLIC)
         response = self.client.execute(timeline_query)
-        content = response.data['timeline']
+        content = response.data['timeline']['edges']
         self.assertEqual(len(content), 0)
 
 
+class TimelineEntriesTestCase(BaseLoggedUserWithFollowsTestCase):
+    def timeline_texts(self):
+        response = self.client.execute(timeline_query)
+        return [edge['node']['text']
+                for edge in response.data['timeline']['edges']]
+
+    def test_idea_created_before_follow_approval(self):
+        self.follow.approved = False
+        self.follow.save()
+        Idea.objects.create(text='hola',
+                            author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        self.assertEqual(self.timeline_texts(), [])
+        self.follow.approved = True
+        self.follow.save()
+        TimelineEntry.objects.sync_follow(self.follow)
+        self.assertEqual(self.timeline_texts(), ['hola'])
+
+    def test_unfollow_removes_ideas(self):
+        Idea.objects.create(text='hola',
+                            author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        TimelineEntry.objects.remove_follow(self.follow)
+        self.follow.delete()
+        self.assertEqual(self.timeline_texts(), [])
+
+    def test_private_visibility_removes_idea_from_followers(self):
+        idea = Idea.objects.create(text='hola',
+                                   author=self.extra_user,
+                                   visibility=Idea.VisibilityOptions.PUBLIC)
+        idea.visibility = Idea.VisibilityOptions.PRIVATE
+        idea.save()
+        TimelineEntry.objects.sync_visibility(idea)
+        self.assertEqual(self.timeline_texts(), [])
+        self.assertTrue(
+            TimelineEntry.objects.filter(reader=self.extra_user,
+                                         idea=idea).exists()
+        )
+
+    def test_materialized_timeline_matches_visibility_rule(self):
+        seed(users=20, ideas_per_user=5, follows_per_user=5)
+        for reader in AppUser.objects.all():
+            self.assertEqual(
+                set(TimelineEntry.objects.filter(
+                    reader=reader).values_list('idea_id', flat=True)),
+                set(Idea.objects.timeline_for(reader).values_list(
+                    'id', flat=True))
+            )
+
+    def test_rebuild(self):
+        Idea.objects.create(text='mine', author=self.logged_user)
+        Idea.objects.create(text='hola',
+                            author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PROTECTED)
+        Idea.objects.create(text='secret', author=self.extra_user)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timeline', stdout=StringIO())
+        self.assertEqual(self.timeline_texts(), ['hola', 'mine'])
+
+
+search_ideas_query = """
+    query searchIdeas($query:String!, $first:Int, $after:String){
+      searchIdeas(query:$query, first:$first, after:$after){
+        edges{node{text}}
+        pageInfo{hasNextPage, endCursor}
+      }
+    }
+"""
+
+
+class SearchIdeasTestCase(BaseLoggedUserWithFollowsTestCase):
+
+    def search(self, query, **variables):
+        response = self.client.execute(search_ideas_query,
+                                       {'query': query, **variables})
+        return [edge['node']['text']
+                for edge in response.data['searchIdeas']['edges']]
+
+    def test_matches_every_word(self):
+        Idea.objects.create(text='Graphs are running everywhere',
+                            author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        Idea.objects.create(text='Graphs only',
+                            author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        self.assertEqual(self.search('graphs running'),
+                         ['Graphs are running everywhere'])
+        self.assertEqual(self.search('"graphs" OR'), [])
+
+    def test_applies_visibility_rules(self):
+        stranger = AppUser.objects.create(username='stranger',
+                                          email='stranger@email.com')
+        for author in (self.extra_user, stranger):
+            for visibility in Idea.VisibilityOptions.values:
+                Idea.objects.create(text=f'search {author} {visibility}',
+                                    author=author, visibility=visibility)
+        self.assertCountEqual(self.search('search'), [
+            'search author PUBLIC',
+            'search author PROTECTED',
+            'search stranger PUBLIC',
+        ])
+        self.follow.approved = False
+        self.follow.save()
+        self.assertCountEqual(self.search('search'), [
+            'search author PUBLIC',
+            'search stranger PUBLIC',
+        ])
+
+    def test_follows_text_updates(self):
+        idea = Idea.objects.create(text='before',
+                                   author=self.extra_user,
+                                   visibility=Idea.VisibilityOptions.PUBLIC)
+        idea.text = 'after'
+        idea.save()
+        self.assertEqual(self.search('before'), [])
+        self.assertEqual(self.search('after'), ['after'])
+
+    def test_pages(self):
+        for number in range(5):
+            Idea.objects.create(text=f'paged {number}',
+                                author=self.extra_user,
+                                visibility=Idea.VisibilityOptions.PUBLIC)
+        texts, after = [], None
+        while True:
+            response = self.client.execute(
+                search_ideas_query,
+                {'query': 'paged', 'first': 2, 'after': after}
+            )
+            content = response.data['searchIdeas']
+            texts += [edge['node']['text'] for edge in content['edges']]
+            if not content['pageInfo']['hasNextPage']:
+                break
+            after = content['pageInfo']['endCursor']
+        self.assertEqual(texts, [f'paged {number}'
+                                 for number in reversed(range(5))])
+
+
+class ProjectionTestCase(BaseLoggedUserWithFollowsTestCase):
+
+    def execute(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.execute(query)
+        self.assertIsNone(response.errors)
+        return response.data, [query['sql'] for query in queries]
+
+    def idea_queries(self, queries):
+        return [sql for sql in queries if 'FROM "ideas_idea"' in sql
+                or 'FROM "ideas_timelineentry"' in sql]
+
+    def test_loads_only_selected_columns(self):
+        for number in range(3):
+            Idea.objects.create(text=f'mine {number}',
+                                author=self.logged_user)
+        data, queries = self.execute('{myIdeas{edges{node{text}}}}')
+        self.assertEqual(len(data['myIdeas']['edges']), 3)
+        [sql] = self.idea_queries(queries)
+        self.assertIn('"ideas_idea"."text"', sql)
+        self.assertNotIn('"ideas_idea"."visibility"', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def test_joins_selected_relations_only(self):
+        for number in range(3):
+            Idea.objects.create(text=f'idea {number}',
+                                author=self.extra_user,
+                                visibility=Idea.VisibilityOptions.PUBLIC)
+        query = """
+            query{
+              userIdeas(author: "%s"){
+                edges{node{...idea}}
+              }
+            }
+            fragment idea on IdeaType{text, author{username, userId}}
+        """ % self.extra_user.id
+        data, queries = self.execute(query)
+        self.assertEqual(data['userIdeas']['edges'][0]['node']['author'], {
+            'username': self.extra_user.username,
+            'userId': str(self.extra_user.id),
+        })
+        [sql] = self.idea_queries(queries)
+        self.assertIn('"users_appuser"."username"', sql)
+        self.assertNotIn('"users_appuser"."password"', sql)
+
+    def test_timeline_loads_only_selected_columns(self):
+        for number in range(3):
+            Idea.objects.create(text=f'idea {number}',
+                                author=self.extra_user,
+                                visibility=Idea.VisibilityOptions.PUBLIC)
+        data, queries = self.execute('{timeline{edges{node{text}}}}')
+        self.assertEqual(len(data['timeline']['edges']), 3)
+        [sql] = self.idea_queries(queries)
+        self.assertNotIn('"ideas_idea"."visibility"', sql)
+        self.assertNotIn('"users_appuser"', sql)
+
+
+class IdeaPartitionsTestCase(BaseLoggedUserWithFollowsTestCase):
+
+    def create_idea(self, text, months_ago,
+                    visibility=Idea.VisibilityOptions.PUBLIC):
+        idea = Idea.objects.create(text=text, author=self.extra_user,
+                                   visibility=visibility)
+        created_on = add_months(month_start(timezone.now()), -months_ago)
+        Idea.objects.filter(id=idea.id).update(created_on=created_on)
+        TimelineEntry.objects.filter(idea=idea).update(created_on=created_on)
+        return idea
+
+    def archive(self, hot_months):
+        out = StringIO()
+        call_command('maintain_idea_partitions', hot_months=hot_months,
+                     stdout=out)
+        return out.getvalue()
+
+    def test_add_months(self):
+        month = month_start(timezone.now()).replace(year=2020, month=12)
+        self.assertEqual(add_months(month, 1), month.replace(year=2021,
+                                                             month=1))
+        self.assertEqual(add_months(month, -12), month.replace(year=2019))
+
+    def test_archives_old_ideas(self):
+        old = self.create_idea('old', months_ago=3)
+        self.create_idea('new', months_ago=0)
+        self.assertIn('1 ideas created before', self.archive(hot_months=2))
+
+        self.assertEqual([idea.text for idea in Idea.objects.all()], ['new'])
+        self.assertEqual(list(ArchivedIdea.objects.values_list('id', 'text')),
+                         [(old.id, 'old')])
+        self.assertFalse(TimelineEntry.objects.filter(idea_id=old.id))
+        # Still the author's, and counted
+        self.assertEqual(reconcile_counters(), 0)
+        self.extra_user.refresh_from_db()
+        self.assertEqual(self.extra_user.ideas_count, 2)
+
+        response = self.client.execute('{timeline{edges{node{text}}}}')
+        self.assertEqual(response.data['timeline']['edges'],
+                         [{'node': {'text': 'new'}}])
+        self.assertIn('0 ideas', self.archive(hot_months=2))
+
+    def test_pages_continue_into_the_archive(self):
+        self.create_idea('old', months_ago=4)
+        self.create_idea('private', months_ago=3,
+                         visibility=Idea.VisibilityOptions.PRIVATE)
+        self.create_idea('new', months_ago=0)
+        self.archive(hot_months=2)
+        query = """
+            query($author:String!, $after:String){
+              userIdeas(author:$author, first:1, after:$after){
+                edges{node{text, author{username}}}
+                pageInfo{hasNextPage, endCursor}
+              }
+            }
+        """
+        texts, after = [], None
+        while True:
+            content = self.client.execute(query, {
+                'author': self.extra_user.id, 'after': after
+            }).data['userIdeas']
+            texts += [edge['node']['text'] for edge in content['edges']]
+            self.assertEqual(content['edges'][0]['node']['author'],
+                             {'username': self.extra_user.username})
+            if not content['pageInfo']['hasNextPage']:
+                break
+            after = content['pageInfo']['endCursor']
+        self.assertEqual(texts, ['new', 'old'])
+
+        self.client.authenticate(self.extra_user)
+        edges = self.client.execute(my_ideas_query).data['myIdeas']['edges']
+        self.assertEqual([edge['node']['text'] for edge in edges],
+                         ['new', 'private', 'old'])
+
+    def test_deleting_the_author_deletes_archived_ideas(self):
+        self.create_idea('old', months_ago=3)
+        self.archive(hot_months=2)
+        self.extra_user.delete()
+        self.assertFalse(ArchivedIdea.objects.exists())
+
+    def test_authors_change_archived_ideas(self):
+        hidden = self.create_idea('hidden', months_ago=3)
+        deleted = self.create_idea('deleted', months_ago=3)
+        batch_deleted = self.create_idea('batch deleted', months_ago=3)
+        self.archive(hot_months=2)
+        self.client.authenticate(self.extra_user)
+
+        response = self.client.execute(change_idea_visibility_mutation, {
+            'ideaId': hidden.id, 'visibility': 'PRIVATE'
+        })
+        self.assertEqual(response.data['changeIdeaVisibility']['idea'],
+                         {'text': 'hidden'})
+        self.assertEqual(ArchivedIdea.objects.get(id=hidden.id).visibility,
+                         Idea.VisibilityOptions.PRIVATE)
+        self.assertFalse(TimelineEntry.objects.filter(idea_id=hidden.id))
+
+        response = self.client.execute(delete_idea_mutation,
+                                       {'ideaId': deleted.id})
+        self.assertEqual(response.data['deleteIdea']['status'],
+                         {'success': True})
+        response = self.client.execute(delete_ideas_mutation, {
+            'ids': [str(batch_deleted.id)]
+        })
+        self.assertEqual(response.data['deleteIdeas']['results'][0],
+                         {'id': str(batch_deleted.id), 'success': True,
+                          'errors': []})
+        self.assertEqual(list(ArchivedIdea.objects.values_list('id',
+                                                               flat=True)),
+                         [hidden.id])
+        self.extra_user.refresh_from_db()
+        self.assertEqual(self.extra_user.ideas_count, 1)
+        self.assertEqual(reconcile_counters(), 0)
+
+    def test_archived_ideas_of_other_authors_are_not_found(self):
+        idea = self.create_idea('old', months_ago=3)
+        self.archive(hot_months=2)
+        response = self.client.execute(delete_idea_mutation,
+                                       {'ideaId': idea.id})
+        self.assertEqual(response.errors[0].message,
+                         'Idea matching query does not exist.')
+        self.assertTrue(ArchivedIdea.objects.filter(id=idea.id).exists())
+
+    def test_zero_hot_months_archives_nothing(self):
+        self.create_idea('old', months_ago=30)
+        self.archive(hot_months=0)
+        self.assertEqual(Idea.objects.count(), 1)
+
+
 create_idea_mutation = """
     mutation createIdea($text:String!, $visibility: VisibilityOptions!){
       createIdea(text: $text, visibility: $visibility){
@@ -218,7 +622,8 @@ delete_idea_mutation = """
 """
 
 change_idea_visibility_mutation = """
-    mutation changeIdeaVisibility($ideaId:String!, $visibility: VisibilityOptions!){  # NOQA
+    mutation changeIdeaVisibility($ideaId:String!,
+                                  $visibility: VisibilityOptions!){
       changeIdeaVisibility(ideaId: $ideaId, visibility: $visibility){
         idea{text}
       }
@@ -271,3 +676,107 @@ class IdeasMutationsTestCase(BaseTestCase):
                             {'ideaId': idea.id, 'visibility': 'PRIVATE'})
         self.assertEqual(Idea.objects.get(id=idea.id).visibility,
                          Idea.VisibilityOptions.PROTECTED)
+
+
+create_ideas_mutation = """
+    mutation createIdeas($ideas: [IdeaInput!]!){
+      createIdeas(ideas: $ideas){
+        results{idea{id, text, visibility}, errors}
+      }
+    }
+"""
+
+delete_ideas_mutation = """
+    mutation deleteIdeas($ids: [String!]!){
+      deleteIdeas(ids: $ids){
+        results{id, success, errors}
+      }
+    }
+"""
+
+
+class BatchIdeasMutationsTestCase(BaseTestCase):
+    def test_create_ideas(self):
+        Follow.objects.create(user=self.logged_user,
+                              follower=self.extra_user, approved=True)
+        response = self.client.execute(create_ideas_mutation, variables={
+            'ideas': [{'text': 'first', 'visibility': 'PUBLIC'},
+                      {'text': 'x' * 281},
+                      {'text': 'second', 'visibility': 'PROTECTED'}]
+        })
+        results = response.data['createIdeas']['results']
+        self.assertEqual([result['errors'] for result in results],
+                         [[], ['Ensure this value has at most 280 '
+                               'characters (it has 281).'], []])
+        self.assertIsNone(results[1]['idea'])
+        first = Idea.objects.get(text='first', author=self.logged_user)
+        second = Idea.objects.get(text='second', author=self.logged_user)
+        self.assertEqual(results[0]['idea']['id'], str(first.id))
+        self.assertEqual(results[2]['idea']['id'], str(second.id))
+        self.assertEqual(Idea.objects.count(), 2)
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                reader=self.extra_user
+            ).values_list('idea', flat=True)),
+            {first.id, second.id}
+        )
+
+    def test_create_ideas_default_visibility(self):
+        response = self.client.execute(create_ideas_mutation, variables={
+            'ideas': [{'text': 'TEXT'}]
+        })
+        self.assertEqual(
+            response.data['createIdeas']['results'][0]['idea']['visibility'],
+            'PRIVATE'
+        )
+
+    def test_delete_ideas(self):
+        own = Idea.objects.create(text='own', author=self.logged_user)
+        foreign = Idea.objects.create(text='foreign', author=self.extra_user)
+        response = self.client.execute(delete_ideas_mutation, variables={
+            'ids': [str(own.id), str(foreign.id), 'abc']
+        })
+        self.assertEqual(
+            [result['success']
+             for result in response.data['deleteIdeas']['results']],
+            [True, False, False]
+        )
+        self.assertFalse(Idea.objects.filter(id=own.id).exists())
+        self.assertTrue(Idea.objects.filter(id=foreign.id).exists())
+
+    def test_batch_size_is_limited(self):
+        response = self.client.execute(delete_ideas_mutation, variables={
+            'ids': ['1'] * 5001
+        })
+        self.assertIsNone(response.data['deleteIdeas'])
+        self.assertIn('5000', response.errors[0].message)
+
+
+class ExplainResolversTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_resolvers_use_their_indexes(self):
+        output = StringIO()
+        call_command('explain_resolvers', seed=True, users=50,
+                     ideas_per_user=10, follows_per_user=5, stdout=output)
+        self.assertIn('Every resolver uses its index', output.getvalue())
+
+
+class BenchmarkResolversTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_results_of_every_operation(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark_resolvers', users=[30], repeat=1,
+                         ideas_per_user=3, follows_per_user=3, output=path,
+                         stdout=StringIO())
+            with open(path) as output:
+                results = json.load(output)
+        run, = results['runs']
+        self.assertEqual(run['users'], 30)
+        self.assertEqual(set(run['operations']), set(OPERATIONS))
+        self.assertEqual(run['operations']['timeline']['queries'], 1)
+        self.assertFalse(AppUser.objects.exists())
@@ -0,0 +1,230 @@
+import json
+import logging
+import threading
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from graphql.utils.get_operation_ast import get_operation_ast
+
+logger = logging.getLogger(__name__)
+
+# Resolver path of the statements run before the first resolver
+OUTSIDE_RESOLVERS = '(none)'
+
+_active = threading.local()
+
+
+class SQLStats:
+    """
+    Statements run, rows fetched and milliseconds spent in the database
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+        self.time = 0.0
+
+    def add(self, other):
+        self.queries += other.queries
+        self.rows += other.rows
+        self.time += other.time
+
+    def as_dict(self):
+        return {'queries': self.queries, 'rows': self.rows,
+                'sql_ms': round(self.time, 3)}
+
+
+class CountingCursor:
+    """
+    Proxy of a Django cursor wrapper adding up its statements and the rows
+    fetched from them into `stats`
+    """
+
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return self.cursor.__exit__(*exc_info)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.stats.rows += 1
+            yield row
+
+    def _timed(self, method, *args):
+        start = perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.stats.queries += 1
+            self.stats.time += (perf_counter() - start) * 1000
+
+    def execute(self, sql, params=None):
+        return self._timed(self.cursor.execute, sql, params)
+
+    def executemany(self, sql, param_list):
+        return self._timed(self.cursor.executemany, sql, param_list)
+
+    def callproc(self, procname, params=None, kparams=None):
+        return self._timed(self.cursor.callproc, procname, params, kparams)
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.cursor.fetchmany(*args)
+        self.stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.stats.rows += len(rows)
+        return rows
+
+
+@contextmanager
+def count_sql(using='default'):
+    """
+    Counts the SQL the current thread runs on `using` inside the block:
+
+        with count_sql() as stats:
+            ...
+        stats.queries, stats.rows, stats.time
+    """
+    connection = connections[using]
+    stats = SQLStats()
+    make_cursor = connection.make_cursor
+    make_debug_cursor = connection.make_debug_cursor
+    connection.make_cursor = lambda cursor: CountingCursor(
+        make_cursor(cursor), stats
+    )
+    connection.make_debug_cursor = lambda cursor: CountingCursor(
+        make_debug_cursor(cursor), stats
+    )
+    try:
+        yield stats
+    finally:
+        connection.make_cursor = make_cursor
+        connection.make_debug_cursor = make_debug_cursor
+
+
+def field_path(path):
+    """
+    Response path of a field without its list indexes, so the rows of a
+    list add up: ['timeline', 'edges', 3, 'node'] -> 'timeline.edges.node'
+    """
+    return '.'.join(key for key in path if isinstance(key, str))
+
+
+def get_operation_name(document, name=None):
+    """
+    Name of the operation, or its first top-level field when anonymous
+    """
+    operation = get_operation_ast(document, name)
+    if operation is None:
+        return 'unknown'
+    if operation.name:
+        return operation.name.value
+    return operation.selection_set.selections[0].name.value
+
+
+class SQLRecorder:
+    """
+    Database execute wrapper charging the statements of every connection
+    to the resolver that started last in this thread, as set by
+    SQLMiddleware. Lazy querysets of a list field run as the list is
+    completed, before its items resolve, so they are charged to the list;
+    batched DataLoader queries go to the field that triggered the batch
+    """
+
+    def __init__(self):
+        self.path = None
+        self.total = SQLStats()
+        self.resolvers = defaultdict(SQLStats)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (perf_counter() - start) * 1000
+            path = (field_path(self.path) if self.path is not None
+                    else OUTSIDE_RESOLVERS)
+            for stats in (self.total, self.resolvers[path]):
+                stats.queries += 1
+                stats.time += elapsed
+
+    @contextmanager
+    def record(self):
+        previous = getattr(_active, 'recorder', None)
+        _active.recorder = self
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(self))
+                yield self
+        finally:
+            _active.recorder = previous
+
+    def merge(self, other):
+        self.total.add(other.total)
+        for path, stats in other.resolvers.items():
+            self.resolvers[path].add(stats)
+
+    def summary(self):
+        resolvers = sorted(self.resolvers.items(),
+                           key=lambda item: -item[1].time)
+        return {
+            'queries': self.total.queries,
+            'sql_ms': round(self.total.time, 3),
+            'resolvers': {path: {'queries': stats.queries,
+                                 'sql_ms': round(stats.time, 3)}
+                          for path, stats in resolvers},
+        }
+
+
+class SQLMiddleware:
+    """
+    Graphene middleware telling the active SQLRecorder which resolver
+    runs. The path is only joined when a statement runs, so fields
+    resolved without SQL cost an attribute assignment
+    """
+
+    def resolve(self, next, root, info, **kwargs):
+        recorder = getattr(_active, 'recorder', None)
+        if recorder is not None:
+            recorder.path = info.path
+        return next(root, info, **kwargs)
+
+
+def shows_sql(request):
+    user = getattr(request, 'user', None)
+    return (settings.SQL_INSTRUMENTATION['HEADER'] in request.headers
+            and (settings.DEBUG or getattr(user, 'is_staff', False)))
+
+
+def report_sql(request, operation, recorder, duration):
+    """
+    Logs the SQL summary of a GraphQL request as one JSON line, for log
+    aggregation, and adds it to the response `extensions` when the
+    request asked for it
+    """
+    summary = {'operation': operation, 'duration_ms': round(duration, 3),
+               **recorder.summary()}
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(summary, sort_keys=True))
+    if shows_sql(request):
+        request.graphql_extensions['sql'] = summary
@@ -0,0 +1,85 @@
+from collections import defaultdict
+
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from ideas_app.ideas.models import Idea
+from ideas_app.users.models import AppUser, Follow
+
+
+class ModelByIdLoader(DataLoader):
+    model = None
+
+    def batch_load_fn(self, keys):
+        objects = self.model.objects.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class RelatedListLoader(DataLoader):
+    """
+    Loads the reverse set of many parents with one query,
+    grouping rows by `field` (the foreign key pointing to the parent)
+    """
+    model = None
+    field = None
+    ordering = ('-id',)
+
+    def batch_load_fn(self, keys):
+        rows = defaultdict(list)
+        queryset = self.model.objects.filter(
+            **{f'{self.field}__in': keys}
+        ).order_by(*self.ordering)
+        for row in queryset:
+            rows[getattr(row, f'{self.field}_id')].append(row)
+        return Promise.resolve([rows[key] for key in keys])
+
+
+class UserLoader(ModelByIdLoader):
+    model = AppUser
+
+
+class IdeasByAuthorLoader(RelatedListLoader):
+    model = Idea
+    field = 'author'
+    ordering = ('-created_on', '-id')
+
+
+class FollowsByUserLoader(RelatedListLoader):
+    model = Follow
+    field = 'user'
+
+
+class FollowsByFollowerLoader(RelatedListLoader):
+    model = Follow
+    field = 'follower'
+
+
+class Loaders:
+    def __init__(self):
+        self.user = UserLoader()
+        self.ideas_by_author = IdeasByAuthorLoader()
+        self.follows_by_user = FollowsByUserLoader()
+        self.follows_by_follower = FollowsByFollowerLoader()
+
+
+def get_loaders(context):
+    """
+    Loaders live on the request, so batching and caching never leak
+    between requests
+    """
+    loaders = getattr(context, 'loaders', None)
+    if loaders is None:
+        loaders = context.loaders = Loaders()
+    return loaders
+
+
+def load_related(info, instance, field_name, loader_name):
+    """
+    Resolves a foreign key through the request loader,
+    unless the related object was already joined with select_related
+    """
+    field = instance._meta.get_field(field_name)
+    if field.is_cached(instance):
+        return field.get_cached_value(instance)
+    loader = getattr(get_loaders(info.context), loader_name)
+    return loader.load(getattr(instance, field.attname))
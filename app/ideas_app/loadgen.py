@@ -0,0 +1,101 @@
+import io
+import json
+import urllib.error
+import urllib.request
+from statistics import quantiles
+from time import perf_counter
+
+
+def wsgi_post(handler, path, body, headers):
+    """
+    POSTs `body` to the WSGI `handler` in process, returns
+    (milliseconds, status code, content)
+    """
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': path,
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'HTTP_HOST': 'localhost',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': 'http',
+    }
+    for name, value in headers.items():
+        key = name.upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = f'HTTP_{key}'
+        environ[key] = value
+    statuses = []
+    start = perf_counter()
+    content = b''.join(handler(
+        environ, lambda status, response_headers: statuses.append(status)
+    ))
+    return (perf_counter() - start) * 1000, int(statuses[0][:3]), content
+
+
+async def asgi_post(application, path, body, headers):
+    """
+    POSTs `body` to the ASGI `application` in process, returns
+    (milliseconds, status code, content)
+    """
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'path': path,
+        'query_string': b'',
+        'headers': [(name.lower().encode(), value.encode())
+                    for name, value in headers.items()],
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body}
+
+    async def send(message):
+        messages.append(message)
+
+    start = perf_counter()
+    await application(scope, receive, send)
+    timing = (perf_counter() - start) * 1000
+    content = b''.join(message.get('body', b'') for message in messages[1:])
+    return timing, messages[0]['status'], content
+
+
+def http_post(url, body, headers, timeout=30):
+    """
+    POSTs `body` to a running server, returns
+    (milliseconds, status code, content)
+    """
+    request = urllib.request.Request(url, data=body, headers=headers,
+                                     method='POST')
+    start = perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, content = response.status, response.read()
+    except urllib.error.HTTPError as error:
+        status, content = error.code, error.read()
+    return (perf_counter() - start) * 1000, status, content
+
+
+def graphql_errors(status, content):
+    """
+    Error messages of a GraphQL response, empty when it succeeded
+    """
+    try:
+        errors = json.loads(content).get('errors') or []
+    except ValueError:
+        return [f'HTTP {status}: invalid JSON']
+    messages = [error.get('message', str(error)) for error in errors]
+    if status != 200 and not messages:
+        messages.append(f'HTTP {status}')
+    return messages
+
+
+def percentile(timings, percent):
+    """
+    `percent` percentile of `timings`, in their unit
+    """
+    if len(timings) < 2:
+        return timings[0] if timings else 0.0
+    return quantiles(timings, n=100, method='inclusive')[percent - 1]
@@ -0,0 +1,122 @@
+import base64
+import json
+
+import graphene
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from graphql import GraphQLError
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+NEWEST_FIRST = ('-created_on', '-id')
+
+
+def encode_cursor(values):
+    payload = json.dumps(values, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def _datetime(value):
+    return parse_datetime(value) if isinstance(value, str) else None
+
+
+def _string(value):
+    return value if isinstance(value, str) else None
+
+
+def _integer(value):
+    return value if type(value) is int else None
+
+
+# Cursor values are ids and ranks unless listed here
+CURSOR_VALUES = {'created_on': _datetime, 'username': _string}
+
+
+def decode_cursor(cursor, ordering):
+    """
+    Values of the `ordering` fields in a cursor made by encode_cursor,
+    checked so that a malformed cursor never reaches the database
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(ordering):
+            raise ValueError('Wrong number of values')
+        values = [
+            CURSOR_VALUES.get(field.lstrip('-'), _integer)(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (TypeError, ValueError) as error:
+        raise GraphQLError(f"Invalid cursor {cursor}") from error
+    if None in values:
+        raise GraphQLError(f"Invalid cursor {cursor}")
+    return values
+
+
+def keyset_filter(ordering, values):
+    """
+    Rows strictly after `values` in `ordering`, e.g. for
+    ('-created_on', '-id') it is (created_on, id) < (value0, value1).
+    The first column also gets a plain range condition, created_on <=
+    value0, which Postgres can prune partitions and seek indexes with
+    """
+    query = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        query |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    first = ordering[0]
+    bound = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f"{first.lstrip('-')}__{bound}": values[0]}) & query
+
+
+def connection_field(connection, **kwargs):
+    kwargs.setdefault('first', graphene.Int())
+    return graphene.Field(connection, after=graphene.String(), **kwargs)
+
+
+def paginate(queryset, connection, first=None, after=None,
+             ordering=NEWEST_FIRST, node=None, older=None):
+    """
+    Keyset pagination: seeks past the `after` cursor instead of using
+    OFFSET, so every page costs the same. Rows of `older`, which all come
+    after those of `queryset` in `ordering`, are read once `queryset`
+    runs out
+    """
+    if first is None:
+        first = DEFAULT_PAGE_SIZE
+    if not 0 < first <= MAX_PAGE_SIZE:
+        raise GraphQLError(
+            f"first must be between 1 and {MAX_PAGE_SIZE}"
+        )
+    query = (keyset_filter(ordering, decode_cursor(after, ordering))
+             if after else Q())
+    rows = []
+    for rows_queryset in (queryset, older):
+        if rows_queryset is None or len(rows) > first:
+            break
+        rows += rows_queryset.filter(query).order_by(
+            *ordering
+        )[:first + 1 - len(rows)]
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+
+    edges = [
+        connection.Edge(
+            node=node(row) if node else row,
+            cursor=encode_cursor(
+                [getattr(row, field.lstrip('-')) for field in ordering]
+            )
+        )
+        for row in rows
+    ]
+    return connection(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            has_next_page=has_next_page,
+            has_previous_page=bool(after),
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+        )
+    )
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql import parse, validate
+from graphql.backend.base import GraphQLDocument
+from graphql.backend.core import GraphQLCoreBackend
+from graphql.execution import ExecutionResult, execute
+from graphql.validation.rules import specified_rules
+
+from ideas_app.tracing import phase
+
+
+class PersistedQueryNotFound(Exception):
+    pass
+
+
+class PersistedQueryNotAllowed(Exception):
+    pass
+
+
+class PersistedQueryHashMismatch(Exception):
+    pass
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+def load_registry(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as registry_file:
+        return json.load(registry_file)
+
+
+class PersistedQueries:
+    """
+    Automatic Persisted Queries: clients send the sha256 of a query and
+    only send the full text the first time. In strict mode only the
+    hashes in the registry file are accepted
+    """
+
+    def __init__(self, registry=None, strict=False, timeout=None):
+        self.registry = registry or {}
+        self.strict = strict
+        self.timeout = timeout
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.PERSISTED_QUERIES
+        return cls(registry=load_registry(options['REGISTRY']),
+                   strict=options['STRICT'],
+                   timeout=options['CACHE_TIMEOUT'])
+
+    @staticmethod
+    def key(sha256_hash):
+        return f'apq:{sha256_hash}'
+
+    def lookup(self, sha256_hash):
+        return (self.registry.get(sha256_hash)
+                or cache.get(self.key(sha256_hash)))
+
+    def resolve(self, query, extensions):
+        """
+        The query text to run for a request's `query` and `extensions`
+        """
+        persisted = (extensions or {}).get('persistedQuery') or {}
+        sha256_hash = persisted.get('sha256Hash')
+
+        if sha256_hash is None:
+            if self.strict and query:
+                raise PersistedQueryNotAllowed(
+                    'Only persisted queries are allowed'
+                )
+            return query
+
+        if not query:
+            query = self.lookup(sha256_hash)
+            if query is None:
+                raise PersistedQueryNotFound('PersistedQueryNotFound')
+            return query
+
+        if query_hash(query) != sha256_hash:
+            raise PersistedQueryHashMismatch(
+                'provided sha does not match query'
+            )
+        if self.strict and sha256_hash not in self.registry:
+            raise PersistedQueryNotAllowed(
+                f'Query {sha256_hash} is not registered'
+            )
+        if sha256_hash not in self.registry:
+            cache.set(self.key(sha256_hash), query, self.timeout)
+        return query
+
+
+def execute_validated(validation_errors, schema, document_ast,
+                      *args, **kwargs):
+    if validation_errors:
+        return ExecutionResult(errors=validation_errors, invalid=True)
+    kwargs.pop('validate', None)
+    return execute(schema, document_ast, *args, **kwargs)
+
+
+class DocumentCacheBackend(GraphQLCoreBackend):
+    """
+    Parses and validates each distinct query once, keeping the `size`
+    most recently used documents. Misses are timed as the parsing and
+    validation phases of `tracer`
+    """
+
+    def __init__(self, size=256, rules=None, executor=None):
+        super().__init__(executor=executor)
+        self.size = size
+        self.rules = rules or specified_rules
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string, tracer=None):
+        key = (schema, document_string)
+        with self.lock:
+            document = self.documents.get(key)
+            if document is not None:
+                self.documents.move_to_end(key)
+                return document
+
+        with phase(tracer, 'parsing'):
+            document_ast = parse(document_string)
+        with phase(tracer, 'validation'):
+            validation_errors = validate(schema, document_ast, self.rules)
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(execute_validated, validation_errors, schema,
+                            document_ast, **self.execute_params),
+        )
+        document.validation_errors = validation_errors
+        with self.lock:
+            self.documents[key] = document
+            while len(self.documents) > self.size:
+                self.documents.popitem(last=False)
+        return document
@@ -0,0 +1,120 @@
+from collections import defaultdict
+
+from django.core.exceptions import FieldDoesNotExist
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import ast
+from graphql.type.definition import get_named_type
+
+
+class NotProjectable(Exception):
+    pass
+
+
+def collect_fields(info, selection_sets):
+    """
+    Selection sets of each field selected in `selection_sets`, by field
+    name, with fragments merged in. @skip and @include are ignored, so
+    it can only select more than the query does
+    """
+    fields = defaultdict(list)
+    for selection_set in selection_sets:
+        if selection_set is None:
+            continue
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                fields[selection.name.value].append(selection.selection_set)
+                continue
+            if isinstance(selection, ast.FragmentSpread):
+                nested = info.fragments[selection.name.value].selection_set
+            else:
+                nested = selection.selection_set
+            for name, sets in collect_fields(info, [nested]).items():
+                fields[name] += sets
+    return fields
+
+
+def model_field(model, name):
+    """
+    Field of `model` graphene-django names `name`: reverse relations are
+    named by their accessor (idea_set)
+    """
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        for relation in model._meta.related_objects:
+            if relation.get_accessor_name() == name:
+                return relation
+        raise NotProjectable(name)
+
+
+def add_projection(info, model, graphql_type, selection_sets, prefix,
+                   columns, related, prefetched):
+    """
+    Adds the columns and joins needed to resolve `selection_sets` on
+    instances of `model` reached through `prefix`. Fields that aren't
+    model fields must list the columns their resolver reads in the
+    graphene type's `field_columns`
+    """
+    columns.add(prefix + model._meta.pk.attname)
+    field_columns = getattr(getattr(graphql_type, 'graphene_type', None),
+                            'field_columns', {})
+    for name, sets in collect_fields(info, selection_sets).items():
+        if name.startswith('__'):
+            continue
+        field_name = to_snake_case(name)
+        if field_name in field_columns:
+            columns.update(prefix + column
+                           for column in field_columns[field_name])
+            continue
+        field = model_field(model, field_name)
+        if not field.is_relation:
+            columns.add(prefix + field.attname)
+        elif field.concrete and (field.many_to_one or field.one_to_one):
+            columns.add(prefix + field.name)
+            related.add(prefix + field.name)
+            add_projection(
+                info, field.related_model,
+                get_named_type(graphql_type.fields[name].type), sets,
+                f'{prefix}{field.name}__', columns, related, prefetched
+            )
+        else:
+            # Reverse and many to many sets are read by the instance's pk
+            prefetched.add(prefix + field.get_accessor_name()
+                           if field.auto_created else prefix + field.name)
+
+
+def project(queryset, info, path=(), prefix='', required=()):
+    """
+    `queryset` loading only the columns and joins the query selects on
+    the objects found under `path` of the resolved field, e.g.
+    ('edges', 'node') for connections. `prefix` leads from the queryset
+    rows to those objects ('idea__' for timeline entries) and `required`
+    adds the columns the resolver reads itself, like pagination keys.
+    The queryset's select_related is replaced. Selections that can't be
+    projected leave the queryset as it was
+    """
+    graphql_type = get_named_type(info.return_type)
+    selection_sets = [field.selection_set for field in info.field_asts]
+    for name in path:
+        selection_sets = collect_fields(info, selection_sets).get(name, [])
+        graphql_type = get_named_type(graphql_type.fields[name].type)
+
+    model = queryset.model
+    columns, related, prefetched = set(required), set(), set()
+    if prefix:
+        relation = prefix[:-2]
+        columns.add(relation)
+        related.add(relation)
+        for name in relation.split('__'):
+            model = model._meta.get_field(name).related_model
+    try:
+        add_projection(info, model, graphql_type, selection_sets, prefix,
+                       columns, related, prefetched)
+    except NotProjectable:
+        return queryset
+    queryset = queryset.select_related(None).only(*columns)
+    if related:
+        queryset = queryset.select_related(*related)
+    if prefetched:
+        queryset = queryset.prefetch_related(*prefetched)
+    return queryset
@@ -0,0 +1,148 @@
+import hashlib
+import json
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from graphql.language import ast
+from graphql.language.printer import print_ast
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from ideas_app.auth import viewer_of
+from ideas_app.users.cache import get_followee_ids
+
+
+def tag_key(user_id):
+    return f'response-tag:user:{user_id}'
+
+
+def invalidate_users(user_ids):
+    """
+    Expires the cached responses tagged with any of `user_ids`. New
+    versions are set again on commit, so a request reading the
+    pre-commit rows in between can't keep its response
+    """
+    keys = [tag_key(user_id) for user_id in set(user_ids)]
+    if not keys:
+        return
+
+    def expire():
+        cache.set_many({key: uuid4().hex for key in keys}, None)
+    expire()
+    transaction.on_commit(expire)
+
+
+def tag_versions(user_ids):
+    keys = sorted({tag_key(user_id) for user_id in user_ids})
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # add() keeps a version set by a concurrent invalidation
+        for key in missing:
+            cache.add(key, uuid4().hex, None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def user_ideas_scope(viewer, arguments):
+    try:
+        author_id = int(arguments.get('author'))
+    except (TypeError, ValueError):
+        return None
+    if author_id == viewer.id:
+        audience = 'author'
+    elif author_id in get_followee_ids(viewer.id):
+        audience = 'follower'
+    else:
+        audience = 'public'
+    return f'{audience}:{author_id}', [author_id]
+
+
+def my_ideas_scope(viewer, arguments):
+    return f'author:{viewer.id}', [viewer.id]
+
+
+def timeline_scope(viewer, arguments):
+    return f'reader:{viewer.id}', [viewer.id, *get_followee_ids(viewer.id)]
+
+
+# Query fields whose responses are cached: name -> function of the viewer and
+# the field arguments returning the viewer's visibility class, shared by the
+# viewers who see the same response, and the ids of the users whose ideas,
+# follows or profile the response shows, or None when it can't be cached
+CACHEABLE_FIELDS = {
+    'userIdeas': user_ideas_scope,
+    'myIdeas': my_ideas_scope,
+    'timeline': timeline_scope,
+}
+
+
+def argument_value(node, variables):
+    if isinstance(node, ast.Variable):
+        return variables.get(node.name.value)
+    return getattr(node, 'value', None)
+
+
+class CachedResponse:
+    """
+    Cache slot of a read query response. The key covers the normalized
+    document, the variables, the viewer's visibility classes and the
+    current versions of the response's user tags, so any invalidation
+    moves the query to a new slot and a new ETag
+    """
+
+    def __init__(self, key, user_ids):
+        versions = tag_versions(user_ids)
+        self.key = 'response:' + hashlib.sha256(
+            json.dumps([key, versions]).encode('utf-8')
+        ).hexdigest()
+        self.etag = f'"{self.key[-32:]}"'
+        self.hit = False
+        # Whether the response sent is the one in the slot
+        self.stored = False
+
+    def get(self):
+        content = cache.get(self.key)
+        self.hit = self.stored = content is not None
+        return content
+
+    def set(self, content):
+        cache.set(self.key, content, settings.RESPONSE_CACHE['TIMEOUT'])
+        self.stored = True
+
+    @classmethod
+    def for_request(cls, request, document, variables, operation_name):
+        """
+        Slot of the request's response, or None when it can't be cached:
+        anything but an authenticated query of CACHEABLE_FIELDS
+        """
+        if getattr(document, 'validation_errors', None):
+            return None
+        document_ast = document.document_ast
+        operation = get_operation_ast(document_ast, operation_name)
+        if operation is None or operation.operation != 'query':
+            return None
+        selections = operation.selection_set.selections
+        if not all(isinstance(selection, ast.Field)
+                   and selection.name.value in CACHEABLE_FIELDS
+                   for selection in selections):
+            return None
+        viewer = viewer_of(request)
+        if viewer.is_anonymous:
+            return None
+
+        variables = variables or {}
+        classes, user_ids = [], set()
+        for selection in selections:
+            scope = CACHEABLE_FIELDS[selection.name.value](viewer, {
+                argument.name.value: argument_value(argument.value, variables)
+                for argument in selection.arguments
+            })
+            if scope is None:
+                return None
+            classes.append(scope[0])
+            user_ids.update(scope[1])
+        key = json.dumps([print_ast(document_ast), operation_name, variables,
+                          classes], sort_keys=True, default=str)
+        return cls(key, user_ids)
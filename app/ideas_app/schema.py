@@ -1,10 +1,10 @@
 import graphene
 
-from graphql_auth.schema import UserQuery, MeQuery
 from graphql_auth import mutations
 
-from ideas_app.ideas.schema import IdeaQuery, IdeaMutation
-from ideas_app.users.schema import FollowQuery, FollowMutation, AppUserQuery
+from ideas_app.ideas.schema import IdeaQuery, IdeaMutation, IdeaSubscription
+from ideas_app.users.schema import (FollowQuery, FollowMutation, AppUserQuery,
+                                    UserQuery, MeQuery)
 
 
 class AuthMutation(graphene.ObjectType):
@@ -28,4 +28,9 @@ class Mutation(AuthMutation, FollowMutation, IdeaMutation,
     pass
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(IdeaSubscription, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=Query, mutation=Mutation,
+                         subscription=Subscription)
@@ -0,0 +1,96 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from graphql_auth.models import UserStatus
+
+from ideas_app.ideas.models import Idea, TimelineEntry
+from ideas_app.users.counters import reconcile_counters
+from ideas_app.users.models import AppUser, Follow
+
+BATCH_SIZE = 1000
+
+
+def _bulk_create(model, objects, ignore_conflicts=False):
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, BATCH_SIZE))
+        if not batch:
+            break
+        model.objects.bulk_create(batch, ignore_conflicts=ignore_conflicts)
+
+
+@contextmanager
+def explicit_created_on():
+    """
+    bulk_create honours auto_now_add, so seeded ideas would all share the
+    same timestamp unless it is switched off while seeding
+    """
+    field = Idea._meta.get_field('created_on')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+@transaction.atomic
+def seed(users=100, ideas_per_user=10, follows_per_user=10,
+         approved_ratio=0.8, timelines=True, random_seed=0):
+    """
+    Bulk loads users, ideas and follows sized for benchmarks and EXPLAIN
+    checks, much faster than `manage.py seed`
+    """
+    rand = random.Random(random_seed)
+    start = AppUser.objects.aggregate(last=Max('id'))['last'] or 0
+    _bulk_create(AppUser, (
+        AppUser(username=f'seed_{start + number}',
+                email=f'seed_{start + number}@email.com',
+                password='!')
+        for number in range(1, users + 1)
+    ))
+    user_ids = list(
+        AppUser.objects.filter(id__gt=start).values_list('id', flat=True)
+    )
+    # graphql_auth creates it in a post_save signal, skipped by bulk_create
+    _bulk_create(UserStatus, (UserStatus(user_id=user_id, verified=True)
+                              for user_id in user_ids))
+
+    now = timezone.now()
+    visibilities = Idea.VisibilityOptions.values
+    with explicit_created_on():
+        _bulk_create(Idea, (
+            Idea(author_id=author_id,
+                 text=f'idea {number} of {author_id}',
+                 visibility=rand.choice(visibilities),
+                 created_on=now - timedelta(
+                     seconds=rand.randrange(365 * 24 * 3600)))
+            for author_id in user_ids
+            for number in range(ideas_per_user)
+        ))
+
+    def followees(follower_id):
+        sample = rand.sample(user_ids,
+                             min(follows_per_user + 1, len(user_ids)))
+        return [user_id for user_id in sample
+                if user_id != follower_id][:follows_per_user]
+
+    _bulk_create(Follow, (
+        Follow(user_id=user_id, follower_id=follower_id,
+               approved=rand.random() < approved_ratio)
+        for follower_id in user_ids
+        for user_id in followees(follower_id)
+    ), ignore_conflicts=True)
+
+    if timelines:
+        TimelineEntry.objects.rebuild()
+    if ideas_per_user or follows_per_user:
+        # bulk_create skips the signals keeping the counters
+        reconcile_counters(AppUser.objects.filter(id__gt=start))
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    return user_ids
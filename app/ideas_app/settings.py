@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 '''
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -81,9 +82,68 @@ WSGI_APPLICATION = 'ideas_app.wsgi.application'
 GRAPHENE = {
     'SCHEMA': 'ideas_app.schema.schema',  # this file doesn't exist yet
     'MIDDLEWARE': [
-        'graphql_jwt.middleware.JSONWebTokenMiddleware',
+        'ideas_app.auth.MemoizedJSONWebTokenMiddleware',
+        # Last, so it wraps the authentication queries of each field too
+        'ideas_app.instrumentation.SQLMiddleware',
     ],
 }
+# SQL queries and database time per resolver path of every /api/ request,
+# logged as JSON by ideas_app.instrumentation at INFO and returned in the
+# response `extensions` for requests with the HEADER header, when DEBUG is
+# on or the user is staff
+SQL_INSTRUMENTATION = {
+    'ENABLED': bool(int(os.environ.get('SQL_INSTRUMENTATION', 1))),
+    'HEADER': 'X-Debug-SQL',
+}
+# Responses of authenticated queries of response_cache.CACHEABLE_FIELDS,
+# kept TIMEOUT seconds in the default cache and expired by the Idea, Follow
+# and AppUser signals of the users they show
+RESPONSE_CACHE = {
+    'ENABLED': bool(int(os.environ.get('RESPONSE_CACHE', 0))),
+    'TIMEOUT': int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 300)),
+}
+# Apollo tracing of a SAMPLE_RATE share of the GraphQL requests, returned in
+# the response `extensions`. Requests left out don't run the tracer at all
+TRACING = {
+    'ENABLED': bool(int(os.environ.get('GRAPHQL_TRACING', 0))),
+    'SAMPLE_RATE': float(os.environ.get('GRAPHQL_TRACING_SAMPLE_RATE', 0.01)),
+}
+PERSISTED_QUERIES = {
+    # Reject any query whose hash is not in the REGISTRY file
+    'STRICT': bool(int(os.environ.get('PERSISTED_QUERIES_STRICT', 0))),
+    # JSON object of sha256 -> query, see the persist_queries command
+    'REGISTRY': os.environ.get(
+        'PERSISTED_QUERIES_REGISTRY',
+        os.path.join(BASE_DIR, 'persisted_queries.json')
+    ),
+    'CACHE_TIMEOUT': 24 * 3600,
+    'DOCUMENT_CACHE_SIZE': 256,
+}
+
+QUERY_COST = {
+    'MAX_DEPTH': int(os.environ.get('QUERY_MAX_DEPTH', 10)),
+    'MAX_COST': int(os.environ.get('QUERY_MAX_COST', 5000)),
+    # Rows assumed for plain lists, and for connections queried without first
+    'DEFAULT_LIST_SIZE': 20,
+    'LIST_SIZES': {
+        'Query.myFollowers': 100,
+        'Query.myFollows': 100,
+        'Query.myPendingFollowers': 100,
+        'Query.users': 100,
+        'AppUserNode.ideaSet': 100,
+        'AppUserNode.user': 100,
+        'AppUserNode.follower': 100,
+    },
+    # Cost of resolving a field once, 1 when missing
+    'WEIGHTS': {
+        'Query.timeline': 5,
+        'Query.userIdeas': 5,
+        'Query.searchIdeas': 5,
+        'Query.searchByUsername': 10,
+        'Query.users': 10,
+    },
+}
+
 AUTHENTICATION_BACKENDS = [
     'graphql_auth.backends.GraphQLAuthBackend',
     'django.contrib.auth.backends.ModelBackend',
@@ -114,29 +174,119 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DATABASES = {
     'default': {
         'ENGINE': os.environ.get('SQL_ENGINE', 'django.db.backends.sqlite3'),
-        'NAME': os.environ.get('SQL_DATABASE', os.path.join(BASE_DIR, 'db.sqlite3')),
+        'NAME': os.environ.get('SQL_DATABASE',
+                               os.path.join(BASE_DIR, 'db.sqlite3')),
         'USER': os.environ.get('SQL_USER', 'user'),
         'PASSWORD': os.environ.get('SQL_PASSWORD', 'password'),
         'HOST': os.environ.get('SQL_HOST', 'localhost'),
         'PORT': os.environ.get('SQL_PORT', '5432'),    
+        # Seconds a connection is reused, the async endpoint keeps one per
+        # worker thread
+        'CONN_MAX_AGE': int(os.environ.get('SQL_CONN_MAX_AGE', 0)),
     }
 }
+# Read replicas of the primary: comma separated hosts in SQL_REPLICAS, or
+# database files on SQLite. Tests read them through the primary
+for index, replica in enumerate(filter(None, os.environ.get(
+        'SQL_REPLICAS', '').split(','))):
+    location = ('NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3')
+                else 'HOST')
+    DATABASES[f'replica{index}'] = {**DATABASES['default'],
+                                    location: replica,
+                                    'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['ideas_app.db_router.ReplicaRouter']
+# Queries read from a random replica of ALIASES, except for the users who
+# ran a mutation in the last STICKY_SECONDS, who read from the primary
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': int(os.environ.get('SQL_REPLICA_STICKY_SECONDS', 5)),
+}
+
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+# Use django.core.cache.backends.filebased.FileBasedCache and a directory
+# as CACHE_LOCATION to share it between processes without extra services
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'ideas_app'),
+    }
+}
+
+FOLLOWEES_CACHE_TIMEOUT = int(os.environ.get('FOLLOWEES_CACHE_TIMEOUT', 3600))
+# Threads resolving the top-level fields of /api/async/ queries, each one
+# may hold a database connection while it runs
+ASYNC_GRAPHQL = {
+    'MAX_WORKERS': int(os.environ.get('ASYNC_GRAPHQL_WORKERS', 8)),
+}
+# Pub/sub of subscription events: QUEUE_SIZE events wait per subscriber
+# before the oldest are dropped, KEEPALIVE seconds between websocket pings
+SUBSCRIPTIONS = {
+    'BROKER': os.environ.get('SUBSCRIPTIONS_BROKER',
+                             'ideas_app.broker.InMemoryBroker'),
+    'QUEUE_SIZE': int(os.environ.get('SUBSCRIPTIONS_QUEUE_SIZE', 100)),
+    'KEEPALIVE': int(os.environ.get('SUBSCRIPTIONS_KEEPALIVE', 20)),
+}
+# CSR file of the approved follows kept by the build_follow_graph command,
+# outside the source tree, and suggestions precomputed per user
+FOLLOW_GRAPH = {
+    'PATH': os.environ.get('FOLLOW_GRAPH_PATH', os.path.join(
+        tempfile.gettempdir(), 'ideas_app_follow_graph.bin'
+    )),
+    'SUGGESTIONS': int(os.environ.get('FOLLOW_SUGGESTIONS', 20)),
+}
+# Monthly partitions of ideas_idea created ahead on Postgres, and months of
+# ideas kept in it by the maintain_idea_partitions command, which archives
+# older ones
+IDEA_PARTITIONS = {
+    'MONTHS_AHEAD': int(os.environ.get('IDEA_PARTITIONS_MONTHS_AHEAD', 3)),
+    'HOT_MONTHS': int(os.environ.get('IDEA_HOT_MONTHS', 24)),
+}
+# Rows read per query round trip, and NDJSON lines per chunk sent, by the
+# /api/export/ endpoint and the export_user command
+EXPORT = {
+    'CHUNK_SIZE': int(os.environ.get('EXPORT_CHUNK_SIZE', 2000)),
+}
+# Seconds a verified JWT is trusted without decoding it again, 0 disables it
+JWT_USER_CACHE_TIMEOUT = int(os.environ.get('JWT_USER_CACHE_TIMEOUT', 60))
+# Set SQL_LOG_LEVEL=INFO to print the SQL summary of every /api/ request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'ideas_app.instrumentation': {
+            'handlers': ['console'],
+            'level': os.environ.get('SQL_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
 AUTH_PASSWORD_VALIDATORS = [
     {
-        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+        'NAME': ('django.contrib.auth.password_validation.'
+                 'UserAttributeSimilarityValidator'),
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+        'NAME': ('django.contrib.auth.password_validation.'
+                 'MinimumLengthValidator'),
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+        'NAME': ('django.contrib.auth.password_validation.'
+                 'CommonPasswordValidator'),
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+        'NAME': ('django.contrib.auth.password_validation.'
+                 'NumericPasswordValidator'),
     },
 ]
 
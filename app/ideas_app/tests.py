@@ -1,12 +1,50 @@
 import json
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+import asyncio
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from graphene_django.utils import GraphQLTestCase
+from graphql import parse
 from graphql_auth.models import UserStatus
+from graphql_jwt.shortcuts import get_token
+from graphql_jwt.middleware import JSONWebTokenMiddleware
 from graphql_jwt.testcases import JSONWebTokenTestCase
 
+from ideas_app.asgi import (ASYNC_GRAPHQL_PATH, EXPORT_PATH,
+                            SUBSCRIPTIONS_PATH, application,
+                            websocket_application)
+from ideas_app.async_graphql import split_operation
+from ideas_app.auth import auth_stats
+from ideas_app.broker import Broker, InMemoryBroker, get_broker
+from ideas_app.complexity import QueryCost, analyze
+from ideas_app.db_router import (ReplicaRouter, is_pinned, pin_to_primary,
+                                 pinned_key, read_alias, reading_from)
+from ideas_app.har import ReplaySession, load_har
+from ideas_app.instrumentation import SQLMiddleware, SQLRecorder, count_sql
+from ideas_app.persisted_queries import PersistedQueries, query_hash
+from ideas_app.ideas.schema import timeline_event
 from ideas_app.schema import schema
-from ideas_app.users.models import AppUser
+from ideas_app.ideas.models import ArchivedIdea, Idea
+from ideas_app.users.cache import get_followee_ids
+from ideas_app.users.models import AppUser, Follow
+from ideas_app.views import IdeasGraphQLView, document_cache_backend
 
 login_query = """
     mutation tokenAuth($username: String!, $password: String!){
@@ -28,6 +66,7 @@ class BaseTestCase(GraphQLTestCase, JSONWebTokenTestCase):
     GRAPHQL_SCHEMA = schema
 
     def setUp(self):
+        cache.clear()
         logged_user_name = 'user'
         logged_user_password = 'superultrafakepassword1'
         self.logged_user = get_user_model().objects.create(
@@ -45,3 +84,1028 @@ class BaseTestCase(GraphQLTestCase, JSONWebTokenTestCase):
         user_status.save()
 
         self.client.authenticate(self.logged_user)
+        self.client.middleware([JSONWebTokenMiddleware, SQLMiddleware])
+
+    @contextmanager
+    def assertQueryBudget(self, queries, resolvers=None):
+        """
+        Fails when the block runs more than `queries` SQL queries, or when a
+        resolver path ('timeline.edges.node.author') runs more than its
+        budget in `resolvers`
+        """
+        recorder = SQLRecorder()
+        with recorder.record():
+            yield recorder
+        summary = recorder.summary()
+        message = json.dumps(summary['resolvers'], indent=2)
+        self.assertLessEqual(summary['queries'], queries, message)
+        for path, budget in (resolvers or {}).items():
+            used = summary['resolvers'].get(path, {'queries': 0})['queries']
+            self.assertLessEqual(used, budget, f'{path}: {message}')
+
+
+me_query = 'query{me{username}}'
+
+
+class PersistedQueriesTestCase(BaseTestCase):
+    def post(self, body):
+        return self._client.post(self.GRAPHQL_URL, json.dumps(body),
+                                 content_type='application/json')
+
+    def persisted(self, sha256_hash):
+        return {'persistedQuery': {'version': 1, 'sha256Hash': sha256_hash}}
+
+    def test_unknown_hash(self):
+        response = self.post({'extensions': self.persisted('abc')})
+        self.assertEqual(response.json()['errors'][0]['message'],
+                         'PersistedQueryNotFound')
+
+    def test_hash_is_registered_with_its_query(self):
+        extensions = self.persisted(query_hash(me_query))
+        self.post({'query': me_query, 'extensions': extensions})
+        response = self.post({'extensions': extensions})
+        self.assertEqual(response.json()['data'], {'me': None})
+
+    def test_hash_mismatch(self):
+        response = self.post({'query': me_query,
+                              'extensions': self.persisted('abc')})
+        self.assertEqual(response.status_code, 400)
+
+    def test_strict_mode_rejects_unregistered_queries(self):
+        strict = PersistedQueries(strict=True)
+        with patch.object(IdeasGraphQLView, 'persisted_queries', strict):
+            response = self.post({'query': me_query})
+        self.assertEqual(response.status_code, 403)
+
+    def test_strict_mode_accepts_registered_hashes(self):
+        strict = PersistedQueries(strict=True,
+                                  registry={query_hash(me_query): me_query})
+        with patch.object(IdeasGraphQLView, 'persisted_queries', strict):
+            response = self.post(
+                {'extensions': self.persisted(query_hash(me_query))}
+            )
+        self.assertEqual(response.json()['data'], {'me': None})
+
+    def test_documents_are_parsed_once(self):
+        query = 'query cached{me{username}}'
+        self.post({'query': query})
+        document = document_cache_backend.document_from_string(schema, query)
+        with patch('ideas_app.persisted_queries.parse') as parse:
+            self.post({'query': query})
+        parse.assert_not_called()
+        self.assertIs(
+            document_cache_backend.document_from_string(schema, query),
+            document
+        )
+
+
+class QueryCostTestCase(BaseTestCase):
+    def post(self, query, variables=None):
+        return self._client.post(
+            self.GRAPHQL_URL,
+            json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json'
+        )
+
+    def test_cost_in_extensions(self):
+        response = self.post('query{me{username}}')
+        self.assertEqual(response.json()['extensions']['cost']['depth'], 2)
+        self.assertEqual(response.json()['extensions']['cost']['estimated'],
+                         2)
+
+    def test_lists_multiply_cost(self):
+        query_cost = analyze(schema, parse(
+            'query{myFollowers{user{username}}}'
+        ))
+        self.assertEqual(query_cost, QueryCost(depth=3, cost=201))
+
+    def test_connections_use_first(self):
+        query_cost = analyze(schema, parse(
+            'query($first:Int){myIdeas(first:$first){edges{node{text}}}}'
+        ), variables={'first': 10})
+        self.assertEqual(query_cost.cost, 1 + 10 * 3)
+
+    def test_too_costly_query_is_rejected(self):
+        response = self.post(
+            'query{users{edges{node{ideaSet{author{username}}}}}}'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('exceeds the maximum cost',
+                      response.json()['errors'][0]['message'])
+
+    def test_too_costly_variables_are_rejected(self):
+        query = ('query($first:Int){users(first:$first)'
+                 '{edges{node{ideaSet{text}}}}}')
+        self.assertEqual(self.post(query, {'first': 2}).status_code, 200)
+        self.assertEqual(self.post(query, {'first': 100}).status_code, 400)
+
+    def test_variables_must_be_an_object(self):
+        query = 'query($first:Int){myIdeas(first:$first){edges{cursor}}}'
+        for variables in ([1], '5', '[1]'):
+            response = self.post(query, variables)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['errors'][0]['message'],
+                             'Variables must be a JSON object.')
+
+    def test_too_deep_query_is_rejected(self):
+        with self.settings(QUERY_COST={**settings.QUERY_COST,
+                                       'MAX_DEPTH': 2}):
+            response = self.post('query{me{ideaSet{text}}}')
+        self.assertEqual(response.status_code, 400)
+
+
+# Replica routing authenticates ahead of the resolvers, none of them retries
+@override_settings(DATABASE_REPLICAS={'ALIASES': [], 'STICKY_SECONDS': 5})
+class JWTMemoizationTestCase(BaseTestCase):
+    query = 'query{me{username}, myFollowers{id}, myFollows{id}}'
+
+    def setUp(self):
+        super().setUp()
+        auth_stats.clear()
+
+    def post(self, token):
+        return self._client.post(
+            self.GRAPHQL_URL,
+            json.dumps({'query': self.query}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'JWT {token}'
+        )
+
+    def test_invalid_token_is_verified_once(self):
+        response = self.post('invalid')
+        self.assertEqual(response.json()['data']['me'], None)
+        self.assertEqual(auth_stats['decodes'], 1)
+        self.assertEqual(auth_stats['memoized'], 2)
+
+    def test_verified_tokens_are_cached(self):
+        token = get_token(self.logged_user)
+        for _ in range(3):
+            response = self.post(token)
+            self.assertEqual(response.json()['data']['me'],
+                             {'username': self.logged_user.username})
+        self.assertEqual(auth_stats['decodes'], 1)
+        self.assertEqual(auth_stats['token_cache_hits'], 2)
+
+    def test_cached_token_of_disabled_user(self):
+        token = get_token(self.logged_user)
+        self.post(token)
+        self.logged_user.is_active = False
+        self.logged_user.save()
+        response = self.post(token)
+        self.assertEqual(response.json()['data']['me'], None)
+
+    def test_cache_can_be_disabled(self):
+        token = get_token(self.logged_user)
+        with self.settings(JWT_USER_CACHE_TIMEOUT=0):
+            self.post(token)
+            self.post(token)
+        self.assertEqual(auth_stats['decodes'], 2)
+
+
+class CountSQLTestCase(TestCase):
+    def test_counts_queries_and_rows(self):
+        for number in range(3):
+            AppUser.objects.create(username=f'user{number}',
+                                   email=f'user{number}@email.com')
+        with count_sql() as stats:
+            list(AppUser.objects.all())
+            AppUser.objects.filter(username='user0').update(is_staff=True)
+            list(AppUser.objects.iterator())
+        self.assertEqual(stats.queries, 3)
+        self.assertEqual(stats.rows, 6)
+        self.assertGreater(stats.time, 0)
+
+    def test_nested_blocks_restore_the_cursors(self):
+        with count_sql() as outer:
+            with count_sql() as inner:
+                AppUser.objects.count()
+            AppUser.objects.count()
+        AppUser.objects.count()
+        self.assertEqual((outer.queries, inner.queries), (2, 1))
+
+
+
+class SQLInstrumentationTestCase(BaseTestCase):
+    timeline_query = ('query{timeline(first: 5)'
+                      '{edges{node{text, author{username}}}}}')
+
+    def setUp(self):
+        super().setUp()
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user, approved=True)
+        for number in range(3):
+            Idea.objects.create(text=f'idea {number}', author=self.extra_user)
+        self.token = get_token(self.logged_user)
+
+    def post(self, **headers):
+        return self.query(self.timeline_query, headers={
+            'HTTP_AUTHORIZATION': f'JWT {self.token}', **headers
+        }).json()
+
+    def test_summary_in_extensions(self):
+        with self.settings(DEBUG=True):
+            content = self.post(HTTP_X_DEBUG_SQL='1')
+        sql = content['extensions']['sql']
+        self.assertEqual(sql['operation'], 'timeline')
+        self.assertEqual(
+            sql['queries'],
+            sum(stats['queries'] for stats in sql['resolvers'].values())
+        )
+        self.assertIn('timeline', sql['resolvers'])
+
+    def test_summary_needs_header_and_debug_or_staff(self):
+        with self.settings(DEBUG=True):
+            self.assertNotIn('sql', self.post()['extensions'])
+        self.assertNotIn('sql', self.post(HTTP_X_DEBUG_SQL='1')['extensions'])
+        self.logged_user.is_staff = True
+        self.logged_user.save()
+        self.assertIn('sql', self.post(HTTP_X_DEBUG_SQL='1')['extensions'])
+
+    def test_summary_is_logged(self):
+        with self.assertLogs('ideas_app.instrumentation', 'INFO') as logs:
+            self.post()
+        summary = json.loads(logs.records[0].getMessage())
+        self.assertEqual(summary['operation'], 'timeline')
+        self.assertIn('duration_ms', summary)
+
+    def test_disabled(self):
+        with self.settings(SQL_INSTRUMENTATION={'ENABLED': False,
+                                                'HEADER': 'X-Debug-SQL'},
+                           DEBUG=True):
+            content = self.post(HTTP_X_DEBUG_SQL='1')
+        self.assertNotIn('sql', content['extensions'])
+
+    def test_query_budget(self):
+        # The user and the page with their authors
+        with self.assertQueryBudget(2, {'timeline': 2,
+                                        'timeline.edges.node.author': 0}):
+            self.client.execute(self.timeline_query)
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(10, {'timeline': 0}):
+                self.client.execute(self.timeline_query)
+
+
+@override_settings(TRACING={'ENABLED': True, 'SAMPLE_RATE': 1})
+class TracingTestCase(BaseTestCase):
+    timeline_query = ('query{timeline(first: 5)'
+                      '{edges{node{text, author{username}}}}}')
+
+    def setUp(self):
+        super().setUp()
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user, approved=True)
+        Idea.objects.create(text='idea', author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        self.token = get_token(self.logged_user)
+
+    def post(self, query):
+        return self.query(query, headers={
+            'HTTP_AUTHORIZATION': f'JWT {self.token}'
+        }).json()
+
+    def test_apollo_tracing(self):
+        # A query the document cache hasn't seen yet
+        content = self.post(self.timeline_query + ' # test_apollo_tracing')
+        tracing = content['extensions']['tracing']
+        self.assertEqual(tracing['version'], 1)
+        self.assertTrue(tracing['startTime'].endswith('Z'))
+        self.assertGreater(tracing['parsing']['duration'], 0)
+        self.assertGreater(tracing['validation']['duration'], 0)
+
+        resolvers = {tuple(resolver['path']): resolver
+                     for resolver in tracing['execution']['resolvers']}
+        timeline = resolvers[('timeline',)]
+        self.assertEqual(timeline['parentType'], 'Query')
+        self.assertEqual(timeline['fieldName'], 'timeline')
+        self.assertGreater(timeline['duration'], 0)
+        self.assertLessEqual(timeline['startOffset'] + timeline['duration'],
+                             tracing['duration'])
+        author = resolvers[('timeline', 'edges', 0, 'node', 'author')]
+        self.assertEqual(author['parentType'], 'IdeaType')
+        self.assertIn(('timeline', 'edges', 0, 'node', 'author', 'username'),
+                      resolvers)
+
+    def test_cached_document(self):
+        self.post(self.timeline_query)
+        tracing = self.post(self.timeline_query)['extensions']['tracing']
+        self.assertEqual(tracing['parsing']['duration'], 0)
+        self.assertTrue(tracing['execution']['resolvers'])
+
+    def test_sampling(self):
+        with self.settings(TRACING={'ENABLED': True, 'SAMPLE_RATE': 0}):
+            content = self.post(self.timeline_query)
+        self.assertNotIn('tracing', content['extensions'])
+        with self.settings(TRACING={'ENABLED': False, 'SAMPLE_RATE': 1}):
+            content = self.post(self.timeline_query)
+        self.assertNotIn('tracing', content['extensions'])
+
+
+@override_settings(RESPONSE_CACHE={'ENABLED': True, 'TIMEOUT': 300})
+class ResponseCacheTestCase(BaseTestCase):
+    user_ideas_query = """
+        query($author: String){
+          userIdeas(author: $author, first: 10){edges{node{text}}}
+        }
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.extra_user
+        Idea.objects.create(text='public', author=self.author,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        Idea.objects.create(text='protected', author=self.author,
+                            visibility=Idea.VisibilityOptions.PROTECTED)
+        self.stranger = AppUser.objects.create(username='stranger',
+                                               email='fake3@email.com')
+
+    def post(self, user, query=None):
+        return self.query(query or self.user_ideas_query,
+                          variables={'author': str(self.author.id)},
+                          headers={'HTTP_AUTHORIZATION':
+                                   f'JWT {get_token(user)}'})
+
+    def get(self, user, etag=None):
+        headers = {'HTTP_AUTHORIZATION': f'JWT {get_token(user)}',
+                   'HTTP_ACCEPT': 'application/json'}
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        return self._client.get(self.GRAPHQL_URL, {
+            'query': self.user_ideas_query,
+            'variables': json.dumps({'author': str(self.author.id)}),
+        }, **headers)
+
+    @staticmethod
+    def texts(response):
+        return [edge['node']['text'] for edge
+                in response.json()['data']['userIdeas']['edges']]
+
+    def test_hit(self):
+        first = self.post(self.logged_user)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertIn('private', first['Cache-Control'])
+        with CaptureQueriesContext(connection) as queries:
+            second = self.post(self.logged_user)
+        self.assertFalse([query for query in queries
+                          if 'ideas_idea' in query['sql']])
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.content, first.content)
+
+    def test_shared_by_visibility_class(self):
+        self.post(self.logged_user)
+        response = self.post(self.stranger)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.texts(response), ['public'])
+
+        Follow.objects.create(user=self.author, follower=self.stranger,
+                              approved=True)
+        response = self.post(self.stranger)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.texts(response), ['protected', 'public'])
+        self.assertEqual(self.texts(self.post(self.logged_user)),
+                         ['public'])
+
+    def test_invalidated_by_ideas(self):
+        self.post(self.logged_user)
+        idea = Idea.objects.create(text='new', author=self.author,
+                                   visibility=Idea.VisibilityOptions.PUBLIC)
+        response = self.post(self.logged_user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.texts(response), ['new', 'public'])
+
+        idea.delete()
+        self.assertEqual(self.texts(self.post(self.logged_user)),
+                         ['public'])
+        Idea.objects.create_many([
+            Idea(text='batch', author=self.author,
+                 visibility=Idea.VisibilityOptions.PUBLIC)
+        ])
+        self.assertEqual(self.texts(self.post(self.logged_user)),
+                         ['batch', 'public'])
+
+    def test_not_modified(self):
+        etag = self.get(self.logged_user)['ETag']
+        response = self.get(self.logged_user, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        Idea.objects.create(text='new', author=self.author,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        response = self.get(self.logged_user, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_errors_are_not_revalidated(self):
+        with patch('ideas_app.ideas.schema.paginate',
+                   side_effect=Exception('unavailable')):
+            error = self.get(self.logged_user)
+        self.assertIn('errors', error.json())
+        for header in ('ETag', 'X-Cache', 'Cache-Control'):
+            self.assertNotIn(header, error)
+
+        response = self.get(self.logged_user)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(self.texts(response), ['public'])
+        self.assertEqual(self.get(self.logged_user,
+                                  response['ETag']).status_code, 304)
+
+    def test_not_cached(self):
+        mutation = 'mutation{createIdea(text: "a", visibility: PUBLIC)' \
+                   '{idea{id}}}'
+        for response in (
+            self.post(self.logged_user, mutation),
+            self.post(self.logged_user, 'query{me{username}}'),
+            self.query(self.user_ideas_query,
+                       variables={'author': str(self.author.id)}),
+        ):
+            self.assertNotIn('ETag', response)
+        with self.settings(RESPONSE_CACHE={'ENABLED': False,
+                                           'TIMEOUT': 300}):
+            self.assertNotIn('ETag', self.post(self.logged_user))
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica0'],
+                                      'STICKY_SECONDS': 5})
+class ReplicaRoutingTestCase(BaseTestCase):
+    mutation = 'mutation{createIdea(text: "a", visibility: PUBLIC){idea{id}}}'
+    query = 'query{myIdeas{edges{node{text}}}}'
+
+    def post(self, query):
+        response = self._client.post(
+            self.GRAPHQL_URL, json.dumps({'query': query}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION=f'JWT {get_token(self.logged_user)}'
+        )
+        self.assertNotIn('errors', response.json())
+        return response
+
+    def execute(self, query):
+        aliases = []
+
+        def record(request, operation_type):
+            aliases.append(read_alias(request, operation_type))
+            return aliases[-1]
+
+        with patch('ideas_app.db_router.read_alias', side_effect=record):
+            self.post(query)
+        return aliases
+
+    def test_queries_read_from_replicas(self):
+        self.assertEqual(self.execute(self.query), ['replica0'])
+        self.assertEqual(self.execute(self.mutation), ['default'])
+
+    def test_viewer_is_pinned_after_mutation(self):
+        self.execute(self.mutation)
+        self.assertTrue(is_pinned(self.logged_user))
+        self.assertFalse(is_pinned(self.extra_user))
+        self.assertEqual(self.execute(self.query), ['default'])
+
+        cache.delete(pinned_key(self.logged_user.pk))
+        self.assertEqual(self.execute(self.query), ['replica0'])
+
+    @override_settings(RESPONSE_CACHE={'ENABLED': True, 'TIMEOUT': 300})
+    def test_responses_read_from_replicas_are_not_cached(self):
+        self.assertNotIn('X-Cache', self.post(self.query))
+        self.assertNotIn('X-Cache', self.post(self.query))
+        pin_to_primary(self.logged_user)
+        self.assertEqual(self.post(self.query)['X-Cache'], 'MISS')
+        self.assertEqual(self.post(self.query)['X-Cache'], 'HIT')
+
+    def test_followees_are_cached_from_the_primary(self):
+        routes = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            routes.append(db_for_read(router, model, **hints))
+            return 'default'
+
+        with patch.object(ReplicaRouter, 'db_for_read', record), \
+                patch.object(connection, 'in_atomic_block', False), \
+                reading_from('replica0'):
+            get_followee_ids(self.logged_user.pk)
+        self.assertEqual(routes, ['default'])
+
+    def test_router(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_write(Idea), 'default')
+        with reading_from('replica0'):
+            # Test cases run inside a transaction of the primary
+            self.assertEqual(router.db_for_read(Idea), 'default')
+            with patch.object(connection, 'in_atomic_block', False):
+                self.assertEqual(router.db_for_read(Idea), 'replica0')
+        with patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(router.db_for_read(Idea), 'default')
+
+
+def post_asgi(body, token=None, headers=()):
+    headers = [(b'content-type', b'application/json'), *headers]
+    if token:
+        headers.append((b'authorization', f'JWT {token}'.encode()))
+    scope = {'type': 'http', 'method': 'POST', 'path': ASYNC_GRAPHQL_PATH,
+             'headers': headers, 'query_string': b''}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': json.dumps(body).encode()}
+
+    async def send(message):
+        messages.append(message)
+
+    async_to_sync(application)(scope, receive, send)
+    return messages[0]['status'], json.loads(messages[1]['body'])
+
+
+class AsyncGraphQLTestCase(TransactionTestCase):
+    """
+    Top-level fields run in other threads with their own connections,
+    so the data has to be committed
+    """
+    query = """
+        query dashboard{
+          myFollowers{follower{username}}
+          myFollows{user{username}}
+          timeline(first: 5){edges{node{text}}}
+        }
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = AppUser.objects.create(username='user',
+                                           email='fake1@email.com')
+        author = AppUser.objects.create(username='author',
+                                        email='fake2@email.com')
+        Follow.objects.create(user=author, follower=self.user,
+                              approved=True)
+        Follow.objects.create(user=self.user, follower=author,
+                              approved=True)
+        Idea.objects.create(text='hola', author=author,
+                            visibility=Idea.VisibilityOptions.PROTECTED)
+        self.token = get_token(self.user)
+
+    def test_split_operation(self):
+        document_ast = parse(self.query)
+        documents = split_operation(document_ast,
+                                    document_ast.definitions[0])
+        self.assertEqual(len(documents), 3)
+        for query in ('mutation{deleteIdea(ideaId: "1"){status}}',
+                      'query{me{id}, me{username}}',
+                      'query{me{id}, ...on Query{users{totalCount}}}'):
+            document_ast = parse(query)
+            self.assertIsNone(
+                split_operation(document_ast, document_ast.definitions[0])
+            )
+
+    def test_top_level_fields(self):
+        status, content = post_asgi({'query': self.query}, self.token)
+        self.assertEqual(status, 200)
+        self.assertNotIn('errors', content)
+        self.assertEqual(content['data'], {
+            'myFollowers': [{'follower': {'username': 'author'}}],
+            'myFollows': [{'user': {'username': 'author'}}],
+            'timeline': {'edges': [{'node': {'text': 'hola'}}]},
+        })
+        self.assertEqual(content['extensions']['cost']['maximum'],
+                         settings.QUERY_COST['MAX_COST'])
+
+    def test_sql_summary_of_every_field(self):
+        with self.settings(DEBUG=True):
+            _, content = post_asgi({'query': self.query}, self.token,
+                                   [(b'x-debug-sql', b'1')])
+        sql = content['extensions']['sql']
+        self.assertEqual(sql['operation'], 'dashboard')
+        self.assertTrue({'myFollowers', 'myFollows', 'timeline'}
+                        <= set(sql['resolvers']))
+
+    @override_settings(TRACING={'ENABLED': True, 'SAMPLE_RATE': 1})
+    def test_tracing_of_every_field(self):
+        _, content = post_asgi({'query': self.query}, self.token)
+        paths = {tuple(resolver['path']) for resolver
+                 in content['extensions']['tracing']['execution']['resolvers']}
+        self.assertTrue({('myFollowers',), ('myFollows',), ('timeline',)}
+                        <= paths)
+
+    def test_anonymous(self):
+        status, content = post_asgi({'query': self.query})
+        self.assertEqual(status, 200)
+        self.assertEqual(len(content['errors']), 3)
+        self.assertEqual(content['data'], {'myFollowers': None,
+                                           'myFollows': None,
+                                           'timeline': None})
+
+    def test_invalid_query(self):
+        status, content = post_asgi({'query': 'query{nope}'}, self.token)
+        self.assertEqual(status, 400)
+        self.assertNotIn('data', content)
+
+    def test_variables_must_be_an_object(self):
+        for variables in ([1], '5'):
+            status, content = post_asgi({
+                'query': 'query($first:Int){timeline(first:$first)'
+                         '{edges{cursor}}}',
+                'variables': variables,
+            }, self.token)
+            self.assertEqual(status, 400)
+            self.assertEqual(content['errors'][0]['message'],
+                             'Variables must be a JSON object')
+
+    def test_mutation(self):
+        idea = Idea.objects.get()
+        status, content = post_asgi({
+            'query': 'mutation($id:String!){deleteIdea(ideaId: $id){status}}',
+            'variables': {'id': str(idea.id)},
+        }, get_token(idea.author))
+        self.assertEqual(content['data'],
+                         {'deleteIdea': {'status': {'success': True}}})
+        self.assertFalse(Idea.objects.exists())
+
+
+HAR_PATH = os.path.join(os.path.dirname(settings.BASE_DIR),
+                        'ideas_requests.har')
+
+
+class ExportTestCase(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for number in range(3):
+            Idea.objects.create(text=f'idea {number}',
+                                author=self.logged_user)
+        Idea.objects.create(text='not mine', author=self.extra_user)
+        Follow.objects.create(user=self.logged_user,
+                              follower=self.extra_user, approved=True)
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user)
+        self.token = get_token(self.logged_user)
+
+    def get(self, token):
+        return self._client.get(EXPORT_PATH,
+                                HTTP_AUTHORIZATION=f'JWT {token}')
+
+    def assertExport(self, rows):
+        self.assertEqual([row['type'] for row in rows],
+                         ['user', 'idea', 'idea', 'idea', 'follower',
+                          'follow'])
+        self.assertEqual(rows[0]['username'], self.logged_user.username)
+        self.assertEqual([row['text'] for row in rows[1:4]],
+                         ['idea 0', 'idea 1', 'idea 2'])
+        self.assertEqual(rows[4], {'type': 'follower',
+                                   'user_id': self.extra_user.id,
+                                   'username': 'author', 'approved': True})
+        self.assertFalse(rows[5]['approved'])
+
+    @staticmethod
+    def parse(content):
+        return [json.loads(line) for line in content.splitlines()]
+
+    @override_settings(EXPORT={'CHUNK_SIZE': 2})
+    def test_streams_ndjson(self):
+        response = self.get(self.token)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        chunks = list(response.streaming_content)
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks],
+                         [2, 2, 2])
+        self.assertExport(self.parse(b''.join(chunks)))
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.get('invalid').status_code, 401)
+        self.assertEqual(
+            self._client.post(EXPORT_PATH,
+                              HTTP_AUTHORIZATION=f'JWT {self.token}')
+            .status_code, 405
+        )
+
+    def test_asgi(self):
+        scope = {'type': 'http', 'method': 'GET', 'path': EXPORT_PATH,
+                 'query_string': b'', 'headers': [
+                     (b'host', b'testserver'),
+                     (b'authorization', f'JWT {self.token}'.encode()),
+                 ]}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        # As the test client does, so the test's connection stays open
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(application)(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertExport(self.parse(b''.join(
+            message.get('body', b'') for message in messages[1:]
+        )))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_user', self.logged_user.username,
+                     chunk_size=1, stdout=out)
+        self.assertExport(self.parse(out.getvalue()))
+
+    def test_archived_ideas_come_first(self):
+        old = Idea.objects.filter(author=self.logged_user).last()
+        Idea.objects.filter(id=old.id).update(
+            created_on=timezone.now() - timedelta(days=400)
+        )
+        call_command('maintain_idea_partitions', hot_months=2,
+                     stdout=StringIO())
+        self.assertEqual(ArchivedIdea.objects.get().id, old.id)
+        rows = self.parse(b''.join(self.get(self.token).streaming_content))
+        self.assertEqual([row['text'] for row in rows[1:4]],
+                         ['idea 2', 'idea 0', 'idea 1'])
+
+
+class HarReplayTestCase(TransactionTestCase):
+    """
+    The WSGI replay runs sessions in other threads with their own
+    connections, so the data has to be committed
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_session_substitutes_ids_and_token(self):
+        user = AppUser.objects.create(username='user',
+                                      email='fake1@email.com')
+        stranger = AppUser.objects.create(username='stranger',
+                                          email='fake2@email.com')
+        requests = {request.operation: request
+                    for request in load_har(HAR_PATH)}
+        session = ReplaySession(user, [user.id, stranger.id])
+
+        headers, body = session.prepare(requests['followUser'])
+        self.assertEqual(headers['Authorization'],
+                         f'JWT {get_token(user)}')
+        self.assertIn(f'userId: "{stranger.id}"', json.loads(body)['query'])
+        # The unfollow of the recorded user targets the same new one
+        _, body = session.prepare(requests['unfollowUser'])
+        self.assertIn(f'userId: "{stranger.id}"', json.loads(body)['query'])
+
+        _, body = session.prepare(requests['changeIdeaVisibility'])
+        idea = Idea.objects.get(author=user)
+        self.assertIn(f'ideaId: "{idea.id}"', json.loads(body)['query'])
+
+        headers, _ = session.prepare(requests['users'])
+        self.assertNotIn('Authorization', headers)
+
+    def test_replay(self):
+        output = StringIO()
+        # The capture's deleteIdea selects a field the schema no longer has,
+        # and concurrent writes can lock SQLite
+        call_command('replay_har', har=HAR_PATH, seed=True, users=30,
+                     sessions=3, concurrency=1,
+                     exclude=['deleteIdea', 'register', 'verifyAccount',
+                              'resendActivationEmail', 'tokenAuth',
+                              'sendPasswordResetEmail', 'passwordReset',
+                              'passwordChange', 'updateAccount'],
+                     stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertIn('timeline', {line.split()[0] for line in lines})
+        self.assertIn('45 requests', lines[-1])
+        self.assertIn(' 0 failed', lines[-1], output.getvalue())
+
+
+class BrokerTestCase(SimpleTestCase):
+    def test_slow_subscribers_get_coalesced_messages(self):
+        async def consume():
+            broker = InMemoryBroker(queue_size=2)
+            subscription = broker.subscribe(['ideas:1'],
+                                            asyncio.get_running_loop())
+            for key, message in ((1, 'a'), (2, 'b'), (1, 'a2'), (3, 'c')):
+                broker.publish('ideas:1', key, message)
+            broker.publish('ideas:2', 4, 'other channel')
+            await asyncio.sleep(0)
+            received = [await subscription.get(), await subscription.get()]
+            subscription.close()
+            return received, broker.subscriptions
+
+        received, subscriptions = async_to_sync(consume)()
+        self.assertEqual(received, [('a2', 1), ('c', 0)])
+        self.assertEqual(dict(subscriptions), {})
+
+    def test_brokers_must_publish(self):
+        with self.assertRaises(TypeError):
+            Broker()
+
+
+@override_settings(SUBSCRIPTIONS={**settings.SUBSCRIPTIONS, 'KEEPALIVE': 0})
+class TimelineSubscriptionTestCase(TransactionTestCase):
+    subscription = 'subscription{timeline{ideaId, idea{text}, missed}}'
+
+    def setUp(self):
+        cache.clear()
+        self.user = AppUser.objects.create(username='user',
+                                           email='fake1@email.com')
+        self.author = AppUser.objects.create(username='author',
+                                             email='fake2@email.com')
+        Follow.objects.create(user=self.author, follower=self.user,
+                              approved=True)
+
+    def execute(self, query, variables=None, user=None):
+        request = RequestFactory().post('/api/')
+        request.user = user or self.author
+        return schema.execute(query, context=request, variables=variables)
+
+    async def connect(self):
+        communicator = ApplicationCommunicator(application, {
+            'type': 'websocket', 'path': SUBSCRIPTIONS_PATH, 'headers': [],
+        })
+        await communicator.send_input({'type': 'websocket.connect'})
+        accept = await communicator.receive_output()
+        self.assertEqual(accept['subprotocol'], 'graphql-ws')
+        await self.send(communicator, {
+            'type': 'connection_init',
+            'payload': {'authToken': get_token(self.user)},
+        })
+        self.assertEqual(await self.receive(communicator),
+                         {'type': 'connection_ack'})
+        return communicator
+
+    @staticmethod
+    async def send(communicator, message):
+        await communicator.send_input({'type': 'websocket.receive',
+                                       'text': json.dumps(message)})
+
+    @staticmethod
+    async def receive(communicator):
+        output = await communicator.receive_output(timeout=5)
+        return json.loads(output['text'])
+
+    @staticmethod
+    async def subscribed(channel, subscribed=True):
+        for _ in range(500):
+            if bool(get_broker().subscriptions.get(channel)) == subscribed:
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError(f'{channel} still {"un" * subscribed}'
+                             f'subscribed')
+
+    def test_followers_receive_committed_ideas(self):
+        async def run():
+            communicator = await self.connect()
+            await self.send(communicator, {
+                'type': 'start', 'id': '1',
+                'payload': {'query': self.subscription},
+            })
+            await self.subscribed(f'ideas:{self.author.id}')
+            result = await sync_to_async(self.execute)(
+                'mutation{createIdea(text: "hola", visibility: PROTECTED)'
+                '{idea{id}}}'
+            )
+            idea_id = result.data['createIdea']['idea']['id']
+            created = await self.receive(communicator)
+            await sync_to_async(self.execute)(
+                'mutation($id: String){changeIdeaVisibility('
+                'ideaId: $id, visibility: PRIVATE){idea{id}}}',
+                {'id': idea_id}
+            )
+            hidden = await self.receive(communicator)
+            await self.send(communicator, {'type': 'stop', 'id': '1'})
+            complete = await self.receive(communicator)
+            await communicator.send_input({'type': 'websocket.disconnect'})
+            return idea_id, created, hidden, complete
+
+        idea_id, created, hidden, complete = async_to_sync(run)()
+        self.assertEqual(created['payload']['data']['timeline'], {
+            'ideaId': idea_id, 'idea': {'text': 'hola'}, 'missed': 0,
+        })
+        self.assertEqual(hidden['payload']['data']['timeline'], {
+            'ideaId': idea_id, 'idea': None, 'missed': 0,
+        })
+        self.assertEqual(complete, {'type': 'complete', 'id': '1'})
+        self.assertNotIn(f'ideas:{self.author.id}',
+                         get_broker().subscriptions)
+
+    def test_unfollowing_leaves_the_author_channel(self):
+        async def run():
+            communicator = await self.connect()
+            await self.send(communicator, {
+                'type': 'start', 'id': '1',
+                'payload': {'query': self.subscription},
+            })
+            await self.subscribed(f'ideas:{self.author.id}')
+            await sync_to_async(self.execute)(
+                'mutation($id: String!){unfollowUser(userId: $id)'
+                '{success}}', {'id': str(self.author.id)}, user=self.user
+            )
+            await self.subscribed(f'ideas:{self.author.id}', False)
+            await communicator.send_input({'type': 'websocket.disconnect'})
+
+        async_to_sync(run)()
+
+    def test_private_creations_are_not_published(self):
+        with patch.object(get_broker(), 'publish') as publish:
+            self.execute('mutation{createIdea(text: "secret", '
+                         'visibility: PRIVATE){idea{id}}}')
+            self.execute('mutation{createIdeas(ideas: [{text: "secret", '
+                         'visibility: PRIVATE}]){results{errors}}}')
+        publish.assert_not_called()
+
+    def test_hidden_ideas_are_only_sent_to_remove_them(self):
+        idea = Idea.objects.create(text='secret', author=self.author,
+                                   visibility=Idea.VisibilityOptions.PRIVATE)
+        seen = set()
+
+        def event(missed=0):
+            return timeline_event(self.user, None, seen,
+                                  ({'idea_id': idea.id}, missed))
+
+        self.assertIsNone(event())
+        dropped = event(missed=2)
+        self.assertEqual((dropped.idea, dropped.missed), (None, 2))
+        Idea.objects.filter(id=idea.id).update(
+            visibility=Idea.VisibilityOptions.PROTECTED
+        )
+        self.assertEqual(event().idea, idea)
+        Idea.objects.filter(id=idea.id).update(
+            visibility=Idea.VisibilityOptions.PRIVATE
+        )
+        hidden = event()
+        self.assertEqual((hidden.idea_id, hidden.idea), (idea.id, None))
+        self.assertIsNone(event())
+
+    def test_anonymous_subscription(self):
+        async def run():
+            communicator = await self.connect()
+            await self.send(communicator, {
+                'type': 'connection_init', 'payload': {},
+            })
+            await self.receive(communicator)
+            await self.send(communicator, {
+                'type': 'start', 'id': '1',
+                'payload': {'query': self.subscription},
+            })
+            data = await self.receive(communicator)
+            complete = await self.receive(communicator)
+            await communicator.send_input({'type': 'websocket.disconnect'})
+            return data, complete
+
+        data, complete = async_to_sync(run)()
+        self.assertEqual(data['payload']['data'], None)
+        self.assertEqual(len(data['payload']['errors']), 1)
+        self.assertEqual(complete['type'], 'complete')
+
+    def start(self, payload):
+        async def run():
+            communicator = await self.connect()
+            await self.send(communicator, {
+                'type': 'start', 'id': '1', 'payload': payload,
+            })
+            message = await self.receive(communicator)
+            await communicator.send_input({'type': 'websocket.disconnect'})
+            return message
+
+        return async_to_sync(run)()
+
+    def test_only_subscriptions(self):
+        message = self.start({'query': '{me{username}}'})
+        self.assertIsNone(message['payload']['data'])
+        self.assertEqual(message['payload']['errors'][0]['message'],
+                         'Only subscriptions are served over websockets')
+
+    def test_strict_mode_rejects_unregistered_subscriptions(self):
+        strict = PersistedQueries(strict=True, registry={
+            query_hash(self.subscription): self.subscription
+        })
+
+        async def run():
+            communicator = await self.connect()
+            await self.send(communicator, {
+                'type': 'start', 'id': '1',
+                'payload': {'query': self.subscription},
+            })
+            message = await self.receive(communicator)
+            await self.send(communicator, {
+                'type': 'start', 'id': '2',
+                'payload': {'extensions': {'persistedQuery': {
+                    'version': 1,
+                    'sha256Hash': query_hash(self.subscription),
+                }}},
+            })
+            await self.subscribed(f'ideas:{self.author.id}')
+            await communicator.send_input({'type': 'websocket.disconnect'})
+            return message
+
+        with patch.object(websocket_application, 'persisted_queries',
+                          strict):
+            message = async_to_sync(run)()
+        self.assertEqual(message, {
+            'type': 'error', 'id': '1',
+            'payload': {'message': 'Only persisted queries are allowed'},
+        })
+
+    def test_costly_subscriptions_report_their_cost(self):
+        with override_settings(QUERY_COST={**settings.QUERY_COST,
+                                           'MAX_COST': 1}):
+            payload = self.start({'query': self.subscription})['payload']
+        self.assertIsNone(payload['data'])
+        self.assertEqual(payload['extensions']['cost']['maximum'], 1)
+        self.assertIn('exceeds the maximum cost',
+                      payload['errors'][0]['message'])
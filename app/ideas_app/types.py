@@ -1,7 +1,39 @@
 import graphene
+from graphql import GraphQLError
+
+MAX_BATCH_SIZE = 5000
 
 
 class SuccessType(graphene.Scalar):
     @staticmethod
     def serialize(success):
         return {"success": success}
+
+
+class ItemResult(graphene.ObjectType):
+    """
+    Outcome of one item of a batch mutation
+    """
+    id = graphene.ID()
+    success = graphene.Boolean()
+    errors = graphene.List(graphene.String)
+
+
+def check_batch_size(items):
+    if len(items) > MAX_BATCH_SIZE:
+        raise GraphQLError(
+            f"At most {MAX_BATCH_SIZE} items can be sent at once"
+        )
+
+
+def parse_ids(ids):
+    """
+    Integer value of every id that is one, so lookups never fail on them
+    """
+    parsed = {}
+    for item_id in ids:
+        try:
+            parsed[item_id] = int(item_id)
+        except (TypeError, ValueError):
+            pass
+    return parsed
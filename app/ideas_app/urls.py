@@ -17,9 +17,11 @@ from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
 
-from graphene_django.views import GraphQLView
+from ideas_app.export import export_view
+from ideas_app.views import IdeasGraphQLView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', csrf_exempt(GraphQLView.as_view(graphiql=True)))
+    path('api/', csrf_exempt(IdeasGraphQLView.as_view(graphiql=True))),
+    path('api/export/', export_view),
 ]
@@ -0,0 +1 @@
+default_app_config = 'ideas_app.users.apps.UsersConfig'
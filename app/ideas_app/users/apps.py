@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 
 class UsersConfig(AppConfig):
-    name = 'users'
+    name = 'ideas_app.users'
+
+    def ready(self):
+        import ideas_app.users.signals  # noqa: F401
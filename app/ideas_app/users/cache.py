@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from ideas_app.db_router import reading_from
+from ideas_app.users.models import Follow
+
+
+def followees_key(user_id):
+    return f'followees:{user_id}'
+
+
+def get_followee_ids(user_id):
+    """
+    Ids of the users `user_id` is an approved follower of. Misses are
+    read from the primary: a lagging replica would cache stale ids until
+    the next invalidation
+    """
+    followee_ids = cache.get(followees_key(user_id))
+    if followee_ids is None:
+        with reading_from(DEFAULT_DB_ALIAS):
+            followee_ids = list(Follow.objects.filter(
+                follower=user_id, approved=True
+            ).values_list('user_id', flat=True))
+        cache.set(followees_key(user_id), followee_ids,
+                  settings.FOLLOWEES_CACHE_TIMEOUT)
+    return followee_ids
+
+
+def invalidate_followees(user_id):
+    # Deleting again on commit stops a concurrent request from caching the
+    # pre-commit followees in between
+    cache.delete(followees_key(user_id))
+    transaction.on_commit(lambda: cache.delete(followees_key(user_id)))
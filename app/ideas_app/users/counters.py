@@ -0,0 +1,117 @@
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from ideas_app.users.models import AppUser, Follow
+
+BATCH_SIZE = 1000
+COUNTERS = ('followers_count', 'following_count', 'ideas_count')
+
+_batch = threading.local()
+
+
+def _apply(deltas):
+    # One UPDATE per counter and delta, whatever the number of users
+    user_ids = defaultdict(list)
+    for (user_id, field), delta in deltas.items():
+        if delta:
+            user_ids[field, delta].append(user_id)
+    for (field, delta), ids in user_ids.items():
+        AppUser.objects.filter(id__in=ids).update(**{field: F(field) + delta})
+
+
+def adjust_counters(user_id, **deltas):
+    """
+    Adds `deltas` to the counters of `user_id` with an atomic UPDATE,
+    e.g. adjust_counters(user.id, ideas_count=1)
+    """
+    pending = getattr(_batch, 'deltas', None)
+    if pending is None:
+        _apply({(user_id, field): delta for field, delta in deltas.items()})
+        return
+    for field, delta in deltas.items():
+        pending[user_id, field] += delta
+
+
+def count_follow(follow, delta):
+    """
+    Counts an approved follow (delta 1) or uncounts it (delta -1)
+    """
+    adjust_counters(follow.user_id, followers_count=delta)
+    adjust_counters(follow.follower_id, following_count=delta)
+
+
+@contextmanager
+def batched_counters():
+    """
+    Holds the counter updates of the block and applies them summed when
+    it ends, so bulk operations don't issue one UPDATE per row
+    """
+    if getattr(_batch, 'deltas', None) is not None:
+        yield
+        return
+    _batch.deltas = Counter()
+    try:
+        yield
+        deltas = _batch.deltas
+    finally:
+        _batch.deltas = None
+    _apply(deltas)
+
+
+def actual_counts():
+    """
+    Counter expressions computed from Follow and Idea rows, archived
+    ideas included
+    """
+    # ideas.models imports this module
+    from ideas_app.ideas.models import ArchivedIdea, Idea
+
+    def count(queryset, field):
+        return Coalesce(Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('*')).values('total')
+        ), 0)
+
+    approved = Follow.objects.filter(approved=True)
+    return {
+        'followers_count': count(approved, 'user'),
+        'following_count': count(approved, 'follower'),
+        'ideas_count': (count(Idea.objects.all(), 'author')
+                        + count(ArchivedIdea.objects.all(), 'author')),
+    }
+
+
+def reconcile_counters(users=None, batch_size=BATCH_SIZE):
+    """
+    Rewrites the counters that drifted from the rows they count, one
+    transaction per batch of users. Returns the users repaired
+    """
+    users = (AppUser.objects.all() if users is None else users).order_by('pk')
+    drifted = reduce(or_, [~Q(**{field: F(f'actual_{field}')})
+                           for field in COUNTERS])
+    repaired = last_id = 0
+    while True:
+        ids = list(users.filter(pk__gt=last_id).values_list(
+            'pk', flat=True
+        )[:batch_size])
+        if not ids:
+            return repaired
+        last_id = ids[-1]
+        with transaction.atomic():
+            drifted_ids = list(AppUser.objects.filter(pk__in=ids).annotate(
+                **{f'actual_{field}': expression
+                   for field, expression in actual_counts().items()}
+            ).filter(drifted).values_list('pk', flat=True))
+            if drifted_ids:
+                AppUser.objects.filter(pk__in=drifted_ids).update(
+                    **actual_counts()
+                )
+        repaired += len(drifted_ids)
@@ -0,0 +1,240 @@
+import heapq
+import os
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from ideas_app.users.models import Follow, FollowGraphChange, SuggestedUser
+
+BATCH_SIZE = 1000
+
+
+def _chunks(values, size=BATCH_SIZE):
+    values = iter(values)
+    while True:
+        chunk = list(islice(values, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+class FollowGraph:
+    """
+    Approved follows in compressed sparse row form: the followees of
+    users[i] are followees[offsets[i]:offsets[i + 1]], both sorted by id
+    """
+
+    def __init__(self, users=None, offsets=None, followees=None):
+        self.users = users if users is not None else array('q')
+        self.offsets = offsets if offsets is not None else array('q', [0])
+        self.followees = followees if followees is not None else array('q')
+
+    @classmethod
+    def from_edges(cls, edges):
+        """
+        Graph of (follower_id, user_id) pairs sorted by follower and user
+        """
+        graph = cls()
+        for follower_id, pairs in groupby(edges, key=lambda edge: edge[0]):
+            graph.followees.extend(user_id for _, user_id in pairs)
+            graph.users.append(follower_id)
+            graph.offsets.append(len(graph.followees))
+        return graph
+
+    @classmethod
+    def from_database(cls):
+        return cls.from_edges(Follow.objects.filter(approved=True).order_by(
+            'follower_id', 'user_id'
+        ).values_list('follower_id', 'user_id').iterator(chunk_size=10000))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Graph saved by save(): the number of users and of followees, then
+        the users, offsets and followees arrays, all as raw int64
+        """
+        graph = cls(array('q'), array('q'), array('q'))
+        with open(path, 'rb') as graph_file:
+            sizes = array('q')
+            sizes.fromfile(graph_file, 2)
+            users, followees = sizes
+            graph.users.fromfile(graph_file, users)
+            graph.offsets.fromfile(graph_file, users + 1)
+            graph.followees.fromfile(graph_file, followees)
+        return graph
+
+    def save(self, path):
+        # Readers never see a half written file
+        temporary = f'{path}.tmp'
+        with open(temporary, 'wb') as graph_file:
+            array('q', [len(self.users), len(self.followees)]).tofile(
+                graph_file
+            )
+            self.users.tofile(graph_file)
+            self.offsets.tofile(graph_file)
+            self.followees.tofile(graph_file)
+        os.replace(temporary, path)
+
+    @property
+    def edges(self):
+        return len(self.followees)
+
+    def _row(self, user_id):
+        index = bisect_left(self.users, user_id)
+        if index < len(self.users) and self.users[index] == user_id:
+            return index
+        return None
+
+    def followees_of(self, user_id):
+        index = self._row(user_id)
+        if index is None:
+            return self.followees[0:0]
+        return self.followees[self.offsets[index]:self.offsets[index + 1]]
+
+    def replace(self, rows):
+        """
+        New graph where the followees of each user in `rows` are the given
+        ones, users mapped to no followees are removed
+        """
+        graph = FollowGraph()
+        previous = 0
+        for user_id in sorted(rows):
+            index = bisect_left(self.users, user_id, previous)
+            graph._copy_rows(self, previous, index)
+            if index < len(self.users) and self.users[index] == user_id:
+                index += 1
+            if rows[user_id]:
+                graph.users.append(user_id)
+                graph.followees.extend(sorted(rows[user_id]))
+                graph.offsets.append(len(graph.followees))
+            previous = index
+        graph._copy_rows(self, previous, len(self.users))
+        return graph
+
+    def _copy_rows(self, source, start, end):
+        if start == end:
+            return
+        shift = len(self.followees) - source.offsets[start]
+        self.users.extend(source.users[start:end])
+        self.followees.extend(
+            source.followees[source.offsets[start]:source.offsets[end]]
+        )
+        self.offsets.extend(
+            offset + shift for offset in source.offsets[start + 1:end + 1]
+        )
+
+    def suggestions(self, user_id, limit):
+        """
+        Up to `limit` (user id, mutual) pairs of the users followed by the
+        followees of `user_id` and not by `user_id` itself, most mutual
+        followees first
+        """
+        followees = self.followees_of(user_id)
+        mutual = Counter()
+        for followee_id in followees:
+            mutual.update(self.followees_of(followee_id))
+        mutual.pop(user_id, None)
+        for followee_id in followees:
+            mutual.pop(followee_id, None)
+        return heapq.nsmallest(limit, mutual.items(),
+                               key=lambda item: (-item[1], item[0]))
+
+
+def graph_path():
+    return settings.FOLLOW_GRAPH['PATH']
+
+
+def mark_changed(follower_ids):
+    """
+    Records that the approved followees of `follower_ids` changed, for the
+    next incremental refresh
+    """
+    FollowGraphChange.objects.bulk_create(
+        [FollowGraphChange(follower_id=follower_id)
+         for follower_id in set(follower_ids)],
+        ignore_conflicts=True
+    )
+
+
+def _insert_suggestions(graph, user_ids):
+    limit = settings.FOLLOW_GRAPH['SUGGESTIONS']
+    rows = (
+        (user_id, suggested_id, mutual)
+        for user_id in user_ids
+        for suggested_id, mutual in graph.suggestions(user_id, limit)
+    )
+    # Plain tuples: building a model instance per row costs more than the
+    # INSERT itself
+    table = SuggestedUser._meta.db_table
+    total = 0
+    with connection.cursor() as cursor:
+        for chunk in _chunks(rows, 10000):
+            cursor.executemany(
+                f'INSERT INTO {table} (user_id, suggested_id, mutual) '
+                f'VALUES (%s, %s, %s)', chunk
+            )
+            total += len(chunk)
+    return total
+
+
+def write_suggestions(graph, user_ids=None):
+    """
+    Replaces the SuggestedUser rows of `user_ids`, of every user when None
+    """
+    if user_ids is None:
+        SuggestedUser.objects.all().delete()
+        user_ids = graph.users
+    else:
+        for chunk in _chunks(user_ids):
+            SuggestedUser.objects.filter(user__in=chunk).delete()
+    return _insert_suggestions(graph, user_ids)
+
+
+@transaction.atomic
+def build(path=None):
+    """
+    Builds the follow graph from every approved follow and the
+    suggestions of every user
+    """
+    path = path or graph_path()
+    FollowGraphChange.objects.all().delete()
+    graph = FollowGraph.from_database()
+    suggestions = write_suggestions(graph)
+    graph.save(path)
+    return graph, suggestions
+
+
+@transaction.atomic
+def refresh(path=None):
+    """
+    Applies the follows changed since the last build or refresh to the
+    saved graph and rewrites the suggestions they affect
+    """
+    path = path or graph_path()
+    if not os.path.exists(path):
+        return build(path)
+    changed = list(FollowGraphChange.objects.select_for_update().values_list(
+        'follower_id', flat=True
+    ))
+    rows = {follower_id: [] for follower_id in changed}
+    # A user's suggestions go through their followees, so the followers of
+    # a changed user are affected too
+    affected = set(changed)
+    for chunk in _chunks(changed):
+        for follower_id, user_id in Follow.objects.filter(
+            follower__in=chunk, approved=True
+        ).values_list('follower_id', 'user_id'):
+            rows[follower_id].append(user_id)
+        affected.update(Follow.objects.filter(
+            user__in=chunk, approved=True
+        ).values_list('follower_id', flat=True))
+    graph = FollowGraph.load(path).replace(rows)
+    suggestions = write_suggestions(graph, sorted(affected))
+    for chunk in _chunks(changed):
+        FollowGraphChange.objects.filter(follower__in=chunk).delete()
+    graph.save(path)
+    return graph, suggestions
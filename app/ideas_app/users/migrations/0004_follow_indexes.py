@@ -0,0 +1,39 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:44
+
+from django.db import migrations, models
+
+
+def remove_duplicate_follows(apps, schema_editor):
+    Follow = apps.get_model('users', 'Follow')
+    duplicates = Follow.objects.values('user', 'follower').annotate(
+        total=models.Count('id')
+    ).filter(total__gt=1)
+    for pair in duplicates.iterator():
+        follow_ids = list(Follow.objects.filter(
+            user=pair['user'], follower=pair['follower']
+        ).order_by('-approved', 'id').values_list('id', flat=True))
+        Follow.objects.filter(id__in=follow_ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20200722_1904'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_follows,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('user', 'follower'), name='unique_follow'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['user', 'approved'], name='follow_user_approved_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(condition=models.Q(approved=True), fields=['follower'], name='follow_follower_approved_idx'),
+        ),
+    ]
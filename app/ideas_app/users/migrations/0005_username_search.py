@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from ideas_app.users.search import create_username_index, drop_username_index
+
+
+def create_index(apps, schema_editor):
+    create_username_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    drop_username_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_follow_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.0.8 on 2026-10-18 13:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from ideas_app.users.search import create_username_index
+
+
+def count_rows(apps, schema_editor):
+    AppUser = apps.get_model('users', 'AppUser')
+    Follow = apps.get_model('users', 'Follow')
+    Idea = apps.get_model('ideas', 'Idea')
+
+    def count(queryset, field):
+        return Coalesce(Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('*')).values('total')
+        ), 0)
+
+    approved = Follow.objects.filter(approved=True)
+    AppUser.objects.update(
+        followers_count=count(approved, 'user'),
+        following_count=count(approved, 'follower'),
+        ideas_count=count(Idea.objects.all(), 'author'),
+    )
+
+
+def recreate_username_index(apps, schema_editor):
+    # Adding the columns remade users_appuser on SQLite, dropping the
+    # triggers of the username search table
+    create_username_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_follow_suggestions'),
+        ('ideas', '0004_idea_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appuser',
+            name='followers_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='appuser',
+            name='following_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='appuser',
+            name='ideas_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(recreate_username_index,
+                             migrations.RunPython.noop),
+        migrations.RunPython(count_rows, migrations.RunPython.noop),
+    ]
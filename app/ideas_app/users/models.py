@@ -6,13 +6,66 @@ from django.contrib.auth.models import AbstractUser
 class AppUser(AbstractUser):
     email = models.EmailField(max_length=255, unique=True)
     username = models.CharField(max_length=40, unique=True)
+    # Denormalized, see ideas_app.users.counters
+    followers_count = models.IntegerField(default=0)
+    following_count = models.IntegerField(default=0)
+    ideas_count = models.IntegerField(default=0)
     USERNAME_FIELD = "username"
     EMAIL_FIELD = "email"
 
 
 class Follow(models.Model):
+    # `approved` as last read or written, the counters change with it
+    approved_in_db = False
+
     approved = models.BooleanField(default=False)
     user = models.ForeignKey(AppUser, related_name='user', on_delete=CASCADE)
     follower = models.ForeignKey(AppUser, related_name='follower',
                                  on_delete=CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'follower'],
+                                    name='unique_follow'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'approved'],
+                         name='follow_user_approved_idx'),
+            models.Index(fields=['follower'],
+                         condition=models.Q(approved=True),
+                         name='follow_follower_approved_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        follow = super().from_db(db, field_names, values)
+        follow.approved_in_db = follow.approved
+        return follow
+
+
+class SuggestedUser(models.Model):
+    """
+    Precomputed "people you may know": `suggested` is followed by `mutual`
+    of the approved followees of `user`. See ideas_app.users.graph
+    """
+    user = models.ForeignKey(AppUser, related_name='suggestions',
+                             on_delete=CASCADE)
+    suggested = models.ForeignKey(AppUser, related_name='+',
+                                  on_delete=CASCADE)
+    mutual = models.PositiveIntegerField()
+
+    class Meta:
+        # The only index: rows are written in bulk and read a page at a time
+        indexes = [
+            models.Index(fields=['user', '-mutual', 'suggested'],
+                         name='suggestion_rank_idx'),
+        ]
+
+
+class FollowGraphChange(models.Model):
+    """
+    Follower whose approved followees changed since the follow graph was
+    last refreshed
+    """
+    follower = models.OneToOneField(AppUser, primary_key=True,
+                                    related_name='+', on_delete=CASCADE)
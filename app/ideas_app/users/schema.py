@@ -1,55 +1,148 @@
 import graphene
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from graphql import GraphQLError
+from graphql_auth.schema import UserNode
+from graphql_auth.settings import graphql_auth_settings
 from graphql_jwt.decorators import login_required
+from graphene_django.filter.fields import DjangoFilterConnectionField
 from graphene_django.types import DjangoObjectType
 
-from ideas_app.users.models import AppUser, Follow
-from ideas_app.types import SuccessType
+from ideas_app.ideas.models import TimelineEntry
+from ideas_app.ideas.subscriptions import publish_follow
+from ideas_app.loaders import get_loaders, load_related
+from ideas_app.pagination import connection_field, paginate
+from ideas_app.projection import project
+from ideas_app.response_cache import invalidate_users
+from ideas_app.types import (ItemResult, SuccessType, check_batch_size,
+                             parse_ids)
+from ideas_app.users.cache import invalidate_followees
+from ideas_app.users.counters import batched_counters, count_follow
+from ideas_app.users.graph import mark_changed
+from ideas_app.users.models import AppUser, Follow, SuggestedUser
+from ideas_app.users.search import users_matching
 
 
 class AppUserType(DjangoObjectType):
     class Meta:
         model = AppUser
-        fields = ['username']
+        fields = ['username', 'followers_count', 'following_count',
+                  'ideas_count']
+    # Columns read by the resolvers of non-model fields, see projection
+    field_columns = {'user_id': ['id']}
     user_id = graphene.String()
 
     def resolve_user_id(self, info):
         return self.pk
 
 
+class AppUserConnection(graphene.relay.Connection):
+    class Meta:
+        node = AppUserType
+
+
 class FollowType(DjangoObjectType):
     class Meta:
         model = Follow
 
+    def resolve_user(self, info):
+        return load_related(info, self, 'user', 'user')
+
+    def resolve_follower(self, info):
+        return load_related(info, self, 'follower', 'user')
+
+
+class AppUserNode(UserNode):
+    """
+    graphql_auth UserNode with its reverse sets batched by the request loaders
+    """
+    class Meta:
+        model = AppUser
+        filter_fields = graphql_auth_settings.USER_NODE_FILTER_FIELDS
+        exclude = graphql_auth_settings.USER_NODE_EXCLUDE_FIELDS
+        interfaces = (graphene.relay.Node,)
+        skip_registry = True
+
+    def resolve_idea_set(self, info):
+        return get_loaders(info.context).ideas_by_author.load(self.pk)
+
+    def resolve_user(self, info):
+        return get_loaders(info.context).follows_by_user.load(self.pk)
+
+    def resolve_follower(self, info):
+        return get_loaders(info.context).follows_by_follower.load(self.pk)
+
+
+class UserQuery(graphene.ObjectType):
+    user = graphene.relay.Node.Field(AppUserNode)
+    users = DjangoFilterConnectionField(AppUserNode)
+
+
+class MeQuery(graphene.ObjectType):
+    me = graphene.Field(AppUserNode)
+
+    def resolve_me(self, info):
+        user = info.context.user
+        if user.is_authenticated:
+            return user
+        return None
+
 
 class FollowQuery:
     my_followers = graphene.List(FollowType)
     my_follows = graphene.List(FollowType)
     my_pending_followers = graphene.List(FollowType)
 
+    # Follow.from_db reads `approved`, deferring it costs a query per row
     @login_required
     def resolve_my_followers(self, info):
-        return Follow.objects.filter(user=info.context.user,
-                                     approved=True)
+        return project(Follow.objects.filter(user=info.context.user,
+                                             approved=True),
+                       info, required=['approved'])
 
     @login_required
     def resolve_my_follows(self, info):
-        return Follow.objects.filter(follower=info.context.user,
-                                     approved=True)
+        return project(Follow.objects.filter(follower=info.context.user,
+                                             approved=True),
+                       info, required=['approved'])
 
     @login_required
     def resolve_my_pending_followers(self, info):
-        return Follow.objects.filter(user=info.context.user,
-                                     approved=False)
+        return project(Follow.objects.filter(user=info.context.user,
+                                             approved=False),
+                       info, required=['approved'])
 
 
 class AppUserQuery:
-    search_by_username = graphene.List(
-        AppUserType, search=graphene.String())
+    search_by_username = connection_field(
+        AppUserConnection, search=graphene.String(required=True),
+        first=graphene.Int(required=True))
+    suggested_users = connection_field(
+        AppUserConnection,
+        description="Users followed by your followees, most shared first")
+
+    @login_required
+    def resolve_search_by_username(self, info, search, first, after=None):
+        users = project(users_matching(search), info, ('edges', 'node'),
+                        required=['username'])
+        return paginate(users, AppUserConnection, first, after,
+                        ordering=('rank', 'username', 'id'))
 
     @login_required
-    def resolve_search_by_username(self, info, search):
-        return AppUser.objects.filter(username__contains=search)
+    def resolve_suggested_users(self, info, first=None, after=None):
+        viewer = info.context.user
+        # Skips the users followed or requested since the last refresh
+        suggestions = SuggestedUser.objects.filter(
+            ~Exists(Follow.objects.filter(follower=viewer,
+                                          user=OuterRef('suggested'))),
+            user=viewer
+        )
+        suggestions = project(suggestions, info, ('edges', 'node'),
+                              prefix='suggested__',
+                              required=['mutual', 'suggested'])
+        return paginate(suggestions, AppUserConnection, first, after,
+                        ordering=('-mutual', 'suggested_id'),
+                        node=lambda suggestion: suggestion.suggested)
 
 
 class FollowUserMutation(graphene.Mutation):
@@ -90,14 +183,69 @@ class ApproveFollowerMutation(graphene.Mutation):
 
     @login_required
     def mutate(self, info, follow_request_id, approved):
-        follow = Follow.objects.get(
-            id=follow_request_id
-        )
-        follow.approved = approved
-        follow.save()
+        # Locked until the counters are updated: a concurrent approval
+        # waits and then reads the request as already approved
+        with transaction.atomic():
+            follow = Follow.objects.select_for_update().get(
+                id=follow_request_id, user=info.context.user
+            )
+            follow.approved = approved
+            follow.save()
+            TimelineEntry.objects.sync_follow(follow)
+            publish_follow(follow, follow.approved)
         return ApproveFollowerMutation(follow=follow)
 
 
+class BatchApproveFollowersMutation(graphene.Mutation):
+    """
+    Approves or rejects many follow requests made to the user with one
+    UPDATE. Requests to other users are reported as not found
+    """
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.String),
+                            required=True,
+                            description="Follow request identifiers")
+        approved = graphene.Boolean(required=True,
+                                    description="Approve or reject follows")
+
+    results = graphene.List(ItemResult)
+
+    @login_required
+    def mutate(self, info, ids, approved):
+        check_batch_size(ids)
+        parsed_ids = parse_ids(ids)
+        with transaction.atomic():
+            follows = Follow.objects.select_for_update().filter(
+                id__in=set(parsed_ids.values()), user=info.context.user
+            )
+            found = {follow.id: follow for follow in follows}
+            changed = [follow for follow in found.values()
+                       if follow.approved != approved]
+            follows.filter(
+                id__in=[follow.id for follow in changed]
+            ).update(approved=approved)
+
+            # update() skips Follow.save and its signals
+            with batched_counters():
+                for follow in changed:
+                    follow.approved = follow.approved_in_db = approved
+                    invalidate_followees(follow.follower_id)
+                    count_follow(follow, 1 if approved else -1)
+                    publish_follow(follow, approved)
+            TimelineEntry.objects.sync_follows(changed)
+            mark_changed(follow.follower_id for follow in changed)
+            invalidate_users([follow.user_id for follow in changed]
+                             + [follow.follower_id for follow in changed])
+
+        return BatchApproveFollowersMutation(results=[
+            ItemResult(id=follow_id, success=True, errors=[])
+            if parsed_ids.get(follow_id) in found else
+            ItemResult(id=follow_id, success=False,
+                       errors=['Follow request not found'])
+            for follow_id in ids
+        ])
+
+
 class UnfollowMutation(graphene.Mutation):
     class Arguments:
         user_id = graphene.String(required=True,
@@ -111,7 +259,11 @@ class UnfollowMutation(graphene.Mutation):
             user=user_id,
             follower=info.context.user
         )
-        follow.delete()
+        # The timeline is only pruned along with the follow
+        with transaction.atomic():
+            TimelineEntry.objects.remove_follow(follow)
+            follow.delete()
+            publish_follow(follow, False)
         return UnfollowMutation(success=True)
 
 
@@ -128,12 +280,17 @@ class DeleteFollowerMutation(graphene.Mutation):
             user=info.context.user,
             follower=follower_id
         )
-        follow.delete()
+        # The timeline is only pruned along with the follow
+        with transaction.atomic():
+            TimelineEntry.objects.remove_follow(follow)
+            follow.delete()
+            publish_follow(follow, False)
         return UnfollowMutation(success=True)
 
 
 class FollowMutation(graphene.ObjectType):
     follow_user = FollowUserMutation.Field()
     approve_follower = ApproveFollowerMutation.Field()
+    approve_followers = BatchApproveFollowersMutation.Field()
     unfollow_user = UnfollowMutation.Field()
     delete_follower = DeleteFollowerMutation.Field()
@@ -0,0 +1,94 @@
+import sqlite3
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+
+from ideas_app.users.models import AppUser
+
+POSTGRES_TRIGRAM_INDEX = 'users_appuser_username_trgm_idx'
+SQLITE_FTS_TABLE = 'users_appuser_username_fts'
+# The trigram index only serves LIKE patterns without an ESCAPE clause
+LIKE_SPECIAL_CHARACTERS = ('%', '_', '\\')
+
+SQLITE_FTS_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        username, content='users_appuser', content_rowid='id',
+        tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_insert
+    AFTER INSERT ON users_appuser BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, username)
+        VALUES (new.id, new.username);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_delete
+    AFTER DELETE ON users_appuser BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, username)
+        VALUES ('delete', old.id, old.username);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_update
+    AFTER UPDATE OF username ON users_appuser BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, username)
+        VALUES ('delete', old.id, old.username);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, username)
+        VALUES (new.id, new.username);
+    END""",
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def create_username_index(schema_editor):
+    """
+    Substring search index: pg_trgm GIN on Postgres, FTS5 trigram table
+    kept in sync by triggers on SQLite >= 3.34. SQLite drops triggers
+    when it remakes users_appuser, so migrations altering that table must
+    call this again
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {POSTGRES_TRIGRAM_INDEX} '
+            f'ON users_appuser USING gin (username gin_trgm_ops)'
+        )
+    elif vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+        for statement in SQLITE_FTS_STATEMENTS:
+            schema_editor.execute(statement)
+
+
+def drop_username_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_TRIGRAM_INDEX}')
+    elif vendor == 'sqlite':
+        for action in ('insert', 'delete', 'update'):
+            schema_editor.execute(
+                f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_{action}'
+            )
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+
+def has_sqlite_fts():
+    return (connection.vendor == 'sqlite'
+            and SQLITE_FTS_TABLE in connection.introspection.table_names())
+
+
+def users_matching(search):
+    """
+    Users whose username contains `search`, prefix matches first
+    (rank 0) and then the rest (rank 1)
+    """
+    users = AppUser.objects.filter(username__contains=search)
+    indexable = (len(search) >= 3 and not any(
+        character in search for character in LIKE_SPECIAL_CHARACTERS
+    ))
+    if indexable and has_sqlite_fts():
+        users = AppUser.objects.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE username LIKE %s',
+            [f'%{search}%']
+        ))
+    return users.annotate(rank=Case(
+        When(username__startswith=search, then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    ))
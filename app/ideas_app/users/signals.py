@@ -0,0 +1,56 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from ideas_app.ideas.models import ArchivedIdea, Idea
+from ideas_app.response_cache import invalidate_users
+from ideas_app.users.cache import invalidate_followees
+from ideas_app.users.counters import adjust_counters, count_follow
+from ideas_app.users.graph import mark_changed
+from ideas_app.users.models import AppUser, Follow
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    # A new pending request does not change anybody's followees
+    if not created or instance.approved:
+        invalidate_followees(instance.follower_id)
+        mark_changed([instance.follower_id])
+    if instance.approved != instance.approved_in_db:
+        count_follow(instance, 1 if instance.approved else -1)
+        instance.approved_in_db = instance.approved
+        invalidate_users([instance.user_id, instance.follower_id])
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    if instance.approved:
+        invalidate_followees(instance.follower_id)
+        mark_changed([instance.follower_id])
+    if instance.approved_in_db:
+        count_follow(instance, -1)
+        invalidate_users([instance.user_id, instance.follower_id])
+
+
+@receiver(post_save, sender=Idea)
+def idea_saved(sender, instance, created, **kwargs):
+    if created:
+        adjust_counters(instance.author_id, ideas_count=1)
+    invalidate_users([instance.author_id])
+
+
+@receiver(post_delete, sender=Idea)
+@receiver(post_delete, sender=ArchivedIdea)
+def idea_deleted(sender, instance, **kwargs):
+    adjust_counters(instance.author_id, ideas_count=-1)
+    invalidate_users([instance.author_id])
+
+
+@receiver(post_save, sender=ArchivedIdea)
+def archived_idea_saved(sender, instance, **kwargs):
+    invalidate_users([instance.author_id])
+
+
+@receiver(post_save, sender=AppUser)
+def user_saved(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_users([instance.id])
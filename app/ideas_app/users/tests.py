@@ -1,10 +1,33 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ideas_app.ideas.models import Idea, TimelineEntry
 from ideas_app.tests import BaseTestCase
-from ideas_app.users.models import Follow
+from ideas_app.users.cache import followees_key, get_followee_ids
+from ideas_app.users.counters import batched_counters, reconcile_counters
+from ideas_app.users.graph import FollowGraph, build, refresh
+from ideas_app.users.models import (AppUser, Follow, FollowGraphChange,
+                                    SuggestedUser)
 
 search_by_username_query = """
-    query searchByUsername($search: String!){
-      searchByUsername(search: $search){
-        username
+    query searchByUsername($search: String!, $first: Int!, $after: String){
+      searchByUsername(search: $search, first: $first, after: $after){
+        edges{
+          node{
+            username
+          }
+        }
+        pageInfo{
+          hasNextPage
+          endCursor
+        }
       }
     }
 """
@@ -15,28 +38,90 @@ class SearchTestCase(BaseTestCase):
     def test_search_by_username_results(self):
         response = self.client.execute(
             search_by_username_query,
-            variables={'search': 'use'}
+            variables={'search': 'use', 'first': 20}
         )
-        content = response.data['searchByUsername']
+        content = response.data['searchByUsername']['edges']
         self.assertNotEqual(len(content), 0)
 
     def test_search_by_username_no_results(self):
         response = self.client.execute(
             search_by_username_query,
-            variables={'search': 'userrrrrrr'}
+            variables={'search': 'userrrrrrr', 'first': 20}
         )
-        content = response.data['searchByUsername']
+        content = response.data['searchByUsername']['edges']
         self.assertEqual(len(content), 0)
 
     def test_search_by_username_contains_search(self):
         search = 'use'
         response = self.client.execute(
             search_by_username_query,
-            variables={'search': search}
+            variables={'search': search, 'first': 20}
         )
-        content = response.data['searchByUsername']
+        content = response.data['searchByUsername']['edges']
         for user in content:
-            self.assertIn(search, user['username'])
+            self.assertIn(search, user['node']['username'])
+
+    def test_search_by_username_prefix_matches_first(self):
+        AppUser.objects.create(username='abuser', email='abuser@email.com')
+        AppUser.objects.create(username='user_z', email='user_z@email.com')
+        response = self.client.execute(
+            search_by_username_query,
+            variables={'search': 'use', 'first': 20}
+        )
+        usernames = [edge['node']['username'] for edge
+                     in response.data['searchByUsername']['edges']]
+        self.assertEqual(usernames[-1], 'abuser')
+        for username in usernames[:-1]:
+            self.assertTrue(username.startswith('use'))
+
+    def test_search_by_username_requires_first(self):
+        response = self.client.execute(
+            '{ searchByUsername(search: "use"){ edges{ node{ username } } } }'
+        )
+        self.assertIsNotNone(response.errors)
+
+    def test_search_by_username_pages(self):
+        for number in range(5):
+            AppUser.objects.create(username=f'page{number}',
+                                   email=f'page{number}@email.com')
+        usernames, after = [], None
+        while True:
+            response = self.client.execute(
+                search_by_username_query,
+                variables={'search': 'page', 'first': 2, 'after': after}
+            )
+            content = response.data['searchByUsername']
+            usernames += [edge['node']['username']
+                          for edge in content['edges']]
+            if not content['pageInfo']['hasNextPage']:
+                break
+            after = content['pageInfo']['endCursor']
+        self.assertEqual(usernames, [f'page{number}' for number in range(5)])
+
+    def test_search_by_username_follows_renames(self):
+        user = AppUser.objects.create(username='renamed',
+                                      email='renamed@email.com')
+        user.username = 'newname'
+        user.save()
+        response = self.client.execute(
+            search_by_username_query,
+            variables={'search': 'newna', 'first': 20}
+        )
+        usernames = [edge['node']['username'] for edge
+                     in response.data['searchByUsername']['edges']]
+        self.assertEqual(usernames, ['newname'])
+
+    def test_search_by_username_loads_only_selected_columns(self):
+        AppUser.objects.create(username='narrow', email='narrow@email.com')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.execute(
+                search_by_username_query,
+                variables={'search': 'narr', 'first': 20}
+            )
+        self.assertIsNone(response.errors)
+        [sql] = [query['sql'] for query in queries
+                 if 'narr' in query['sql']]
+        self.assertNotIn('"users_appuser"."password"', sql)
 
 
 my_followers_query = """
@@ -85,6 +170,40 @@ class MyFollowersTestCase(BaseTestCase):
         self.assertNotEqual(len(content), 0)
 
 
+class MyFollowersBatchingTestCase(BaseTestCase):
+    def count_queries(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.execute(query)
+        self.assertIsNone(response.errors)
+        return len(queries)
+
+    def create_followers(self, start, stop):
+        for index in range(start, stop):
+            follower = AppUser.objects.create(username=f'follower{index}',
+                                              email=f'f{index}@email.com')
+            Follow.objects.create(user=self.logged_user, follower=follower,
+                                  approved=True)
+            Idea.objects.create(text='hola', author=follower)
+
+    def test_followers_cost_fixed_queries(self):
+        self.create_followers(0, 1)
+        one_follower_queries = self.count_queries(my_followers_query)
+        self.create_followers(1, 10)
+        self.assertEqual(self.count_queries(my_followers_query),
+                         one_follower_queries)
+
+    def test_user_reverse_sets_cost_fixed_queries(self):
+        query = """
+            query{
+              users{edges{node{username, ideaSet{text}, user{approved}}}}
+            }
+        """
+        self.create_followers(0, 1)
+        few_users_queries = self.count_queries(query)
+        self.create_followers(1, 10)
+        self.assertEqual(self.count_queries(query), few_users_queries)
+
+
 my_pending_followers_query = """
     query myPendingFollowers{
       myPendingFollowers{
@@ -268,6 +387,53 @@ class FollowUserTestCase(BaseTestCase):
                 follower=self.extra_user).exists()
         )
 
+    def test_approve_follower_fills_timeline(self):
+        follow = Follow.objects.create(user=self.extra_user,
+                                       follower=self.logged_user,
+                                       approved=False)
+        idea = Idea.objects.create(text='hola', author=self.extra_user,
+                                   visibility=Idea.VisibilityOptions.PUBLIC)
+        self.client.authenticate(self.extra_user)
+        self.client.execute(
+            approve_follower_mutation,
+            variables={'followRequestId': follow.id, 'approved': True}
+        )
+        self.assertTrue(
+            TimelineEntry.objects.filter(reader=self.logged_user,
+                                         idea=idea).exists()
+        )
+
+    def test_unfollow_user_empties_timeline(self):
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user,
+                              approved=True)
+        Idea.objects.create(text='hola', author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        self.client.execute(
+            unfollow_user_mutation,
+            variables={'userId': self.extra_user.id}
+        )
+        self.assertFalse(
+            TimelineEntry.objects.filter(reader=self.logged_user).exists()
+        )
+
+    def test_failed_unfollow_keeps_timeline(self):
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user,
+                              approved=True)
+        Idea.objects.create(text='hola', author=self.extra_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        with patch.object(Follow, 'delete',
+                          side_effect=IntegrityError('locked')):
+            response = self.client.execute(
+                unfollow_user_mutation,
+                variables={'userId': self.extra_user.id}
+            )
+        self.assertEqual(response.errors[0].message, 'locked')
+        self.assertTrue(
+            TimelineEntry.objects.filter(reader=self.logged_user).exists()
+        )
+
     def test_approve_follower(self):
         follow = Follow.objects.create(user=self.logged_user,
                                        follower=self.extra_user,
@@ -281,4 +447,352 @@ class FollowUserTestCase(BaseTestCase):
                 id=follow.id).approved
         )
 
+    def test_cannot_approve_follow_request_to_other_user(self):
+        follow = Follow.objects.create(user=self.extra_user,
+                                       follower=self.logged_user,
+                                       approved=False)
+        response = self.client.execute(
+            approve_follower_mutation,
+            variables={'followRequestId': follow.id, 'approved': True}
+        )
+        self.assertEqual(response.errors[0].message,
+                         'Follow matching query does not exist.')
+        self.assertFalse(Follow.objects.get(id=follow.id).approved)
+
+    def test_follow_is_unique(self):
+        Follow.objects.create(user=self.extra_user, follower=self.logged_user)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.extra_user,
+                                  follower=self.logged_user)
+
+
+class FolloweesCacheTestCase(BaseTestCase):
+    def test_followees_are_cached(self):
+        Follow.objects.create(user=self.extra_user, follower=self.logged_user,
+                              approved=True)
+        self.assertEqual(get_followee_ids(self.logged_user.id),
+                         [self.extra_user.id])
+        with self.assertNumQueries(0):
+            get_followee_ids(self.logged_user.id)
+
+    def test_pending_follow_keeps_cache(self):
+        get_followee_ids(self.logged_user.id)
+        Follow.objects.create(user=self.extra_user, follower=self.logged_user)
+        self.assertIsNotNone(cache.get(followees_key(self.logged_user.id)))
+
+    def test_approval_invalidates_cache(self):
+        follow = Follow.objects.create(user=self.extra_user,
+                                       follower=self.logged_user)
+        self.assertEqual(get_followee_ids(self.logged_user.id), [])
+        self.client.authenticate(self.extra_user)
+        self.client.execute(
+            approve_follower_mutation,
+            variables={'followRequestId': follow.id, 'approved': True}
+        )
+        self.assertEqual(get_followee_ids(self.logged_user.id),
+                         [self.extra_user.id])
+
+    def test_unfollow_invalidates_cache(self):
+        Follow.objects.create(user=self.extra_user, follower=self.logged_user,
+                              approved=True)
+        get_followee_ids(self.logged_user.id)
+        self.client.execute(
+            unfollow_user_mutation,
+            variables={'userId': self.extra_user.id}
+        )
+        self.assertEqual(get_followee_ids(self.logged_user.id), [])
+
+
+approve_followers_mutation = """
+    mutation approveFollowers($ids: [String!]!, $approved: Boolean!){
+      approveFollowers(ids: $ids, approved: $approved){
+        results{id, success, errors}
+      }
+    }
+"""
+
+
+class ApproveFollowersTestCase(BaseTestCase):
+    def follow_requests(self, total):
+        AppUser.objects.bulk_create(
+            AppUser(username=f'follower{number}',
+                    email=f'follower{number}@email.com')
+            for number in range(total)
+        )
+        followers = AppUser.objects.filter(username__startswith='follower')
+        return [Follow.objects.create(user=self.logged_user, follower=user)
+                for user in followers]
+
+    def approve(self, ids, approved=True):
+        return self.client.execute(
+            approve_followers_mutation,
+            variables={'ids': [str(follow_id) for follow_id in ids],
+                       'approved': approved}
+        )
+
+    def test_per_item_results(self):
+        follow, = self.follow_requests(1)
+        foreign = Follow.objects.create(user=self.extra_user,
+                                        follower=follow.follower)
+        response = self.approve([follow.id, foreign.id, 'abc'])
+        self.assertEqual(response.data['approveFollowers']['results'], [
+            {'id': str(follow.id), 'success': True, 'errors': []},
+            {'id': str(foreign.id), 'success': False,
+             'errors': ['Follow request not found']},
+            {'id': 'abc', 'success': False,
+             'errors': ['Follow request not found']},
+        ])
+        self.assertTrue(Follow.objects.get(id=follow.id).approved)
+        self.assertFalse(Follow.objects.get(id=foreign.id).approved)
+
+    def test_side_effects_of_approval(self):
+        follow, = self.follow_requests(1)
+        idea = Idea.objects.create(text='hola', author=self.logged_user,
+                                   visibility=Idea.VisibilityOptions.PUBLIC)
+        self.assertEqual(get_followee_ids(follow.follower_id), [])
+        self.approve([follow.id])
+        self.assertEqual(get_followee_ids(follow.follower_id),
+                         [self.logged_user.id])
+        self.assertTrue(TimelineEntry.objects.filter(
+            reader=follow.follower_id, idea=idea).exists())
+
+        self.approve([follow.id], approved=False)
+        self.assertEqual(get_followee_ids(follow.follower_id), [])
+        self.assertFalse(TimelineEntry.objects.filter(
+            reader=follow.follower_id, idea=idea).exists())
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        follows = self.follow_requests(30)
+        Idea.objects.create(text='hola', author=self.logged_user,
+                            visibility=Idea.VisibilityOptions.PUBLIC)
+        with CaptureQueriesContext(connection) as few:
+            self.approve([follow.id for follow in follows[:2]])
+        with CaptureQueriesContext(connection) as many:
+            self.approve([follow.id for follow in follows[2:]])
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(
+            Follow.objects.filter(user=self.logged_user,
+                                  approved=True).count(),
+            30
+        )
+
+
+class FollowGraphTestCase(SimpleTestCase):
+    def setUp(self):
+        self.graph = FollowGraph.from_edges([
+            (1, 2), (1, 3), (2, 4), (2, 5), (3, 1), (3, 4), (5, 1),
+        ])
+
+    def test_csr_rows(self):
+        self.assertEqual(list(self.graph.users), [1, 2, 3, 5])
+        self.assertEqual(list(self.graph.offsets), [0, 2, 4, 6, 7])
+        self.assertEqual(list(self.graph.followees_of(3)), [1, 4])
+        self.assertEqual(list(self.graph.followees_of(4)), [])
+
+    def test_save_and_load(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'follow_graph.bin')
+        self.graph.save(path)
+        self.assertEqual(os.path.getsize(path), 8 * (2 + 4 + 5 + 7))
+        graph = FollowGraph.load(path)
+        self.assertEqual(graph.users, self.graph.users)
+        self.assertEqual(graph.offsets, self.graph.offsets)
+        self.assertEqual(graph.followees, self.graph.followees)
+
+    def test_replace(self):
+        graph = self.graph.replace({2: [], 3: [6, 4], 4: [1]})
+        self.assertEqual(list(graph.users), [1, 3, 4, 5])
+        self.assertEqual(list(graph.followees_of(1)), [2, 3])
+        self.assertEqual(list(graph.followees_of(3)), [4, 6])
+        self.assertEqual(list(graph.followees_of(4)), [1])
+        self.assertEqual(list(graph.followees_of(5)), [1])
+        self.assertEqual(list(graph.offsets), [0, 2, 4, 5, 6])
+
+    def test_suggestions_rank_mutual_followees(self):
+        # 4 is followed by both followees of 1, 5 by one
+        self.assertEqual(self.graph.suggestions(1, 10), [(4, 2), (5, 1)])
+        self.assertEqual(self.graph.suggestions(1, 1), [(4, 2)])
+        self.assertEqual(self.graph.suggestions(4, 10), [])
+
+
+suggested_users_query = """
+    query suggestedUsers($first: Int, $after: String){
+      suggestedUsers(first: $first, after: $after){
+        edges{node{username}}
+        pageInfo{hasNextPage, endCursor}
+      }
+    }
+"""
+
 
+class SuggestedUsersTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'follow_graph.bin')
+        graph_settings = override_settings(
+            FOLLOW_GRAPH={**settings.FOLLOW_GRAPH, 'PATH': path}
+        )
+        graph_settings.enable()
+        self.addCleanup(graph_settings.disable)
+
+        self.users = {
+            name: AppUser.objects.create(username=name,
+                                         email=f'{name}@email.com')
+            for name in ['ana', 'bea', 'carl', 'dan']
+        }
+        self.follow('user', 'author')
+        self.follow('user', 'ana')
+        self.follow('author', 'bea')
+        self.follow('author', 'carl')
+        self.follow('ana', 'carl')
+        self.follow('ana', 'user')
+
+    def user(self, name):
+        if name in self.users:
+            return self.users[name]
+        return AppUser.objects.get(username=name)
+
+    def follow(self, follower, user, approved=True):
+        return Follow.objects.create(follower=self.user(follower),
+                                     user=self.user(user), approved=approved)
+
+    def suggested(self, **variables):
+        response = self.client.execute(suggested_users_query,
+                                       variables=variables)
+        return [edge['node']['username']
+                for edge in response.data['suggestedUsers']['edges']]
+
+    def test_ranked_by_mutual_followees(self):
+        build()
+        self.assertFalse(FollowGraphChange.objects.exists())
+        self.assertEqual(self.suggested(), ['carl', 'bea'])
+
+    def test_paging(self):
+        build()
+        response = self.client.execute(suggested_users_query,
+                                       variables={'first': 1})
+        page = response.data['suggestedUsers']
+        self.assertTrue(page['pageInfo']['hasNextPage'])
+        self.assertEqual(
+            self.suggested(first=1, after=page['pageInfo']['endCursor']),
+            ['bea']
+        )
+
+    def test_skips_users_followed_after_the_build(self):
+        build()
+        self.follow('user', 'carl', approved=False)
+        self.assertEqual(self.suggested(), ['bea'])
+
+    def test_incremental_refresh(self):
+        build()
+        self.follow('user', 'dan')
+        self.follow('dan', 'bea')
+        Follow.objects.filter(follower=self.user('ana'),
+                              user=self.user('carl')).delete()
+        self.assertEqual(
+            set(FollowGraphChange.objects.values_list('follower__username',
+                                                      flat=True)),
+            {'user', 'dan', 'ana'}
+        )
+
+        graph, _ = refresh()
+        self.assertFalse(FollowGraphChange.objects.exists())
+        self.assertEqual(self.suggested(), ['bea', 'carl'])
+
+        # Same as building everything again
+        suggestions = self.all_suggestions()
+        rebuilt, _ = build()
+        self.assertEqual(graph.users, rebuilt.users)
+        self.assertEqual(graph.offsets, rebuilt.offsets)
+        self.assertEqual(graph.followees, rebuilt.followees)
+        self.assertEqual(suggestions, self.all_suggestions())
+
+    def all_suggestions(self):
+        return list(SuggestedUser.objects.order_by(
+            'user', '-mutual', 'suggested'
+        ).values_list('user', 'suggested', 'mutual'))
+
+    def test_refresh_without_graph_builds_it(self):
+        refresh()
+        self.assertEqual(self.suggested(), ['carl', 'bea'])
+
+
+class CountersTestCase(BaseTestCase):
+    def counts(self, user):
+        user.refresh_from_db()
+        return (user.followers_count, user.following_count, user.ideas_count)
+
+    def test_follow_counted_once_approved(self):
+        self.client.execute(follow_user_mutation,
+                            variables={'userId': self.extra_user.id})
+        self.assertEqual(self.counts(self.extra_user), (0, 0, 0))
+        follow = Follow.objects.get()
+        follow.approved = True
+        follow.save()
+        follow.save()
+        self.assertEqual(self.counts(self.extra_user), (1, 0, 0))
+        self.assertEqual(self.counts(self.logged_user), (0, 1, 0))
+
+        self.client.execute(unfollow_user_mutation,
+                            variables={'userId': self.extra_user.id})
+        self.assertEqual(self.counts(self.extra_user), (0, 0, 0))
+        self.assertEqual(self.counts(self.logged_user), (0, 0, 0))
+
+    def test_approve_follower_mutations(self):
+        follow = Follow.objects.create(user=self.logged_user,
+                                       follower=self.extra_user)
+        self.client.execute(approve_follower_mutation, variables={
+            'followRequestId': follow.id, 'approved': True
+        })
+        self.assertEqual(self.counts(self.logged_user), (1, 0, 0))
+        self.client.execute(approve_followers_mutation, variables={
+            'ids': [str(follow.id)], 'approved': False
+        })
+        self.assertEqual(self.counts(self.logged_user), (0, 0, 0))
+        self.assertEqual(self.counts(self.extra_user), (0, 0, 0))
+
+    def test_ideas_counted(self):
+        idea = Idea.objects.create(text='hola', author=self.logged_user)
+        Idea.objects.create_many([
+            Idea(text=f'idea {number}', author=self.logged_user)
+            for number in range(3)
+        ])
+        self.assertEqual(self.counts(self.logged_user), (0, 0, 4))
+        idea.delete()
+        with CaptureQueriesContext(connection) as queries:
+            with batched_counters():
+                Idea.objects.filter(author=self.logged_user).delete()
+        self.assertEqual(self.counts(self.logged_user), (0, 0, 0))
+        self.assertEqual(
+            len([query for query in queries
+                 if query['sql'].startswith('UPDATE')]),
+            1
+        )
+
+    def test_exposed_on_users(self):
+        Idea.objects.create(text='hola', author=self.extra_user)
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user, approved=True)
+        response = self.client.execute("""
+            query{searchByUsername(search: "author", first: 1){
+              edges{node{followersCount, followingCount, ideasCount}}
+            }}
+        """)
+        self.assertEqual(
+            response.data['searchByUsername']['edges'][0]['node'],
+            {'followersCount': 1, 'followingCount': 0, 'ideasCount': 1}
+        )
+
+    def test_reconcile_repairs_drift(self):
+        Follow.objects.create(user=self.extra_user,
+                              follower=self.logged_user, approved=True)
+        Idea.objects.create(text='hola', author=self.logged_user)
+        self.assertEqual(reconcile_counters(), 0)
+
+        AppUser.objects.update(followers_count=7, ideas_count=0)
+        self.assertEqual(reconcile_counters(batch_size=1), 2)
+        self.assertEqual(self.counts(self.extra_user), (1, 0, 0))
+        self.assertEqual(self.counts(self.logged_user), (0, 1, 1))
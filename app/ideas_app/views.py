@@ -0,0 +1,217 @@
+import json
+from contextlib import nullcontext
+from time import perf_counter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.http.response import HttpResponseBadRequest
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
+from graphql.validation.rules import specified_rules
+
+from ideas_app.complexity import QueryCostRule, analyze, report_cost
+from ideas_app.db_router import routed
+from ideas_app.instrumentation import (SQLRecorder, get_operation_name,
+                                       report_sql)
+from ideas_app.persisted_queries import (DocumentCacheBackend,
+                                         PersistedQueries,
+                                         PersistedQueryHashMismatch,
+                                         PersistedQueryNotAllowed,
+                                         PersistedQueryNotFound)
+from ideas_app.response_cache import CachedResponse
+from ideas_app.tracing import phase, start_trace
+
+document_cache_backend = DocumentCacheBackend(
+    size=settings.PERSISTED_QUERIES['DOCUMENT_CACHE_SIZE'],
+    rules=specified_rules + [QueryCostRule]
+)
+
+
+class IdeasGraphQLView(GraphQLView):
+    """
+    GraphQLView with Automatic Persisted Queries, a shared cache of
+    parsed and validated documents, query cost admission control, SQL
+    instrumentation, sampled Apollo tracing and a response cache of read
+    queries with ETags. Queries read from the replicas, see db_router.
+    Anything stored in request.graphql_extensions is returned in the
+    response `extensions`
+    """
+    persisted_queries = None
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('backend', document_cache_backend)
+        super().__init__(**kwargs)
+        if self.persisted_queries is None:
+            IdeasGraphQLView.persisted_queries = (
+                PersistedQueries.from_settings()
+            )
+
+    @staticmethod
+    def get_extensions(request, data):
+        extensions = request.GET.get('extensions') or data.get('extensions')
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(
+                    HttpResponseBadRequest('Extensions are invalid JSON.')
+                )
+        return extensions
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(
+            request, data
+        )
+        if variables and not isinstance(variables, dict):
+            raise HttpError(
+                HttpResponseBadRequest('Variables must be a JSON object.')
+            )
+        try:
+            query = self.persisted_queries.resolve(
+                query, self.get_extensions(request, data)
+            )
+        except PersistedQueryNotFound as error:
+            raise HttpError(HttpResponse(), str(error))
+        except PersistedQueryHashMismatch as error:
+            raise HttpError(HttpResponseBadRequest(), str(error))
+        except PersistedQueryNotAllowed as error:
+            raise HttpError(HttpResponse(status=403), str(error))
+        return query, variables, operation_name, id
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        request.graphql_extensions = {}
+        request.graphql_operation = operation_name or 'unknown'
+        request.graphql_tracer = start_trace() if query else None
+        if not query or not settings.SQL_INSTRUMENTATION['ENABLED']:
+            result = self.execute_within_cost(
+                request, data, query, variables, operation_name,
+                show_graphiql
+            )
+        else:
+            recorder = SQLRecorder()
+            start = perf_counter()
+            with recorder.record():
+                result = self.execute_within_cost(
+                    request, data, query, variables, operation_name,
+                    show_graphiql
+                )
+            report_sql(request, request.graphql_operation, recorder,
+                       (perf_counter() - start) * 1000)
+        if request.graphql_tracer is not None:
+            request.graphql_extensions['tracing'] = (
+                request.graphql_tracer.as_dict()
+            )
+        return result
+
+    def get_middleware(self, request):
+        tracer = getattr(request, 'graphql_tracer', None)
+        if tracer is None:
+            return self.middleware
+        # Last, so each field's time includes the other middlewares
+        return self.middleware + [tracer]
+
+    def execute_within_cost(self, request, data, query, variables,
+                            operation_name, show_graphiql=False):
+        routing = nullcontext()
+        if query:
+            try:
+                document = self.get_backend(request).document_from_string(
+                    self.schema, query, tracer=request.graphql_tracer
+                )
+            except Exception as error:
+                return ExecutionResult(errors=[error], invalid=True)
+            request.graphql_operation = get_operation_name(
+                document.document_ast, operation_name
+            )
+            with phase(request.graphql_tracer, 'validation'):
+                query_cost = analyze(self.schema, document.document_ast,
+                                     operation_name, variables or {})
+            errors = report_cost(query_cost, request.graphql_extensions)
+            if errors:
+                return ExecutionResult(errors=errors, invalid=True)
+            routing = routed(request, document.document_ast, operation_name)
+        with routing:
+            return super().execute_graphql_request(
+                request, data, query, variables, operation_name,
+                show_graphiql
+            )
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        cached = getattr(request, 'cached_response', None)
+        # Responses that were not stored, such as errors, get no ETag: it
+        # would revalidate them as the cached response
+        if cached is not None and (response.status_code == 304
+                                   or cached.stored):
+            response['ETag'] = cached.etag
+            response['X-Cache'] = 'HIT' if cached.hit else 'MISS'
+            # Revalidated on every use and only stored by the client: the
+            # response depends on the viewer
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def cached_response(self, request, query, variables, operation_name):
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query
+            )
+        except Exception:
+            return None
+        return CachedResponse.for_request(request, document, variables,
+                                          operation_name)
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(
+            request, data
+        )
+        cached = None
+        if (settings.RESPONSE_CACHE['ENABLED'] and query and not self.batch
+                and not show_graphiql):
+            cached = request.cached_response = self.cached_response(
+                request, query, variables, operation_name
+            )
+        if cached is not None:
+            # Conditional requests are only answered for GET, per RFC 7232
+            if (request.method == 'GET' and cached.etag in parse_etags(
+                    request.META.get('HTTP_IF_NONE_MATCH', ''))):
+                return '', 304
+            content = cached.get()
+            if content is not None:
+                return content, 200
+
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        if not execution_result:
+            return None, 200
+
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            response['errors'] = [
+                self.format_error(error) for error in execution_result.errors
+            ]
+        if execution_result.invalid:
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        if getattr(request, 'graphql_extensions', None):
+            response['extensions'] = request.graphql_extensions
+        if self.batch:
+            response['id'] = id
+            response['status'] = status_code
+
+        result = self.json_encode(request, response, pretty=show_graphiql)
+        # Debug extensions belong to the request that asked for them, and
+        # a lagging replica's rows would be served to every viewer
+        if (cached is not None and status_code == 200
+                and not execution_result.errors
+                and set(response.get('extensions', {})) <= {'cost'}
+                and request.db_read_alias == DEFAULT_DB_ALIAS):
+            cached.set(result)
+        return result, status_code
@@ -0,0 +1,274 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView, instantiate_middleware
+from graphql import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.execution.middleware import MiddlewareManager
+from graphql.utils.get_operation_ast import get_operation_ast
+
+from ideas_app.async_graphql import run_in_pool
+from ideas_app.auth import authenticate_request
+from ideas_app.complexity import analyze, report_cost
+from ideas_app.persisted_queries import (PersistedQueries,
+                                         PersistedQueryHashMismatch,
+                                         PersistedQueryNotAllowed,
+                                         PersistedQueryNotFound)
+from ideas_app.views import document_cache_backend
+
+
+class WebSocketContext:
+    """
+    Stands for the HttpRequest in resolvers of websocket operations. The
+    JWT comes from the connection_init payload or the Authorization header
+    """
+
+    def __init__(self, scope, loop, authorization=None):
+        self.scope = scope
+        self.loop = loop
+        self.user = AnonymousUser()
+        self.subscriptions = []
+        self.META = {
+            f"HTTP_{name.decode('latin1').upper().replace('-', '_')}":
+                value.decode('latin1')
+            for name, value in scope.get('headers', [])
+        }
+        if authorization:
+            self.META['HTTP_AUTHORIZATION'] = authorization
+        self.COOKIES = {}
+
+
+def format_result(result):
+    payload = {'data': result.data}
+    if result.errors:
+        payload['errors'] = [GraphQLView.format_error(error)
+                             for error in result.errors]
+    if result.extensions:
+        payload['extensions'] = result.extensions
+    return payload
+
+
+class GraphQLWebSocketConnection:
+    """
+    One client of the graphql-ws protocol (subscriptions-transport-ws)
+    """
+
+    def __init__(self, server, scope, receive, send):
+        self.server = server
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.context = None
+        self.operations = {}
+        self.keepalive = None
+
+    async def send_json(self, message):
+        await self.send({'type': 'websocket.send',
+                         'text': json.dumps(message, separators=(',', ':'))})
+
+    async def run(self):
+        try:
+            while True:
+                event = await self.receive()
+                if event['type'] == 'websocket.connect':
+                    await self.send({'type': 'websocket.accept',
+                                     'subprotocol': 'graphql-ws'})
+                elif event['type'] == 'websocket.receive':
+                    if not await self.on_message(event.get('text')):
+                        await self.send({'type': 'websocket.close'})
+                        break
+                elif event['type'] == 'websocket.disconnect':
+                    break
+        finally:
+            for operation_id in list(self.operations):
+                self.stop(operation_id)
+            if self.keepalive:
+                self.keepalive.cancel()
+
+    async def on_message(self, text):
+        try:
+            message = json.loads(text)
+            message_type = message['type']
+        except (TypeError, ValueError, KeyError):
+            await self.send_json({'type': 'connection_error', 'payload': {
+                'message': 'Messages must be JSON objects with a type'
+            }})
+            return True
+
+        operation_id = message.get('id')
+        payload = message.get('payload') or {}
+        if message_type == 'connection_init':
+            await self.init(payload)
+        elif message_type == 'start':
+            if self.context is None:
+                await self.error(operation_id, 'connection_init first')
+            else:
+                await self.start(operation_id, payload)
+        elif message_type == 'stop':
+            self.stop(operation_id)
+            await self.send_json({'type': 'complete', 'id': operation_id})
+        elif message_type == 'connection_terminate':
+            return False
+        return True
+
+    async def init(self, payload):
+        authorization = (payload.get('Authorization')
+                         or payload.get('authorization'))
+        if payload.get('authToken'):
+            authorization = f"JWT {payload['authToken']}"
+        self.context = WebSocketContext(self.scope,
+                                        asyncio.get_running_loop(),
+                                        authorization)
+        if 'HTTP_AUTHORIZATION' in self.context.META:
+            self.context.jwt_user = await run_in_pool(
+                self.server.pool, authenticate_request, self.context
+            )
+            self.context.user = self.context.jwt_user or self.context.user
+        await self.send_json({'type': 'connection_ack'})
+        interval = settings.SUBSCRIPTIONS['KEEPALIVE']
+        if interval and self.keepalive is None:
+            await self.send_json({'type': 'ka'})
+            self.keepalive = asyncio.ensure_future(self.send_keepalive(
+                interval
+            ))
+
+    async def send_keepalive(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            await self.send_json({'type': 'ka'})
+
+    async def error(self, operation_id, message):
+        await self.send_json({'type': 'error', 'id': operation_id,
+                              'payload': {'message': message}})
+
+    async def start(self, operation_id, payload):
+        if operation_id in self.operations:
+            self.stop(operation_id)
+        try:
+            query = self.server.persisted_queries.resolve(
+                payload.get('query'), payload.get('extensions')
+            )
+        except (PersistedQueryNotFound, PersistedQueryHashMismatch,
+                PersistedQueryNotAllowed) as error:
+            await self.error(operation_id, str(error))
+            return
+        if not query:
+            await self.error(operation_id, 'Must provide query string.')
+            return
+        if not isinstance(payload.get('variables') or {}, dict):
+            await self.error(operation_id, 'Variables must be a JSON object')
+            return
+        result = await self.server.execute(self.context, query, payload)
+        if not hasattr(result, 'subscribe'):
+            await self.send_json({'type': 'data', 'id': operation_id,
+                                  'payload': format_result(result)})
+            await self.send_json({'type': 'complete', 'id': operation_id})
+            return
+
+        subscriptions, self.context.subscriptions = (
+            self.context.subscriptions, []
+        )
+        results = []
+        result.subscribe(
+            on_next=results.append,
+            on_error=lambda error: results.append(
+                ExecutionResult(errors=[error])
+            ),
+        )
+        self.operations[operation_id] = [
+            (subscription, asyncio.ensure_future(
+                self.pump(operation_id, subscription, results)
+            ))
+            for subscription in subscriptions
+        ]
+
+    async def pump(self, operation_id, subscription, results):
+        """
+        Sends the subscription's messages one at a time: while the client
+        reads slowly new messages wait, coalesced, in its bounded mailbox
+        """
+        while True:
+            item = await subscription.get()
+            await run_in_pool(self.server.pool, subscription.subject.on_next,
+                              item)
+            while results:
+                await self.send_json({
+                    'type': 'data', 'id': operation_id,
+                    'payload': format_result(results.pop(0)),
+                })
+
+    def stop(self, operation_id):
+        for subscription, task in self.operations.pop(operation_id, []):
+            task.cancel()
+            subscription.close()
+
+
+class GraphQLWebSocketServer:
+    """
+    ASGI app serving GraphQL subscriptions over websockets, persisted
+    queries as in AsyncGraphQLHandler. Resolvers run in the given thread
+    pool, subscription events are published through ideas_app.broker
+    """
+
+    def __init__(self, schema, pool):
+        self.schema = schema
+        self.pool = pool
+        self.persisted_queries = PersistedQueries.from_settings()
+
+    async def __call__(self, scope, receive, send):
+        await GraphQLWebSocketConnection(self, scope, receive, send).run()
+
+    async def execute(self, context, query, payload):
+        try:
+            document = document_cache_backend.document_from_string(
+                self.schema, query
+            )
+        except Exception as error:
+            return ExecutionResult(errors=[error], invalid=True)
+        if document.validation_errors:
+            return ExecutionResult(errors=document.validation_errors,
+                                   invalid=True)
+        operation_name = payload.get('operationName')
+        operation = get_operation_ast(document.document_ast, operation_name)
+        if operation is None:
+            return ExecutionResult(
+                errors=[GraphQLError('Unknown operation')], invalid=True
+            )
+        # Queries and mutations go through /api/
+        if operation.operation != 'subscription':
+            return ExecutionResult(errors=[GraphQLError(
+                'Only subscriptions are served over websockets'
+            )], invalid=True)
+        extensions = {}
+        errors = report_cost(analyze(
+            self.schema, document.document_ast, operation_name,
+            payload.get('variables') or {}
+        ), extensions)
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True,
+                                   extensions=extensions)
+        result = await run_in_pool(
+            self.pool, self.execute_document, context, document.document_ast,
+            payload.get('variables') or {}, operation_name
+        )
+        if not hasattr(result, 'subscribe'):
+            result.extensions.update(extensions)
+        return result
+
+    def execute_document(self, context, document_ast, variables,
+                         operation_name):
+        return execute(
+            self.schema, document_ast,
+            context_value=context,
+            variable_values=variables,
+            operation_name=operation_name,
+            allow_subscriptions=True,
+            # Subscription resolvers must hand their Observable back as is
+            middleware=MiddlewareManager(
+                *instantiate_middleware(graphene_settings.MIDDLEWARE),
+                wrap_in_promise=False
+            ),
+        )